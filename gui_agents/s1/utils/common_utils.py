@@ -1,4 +1,5 @@
 import base64
+import functools
 import io
 import json
 import os
@@ -80,14 +81,15 @@ def calculate_tokens(messages, num_image_token=NUM_IMAGE_TOKEN) -> Tuple[int, in
 
     input_message = messages[:-1]
 
-    input_string = """"""
+    # Counted per message so the memoized counts of unchanged history are reused
+    input_text_tokens = 0
     for message in input_message:
-        input_string += message["content"][0]["text"] + "\n"
+        input_text_tokens += get_input_token_length(
+            message["content"][0]["text"] + "\n"
+        )
         if len(message["content"]) > 1:
             num_input_images += 1
 
-    input_text_tokens = get_input_token_length(input_string)
-
     input_image_tokens = num_image_token * num_input_images
 
     output_tokens = get_input_token_length(output_message["content"][0]["text"])
@@ -785,7 +787,10 @@ def text_cvt_orc_format_paddle(paddle_result):
 
 
 def trim_accessibility_tree(linearized_accessibility_tree, max_tokens):
-    enc = tiktoken.encoding_for_model("gpt-4")
+    # A token spans at least one character, so short trees need no tokenization
+    if len(linearized_accessibility_tree) <= max_tokens:
+        return linearized_accessibility_tree
+    enc = get_encoder()
     tokens = enc.encode(linearized_accessibility_tree)
     if len(tokens) > max_tokens:
         print("MAX TOKEN LENGTH OF ACCESSIBILITY TREE EXCEEDED")
@@ -794,9 +799,14 @@ def trim_accessibility_tree(linearized_accessibility_tree, max_tokens):
     return linearized_accessibility_tree
 
 
+@functools.lru_cache(maxsize=None)
+def get_encoder():
+    return tiktoken.encoding_for_model("gpt-4")
+
+
+@functools.lru_cache(maxsize=4096)
 def get_input_token_length(input_string):
-    enc = tiktoken.encoding_for_model("gpt-4")
-    tokens = enc.encode(input_string)
+    tokens = get_encoder().encode(input_string)
     return len(tokens)
 
 
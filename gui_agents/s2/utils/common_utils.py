@@ -1,3 +1,4 @@
+import functools
 import json
 import re
 from typing import List
@@ -49,14 +50,15 @@ def calculate_tokens(messages, num_image_token=NUM_IMAGE_TOKEN) -> Tuple[int, in
 
     input_message = messages[:-1]
 
-    input_string = """"""
+    # Counted per message so the memoized counts of unchanged history are reused
+    input_text_tokens = 0
     for message in input_message:
-        input_string += message["content"][0]["text"] + "\n"
+        input_text_tokens += get_input_token_length(
+            message["content"][0]["text"] + "\n"
+        )
         if len(message["content"]) > 1:
             num_input_images += 1
 
-    input_text_tokens = get_input_token_length(input_string)
-
     input_image_tokens = num_image_token * num_input_images
 
     output_tokens = get_input_token_length(output_message["content"][0]["text"])
@@ -167,9 +169,14 @@ def parse_single_code_from_string(input_string):
     return codes[0]
 
 
+@functools.lru_cache(maxsize=None)
+def get_encoder():
+    return tiktoken.encoding_for_model("gpt-4")
+
+
+@functools.lru_cache(maxsize=4096)
 def get_input_token_length(input_string):
-    enc = tiktoken.encoding_for_model("gpt-4")
-    tokens = enc.encode(input_string)
+    tokens = get_encoder().encode(input_string)
     return len(tokens)
 
 
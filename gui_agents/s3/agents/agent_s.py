@@ -92,3 +92,15 @@ class AgentS3(UIAgent):
         info = {**{k: v for d in [executor_info or {}] for k, v in d.items()}}
 
         return info, actions
+
+    async def apredict(
+        self, instruction: str, observation: Dict
+    ) -> Tuple[Dict, List[str]]:
+        """Async version of predict"""
+        executor_info, actions = await self.executor.agenerate_next_action(
+            instruction=instruction, obs=observation
+        )
+
+        info = {**{k: v for d in [executor_info or {}] for k, v in d.items()}}
+
+        return info, actions
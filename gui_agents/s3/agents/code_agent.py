@@ -2,7 +2,11 @@ import logging
 from typing import Dict, List, Tuple, Optional
 
 from gui_agents.s3.memory.procedural_memory import PROCEDURAL_MEMORY
-from gui_agents.s3.utils.common_utils import call_llm_safe, split_thinking_response
+from gui_agents.s3.utils.common_utils import (
+    answer_block_complete,
+    call_llm_safe,
+    split_thinking_response,
+)
 from gui_agents.s3.core.mllm import LMMAgent
 
 logger = logging.getLogger("desktopenv.agent")
@@ -108,6 +112,7 @@ class CodeAgent:
         self.agent = LMMAgent(
             engine_params=self.engine_params,
             system_prompt=PROCEDURAL_MEMORY.CODE_AGENT_PROMPT,
+            role="code_agent",
         )
 
     def execute(self, task_instruction: str, screenshot: str, env_controller) -> Dict:
@@ -139,7 +144,12 @@ class CodeAgent:
             logger.info(f"Step {step_count + 1}/{self.budget}")
 
             # Get assistant response (thoughts and code)
-            response = call_llm_safe(self.agent, temperature=1)
+            response = call_llm_safe(
+                self.agent, temperature=1, stop_when=answer_block_complete
+            )
+            if "<answer>" in response and "</answer>" not in response:
+                # The stream was cut as soon as the code block closed
+                response += "\n</answer>"
 
             # Print to terminal for immediate visibility
             print(f"\n🤖 CODING AGENT RESPONSE - Step {step_count + 1}/{self.budget}")
@@ -318,6 +328,7 @@ Keep the summary under 150 words and use clear, factual language.
             summary_agent = LMMAgent(
                 engine_params=self.engine_params,
                 system_prompt=PROCEDURAL_MEMORY.CODE_SUMMARY_AGENT_PROMPT,
+                role="code_agent",
             )
             summary_agent.add_message(summary_prompt, role="user")
             summary = call_llm_safe(summary_agent, temperature=1)
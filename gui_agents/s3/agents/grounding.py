@@ -1,24 +1,38 @@
+import asyncio
+import contextvars
+import hashlib
 import re
-from collections import defaultdict
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from typing import Any, Dict, List, Optional, Tuple
 
-import pytesseract
 from PIL import Image
-from pytesseract import Output
 
 from gui_agents.s3.memory.procedural_memory import PROCEDURAL_MEMORY
 from gui_agents.s3.core.mllm import LMMAgent
-from gui_agents.s3.utils.common_utils import call_llm_safe
+from gui_agents.s3.utils.common_utils import acall_llm_safe, call_llm_safe
+from gui_agents.s3.utils.grounding_cache import GroundingCache
+from gui_agents.s3.utils.incremental_ocr import IncrementalOCR
+from gui_agents.s3.utils.label_resolver import Box, LabelResolver
+from gui_agents.s3.utils.ocr import ParallelOCR, read_words
+from gui_agents.s3.utils.phrase_matcher import match_phrase
+from gui_agents.s3.utils.transcoding import ScreenshotTranscoder, fit_size
 from gui_agents.s3.agents.code_agent import CodeAgent
 import logging
 
 logger = logging.getLogger("desktopenv.agent")
 
+# Screens whose OCR results are kept, a few per step is enough
+OCR_CACHE_SIZE = 8
+
 
 class ACI:
     def __init__(self):
         self.notes: List[str] = []
+        # Code of each action grounded on the current observation, by action code
+        self.grounded_code: Dict[str, str] = {}
 
 
 # Agent action decorator
@@ -178,6 +192,10 @@ set_cell_values(new_cell_values={cell_values}, app_name="{app_name}", sheet_name
 
 # ACI primitives are parameterized by description, and coordinate generation uses a pretrained grounding model
 class OSWorldACI(ACI):
+    # OCR results of recent screens by content hash, see get_ocr_elements
+    _ocr_results: "OrderedDict[bytes, Tuple[str, List]]" = OrderedDict()
+    _ocr_lock = threading.Lock()
+
     def __init__(
         self,
         env,
@@ -205,15 +223,60 @@ class OSWorldACI(ACI):
 
         # Screenshot used during ACI execution
         self.obs = None
+        # Code of each action grounded on the current observation, by action code
+        self.grounded_code = {}
 
         # Configure the visual grounding model responsible for coordinate generation
-        self.grounding_model = LMMAgent(engine_params_for_grounding)
+        self.grounding_model = LMMAgent(engine_params_for_grounding, role="grounding")
         self.engine_params_for_grounding = engine_params_for_grounding
+        # The grounding model can get the screenshot scaled down to its input resolution, the
+        # generation model agents (text span, code agent) in the planner's format; OCR reads the
+        # original
+        self.grounding_transcoder = ScreenshotTranscoder.from_engine_params(
+            engine_params_for_grounding, resize=True
+        )
+        # Coordinate space of the grounding model's answers, that of the image it is sent when
+        # the screenshot is scaled down to fit, else its configured resolution
+        if self.grounding_transcoder.size is not None:
+            self.grounding_space = fit_size(
+                (width, height), self.grounding_transcoder.size
+            )
+        else:
+            self.grounding_space = (
+                engine_params_for_grounding["grounding_width"],
+                engine_params_for_grounding["grounding_height"],
+            )
+        # Opt-in reuse of coordinates across steps for elements that have not moved
+        self.grounding_cache = None
+        if engine_params_for_grounding.get("grounding_cache"):
+            self.grounding_cache = GroundingCache(self.grounding_space)
+
+        self.planner_transcoder = ScreenshotTranscoder.from_engine_params(
+            engine_params_for_generation
+        )
+        # Large screens can be read as bands in parallel processes
+        self.read_words = read_words
+        if engine_params_for_grounding.get("parallel_ocr"):
+            self.read_words = ParallelOCR(
+                engine_params_for_grounding.get("ocr_workers")
+            )
+        # Opt-in OCR of only the regions that changed since the previous screenshot
+        self.incremental_ocr = None
+        if engine_params_for_grounding.get("incremental_ocr"):
+            self.incremental_ocr = IncrementalOCR(self.read_words)
+        # Opt-in grounding of descriptions naming a unique on-screen label from the OCR words
+        self.label_resolver = None
+        if engine_params_for_grounding.get("label_resolver"):
+            self.label_resolver = LabelResolver(
+                engine_params_for_grounding.get("label_audit_rate", 0.0),
+                engine_params_for_grounding.get("label_capitalized", False),
+            )
 
         # Configure text grounding agent
         self.text_span_agent = LMMAgent(
             engine_params=engine_params_for_generation,
             system_prompt=PROCEDURAL_MEMORY.PHRASE_TO_WORD_COORDS_PROMPT,
+            role="text_span",
         )
 
         # Configure code agent
@@ -226,69 +289,185 @@ class OSWorldACI(ACI):
         self.current_task_instruction = None
         self.last_code_agent_result = None
 
-    # Given the state and worker's referring expression, use the grounding model to generate (x,y)
-    def generate_coords(self, ref_expr: str, obs: Dict) -> List[int]:
-
-        # Reset the grounding model state
-        self.grounding_model.reset()
-
+    def _grounding_messages(self, ref_expr: str, obs: Dict) -> List[Dict]:
+        """Build a fresh grounding request, without touching the grounding model's history."""
         # Configure the context, UI-TARS demo does not use system prompt
         prompt = f"Query:{ref_expr}\nOutput only the coordinate of one point in your response.\n"
-        self.grounding_model.add_message(
-            text_content=prompt, image_content=obs["screenshot"], put_text_last=True
-        )
+        return [
+            self.grounding_model.messages[0],
+            self.grounding_model.build_message(
+                text_content=prompt,
+                image_content=self.grounding_transcoder(obs["screenshot"]),
+                role="user",
+                put_text_last=True,
+            ),
+        ]
 
-        # Generate and parse coordinates
-        response = call_llm_safe(self.grounding_model)
+    @staticmethod
+    def _parse_coords(response: str) -> List[int]:
         print("RAW GROUNDING MODEL RESPONSE:", response)
         numericals = re.findall(r"\d+", response)
         assert len(numericals) >= 2
         return [int(numericals[0]), int(numericals[1])]
 
-    # Calls pytesseract to generate word level bounding boxes for text grounding
-    def get_ocr_elements(self, b64_image_data: str) -> Tuple[str, List]:
-        image = Image.open(BytesIO(b64_image_data))
-        image_data = pytesseract.image_to_data(image, output_type=Output.DICT)
+    # Given the state and worker's referring expression, use the grounding model to generate (x,y)
+    def generate_coords(self, ref_expr: str, obs: Dict) -> List[int]:
+        if self.grounding_cache is not None:
+            coords = self.grounding_cache.get(ref_expr, obs["screenshot"])
+            if coords is not None:
+                return coords
+        box = self._resolve_label(ref_expr, obs)
+        if box is not None and not self.label_resolver.should_audit():
+            return self._remember_coords(ref_expr, obs, self._label_coords(box))
+        # Generate and parse coordinates
+        response = call_llm_safe(
+            self.grounding_model, messages=self._grounding_messages(ref_expr, obs)
+        )
+        return self._model_coords(ref_expr, obs, response, box)
 
-        # Clean text by removing leading and trailing spaces and non-alphabetical characters, but keeping punctuation
-        for i, word in enumerate(image_data["text"]):
-            image_data["text"][i] = re.sub(
-                r"^[^a-zA-Z\s.,!?;:\-\+]+|[^a-zA-Z\s.,!?;:\-\+]+$", "", word
+    async def agenerate_coords(self, ref_expr: str, obs: Dict) -> List[int]:
+        """Async version of generate_coords, safe to run concurrently on one screenshot"""
+        if self.grounding_cache is not None:
+            coords = await asyncio.to_thread(
+                self.grounding_cache.get, ref_expr, obs["screenshot"]
             )
+            if coords is not None:
+                return coords
+        box = await asyncio.to_thread(self._resolve_label, ref_expr, obs)
+        if box is not None and not self.label_resolver.should_audit():
+            return self._remember_coords(ref_expr, obs, self._label_coords(box))
+        response = await acall_llm_safe(
+            self.grounding_model, messages=self._grounding_messages(ref_expr, obs)
+        )
+        return self._model_coords(ref_expr, obs, response, box)
+
+    def _resolve_label(self, ref_expr: str, obs: Dict) -> Optional[Box]:
+        """Screen box of the unique on-screen label named by a description, if any."""
+        # OCR is only run for descriptions that name a label
+        if self.label_resolver is None or not self.label_resolver.labels(ref_expr):
+            return None
+        _, ocr_elements = self.get_ocr_elements(obs["screenshot"])
+        return self.label_resolver.resolve(ref_expr, ocr_elements)
+
+    def _label_coords(self, box: Box) -> List[int]:
+        """Center of a label's screen box, in the grounding model's coordinate space."""
+        grounding_width, grounding_height = self.grounding_space
+        return [
+            round((box[0] + box[2]) / 2 * grounding_width / self.width),
+            round((box[1] + box[3]) / 2 * grounding_height / self.height),
+        ]
+
+    def _model_coords(
+        self, ref_expr: str, obs: Dict, response: str, box: Optional[Box]
+    ) -> List[int]:
+        coords = self._parse_coords(response)
+        # An audited label hit is compared with the model, whose answer is kept
+        if box is not None:
+            self.label_resolver.record_audit(box, self.resize_coordinates(coords))
+        return self._remember_coords(ref_expr, obs, coords)
+
+    def _remember_coords(self, ref_expr: str, obs: Dict, coords: List[int]):
+        if self.grounding_cache is not None:
+            self.grounding_cache.put(ref_expr, obs["screenshot"], coords)
+        return coords
+
+    @staticmethod
+    def _run_concurrently(func, args_list: List[Tuple]) -> List:
+        """Call func on each argument tuple in parallel threads, in the caller's context."""
+        if len(args_list) == 1:
+            return [func(*args_list[0])]
+        with ThreadPoolExecutor(
+            max_workers=len(args_list), thread_name_prefix="ground"
+        ) as executor:
+            # Each call runs in a copy of the caller's context so its telemetry is collected
+            futures = [
+                executor.submit(contextvars.copy_context().run, func, *args)
+                for args in args_list
+            ]
+            return [future.result() for future in futures]
+
+    def ground_many(self, descriptions: List[str], obs: Dict) -> List[List[int]]:
+        """Ground several element descriptions on one screenshot with concurrent requests.
+
+        The requests share the screenshot, which comes first in the prompt, so a server with
+        prefix caching encodes it once and the batch takes about the latency of one request.
+
+        Args:
+            descriptions (List[str]): The element descriptions.
+            obs (Dict): The observation containing the screenshot.
+
+        Returns:
+            List[List[int]]: Coordinates in the grounding model's space, in order.
+        """
+        return self._run_concurrently(
+            self.generate_coords, [(description, obs) for description in descriptions]
+        )
+
+    async def aground_many(self, descriptions: List[str], obs: Dict) -> List[List[int]]:
+        """Async version of ground_many"""
+        return list(
+            await asyncio.gather(
+                *(
+                    self.agenerate_coords(description, obs)
+                    for description in descriptions
+                )
+            )
+        )
+
+    def get_ocr_elements(self, b64_image_data: bytes) -> Tuple[str, List]:
+        """OCR table and word elements of a screenshot.
+
+        Results are cached by screenshot content and shared by every ACI in the process, so
+        the start and end phrases of a highlight, validated and then executed, cost one
+        Tesseract pass per distinct screen.
+        """
+        key = hashlib.blake2b(b64_image_data, digest_size=16).digest()
+        with self._ocr_lock:
+            cached = self._ocr_results.get(key)
+            if cached is not None:
+                self._ocr_results.move_to_end(key)
+                return cached
+        result = self._ocr_pass(b64_image_data)
+        with self._ocr_lock:
+            self._ocr_results[key] = result
+            while len(self._ocr_results) > OCR_CACHE_SIZE:
+                self._ocr_results.popitem(last=False)
+        return result
+
+    def _ocr_pass(self, b64_image_data: bytes) -> Tuple[str, List]:
+        image = Image.open(BytesIO(b64_image_data))
+        if self.incremental_ocr is not None:
+            words = self.incremental_ocr(image)
+        else:
+            words = self.read_words(image)
 
         ocr_elements = []
         ocr_table = "Text Table:\nWord id\tText\n"
         # Obtain the <id, text, group number, word number> for each valid element
         grouping_map = defaultdict(list)
-        ocr_id = 0
-        for i in range(len(image_data["text"])):
-            block_num = image_data["block_num"][i]
-            if image_data["text"][i]:
-                grouping_map[block_num].append(image_data["text"][i])
-                ocr_table += f"{ocr_id}\t{image_data['text'][i]}\n"
-                ocr_elements.append(
-                    {
-                        "id": ocr_id,
-                        "text": image_data["text"][i],
-                        "group_num": block_num,
-                        "word_num": len(grouping_map[block_num]),
-                        "left": image_data["left"][i],
-                        "top": image_data["top"][i],
-                        "width": image_data["width"][i],
-                        "height": image_data["height"][i],
-                    }
-                )
-                ocr_id += 1
+        for ocr_id, word in enumerate(words):
+            block_num = word["block_num"]
+            grouping_map[block_num].append(word["text"])
+            ocr_table += f"{ocr_id}\t{word['text']}\n"
+            ocr_elements.append(
+                {
+                    "id": ocr_id,
+                    "text": word["text"],
+                    "group_num": block_num,
+                    "word_num": len(grouping_map[block_num]),
+                    "left": word["left"],
+                    "top": word["top"],
+                    "width": word["width"],
+                    "height": word["height"],
+                }
+            )
 
         return ocr_table, ocr_elements
 
-    # Given the state and worker's text phrase, generate the coords of the first/last word in the phrase
-    def generate_text_coords(
-        self, phrase: str, obs: Dict, alignment: str = ""
-    ) -> List[int]:
-
-        ocr_table, ocr_elements = self.get_ocr_elements(obs["screenshot"])
-
+    def _text_span_messages(
+        self, phrase: str, ocr_table: str, obs: Dict, alignment: str = ""
+    ) -> List[Dict]:
+        """Build a fresh text span request, without touching the text span agent's history."""
         alignment_prompt = ""
         if alignment == "start":
             alignment_prompt = "**Important**: Output the word id of the FIRST word in the provided phrase.\n"
@@ -296,24 +475,32 @@ class OSWorldACI(ACI):
             alignment_prompt = "**Important**: Output the word id of the LAST word in the provided phrase.\n"
 
         # Load LLM prompt
-        self.text_span_agent.reset()
-        self.text_span_agent.add_message(
-            alignment_prompt + "Phrase: " + phrase + "\n" + ocr_table, role="user"
-        )
-        self.text_span_agent.add_message(
-            "Screenshot:\n", image_content=obs["screenshot"], role="user"
-        )
+        return [
+            self.text_span_agent.messages[0],
+            self.text_span_agent.build_message(
+                alignment_prompt + "Phrase: " + phrase + "\n" + ocr_table, role="user"
+            ),
+            self.text_span_agent.build_message(
+                "Screenshot:\n",
+                image_content=self.planner_transcoder(obs["screenshot"]),
+                role="user",
+            ),
+        ]
 
-        # Obtain the target element
-        response = call_llm_safe(self.text_span_agent)
+    @staticmethod
+    def _text_coords_from_response(
+        response: str, ocr_elements: List, alignment: str = ""
+    ) -> List[int]:
         print("TEXT SPAN AGENT RESPONSE:", response)
         numericals = re.findall(r"\d+", response)
         if len(numericals) > 0:
             text_id = int(numericals[-1])
         else:
             text_id = 0
-        elem = ocr_elements[text_id]
+        return OSWorldACI._element_coords(ocr_elements[text_id], alignment)
 
+    @staticmethod
+    def _element_coords(elem: Dict, alignment: str = "") -> List[int]:
         # Compute the element coordinates
         if alignment == "start":
             coords = [elem["left"], elem["top"] + (elem["height"] // 2)]
@@ -326,7 +513,64 @@ class OSWorldACI(ACI):
             ]
         return coords
 
+    # Given the state and worker's text phrase, generate the coords of the first/last word in the phrase
+    def generate_text_coords(
+        self, phrase: str, obs: Dict, alignment: str = ""
+    ) -> List[int]:
+
+        ocr_table, ocr_elements = self.get_ocr_elements(obs["screenshot"])
+        # A phrase found once with confidence needs no model call
+        text_id = match_phrase(phrase, ocr_elements, alignment)
+        if text_id is not None:
+            return self._element_coords(ocr_elements[text_id], alignment)
+
+        # Obtain the target element
+        response = call_llm_safe(
+            self.text_span_agent,
+            messages=self._text_span_messages(phrase, ocr_table, obs, alignment),
+        )
+        return self._text_coords_from_response(response, ocr_elements, alignment)
+
+    async def agenerate_text_coords(
+        self, phrase: str, obs: Dict, alignment: str = ""
+    ) -> List[int]:
+        """Async version of generate_text_coords, OCR runs in a worker thread"""
+        ocr_table, ocr_elements = await asyncio.to_thread(
+            self.get_ocr_elements, obs["screenshot"]
+        )
+        text_id = match_phrase(phrase, ocr_elements, alignment)
+        if text_id is not None:
+            return self._element_coords(ocr_elements[text_id], alignment)
+        response = await acall_llm_safe(
+            self.text_span_agent,
+            messages=self._text_span_messages(phrase, ocr_table, obs, alignment),
+        )
+        return self._text_coords_from_response(response, ocr_elements, alignment)
+
+    def ground_text_many(
+        self, phrases: List[Tuple[str, str]], obs: Dict
+    ) -> List[List[int]]:
+        """Ground several text phrases on one screenshot with one OCR pass and concurrent requests.
+
+        Args:
+            phrases (List[Tuple[str, str]]): (phrase, alignment) pairs, alignment being start,
+                end or empty.
+            obs (Dict): The observation containing the screenshot.
+
+        Returns:
+            List[List[int]]: Screen coordinates, in order.
+        """
+        # OCR once up front rather than racing to run it in every request
+        self.get_ocr_elements(obs["screenshot"])
+        return self._run_concurrently(
+            self.generate_text_coords,
+            [(phrase, obs, alignment) for phrase, alignment in phrases],
+        )
+
     def assign_screenshot(self, obs: Dict):
+        # Groundings only hold for the observation they were made on
+        if obs is not self.obs:
+            self.grounded_code = {}
         self.obs = obs
 
     def set_task_instruction(self, task_instruction: str):
@@ -335,8 +579,7 @@ class OSWorldACI(ACI):
 
     # Resize from grounding model dim into OSWorld dim (1920 * 1080)
     def resize_coordinates(self, coordinates: List[int]) -> List[int]:
-        grounding_width = self.engine_params_for_grounding["grounding_width"]
-        grounding_height = self.engine_params_for_grounding["grounding_height"]
+        grounding_width, grounding_height = self.grounding_space
 
         return [
             round(coordinates[0] * self.width / grounding_width),
@@ -481,8 +724,9 @@ class OSWorldACI(ACI):
             ending_description:str, a very detailed description of where to end the drag action. This description should be at least a full sentence.
             hold_keys:List list of keys to hold while dragging
         """
-        coords1 = self.generate_coords(starting_description, self.obs)
-        coords2 = self.generate_coords(ending_description, self.obs)
+        coords1, coords2 = self.ground_many(
+            [starting_description, ending_description], self.obs
+        )
         x1, y1 = self.resize_coordinates(coords1)
         x2, y2 = self.resize_coordinates(coords2)
 
@@ -510,10 +754,9 @@ class OSWorldACI(ACI):
             ending_phrase:str, the phrase that denotes the end of the text span you want to highlight. If you only want to highlight one word, just pass in that single word.
             button:str, the button to use to highlight the text span. Defaults to "left". Can be "left", "right", or "middle".
         """
-        coords1 = self.generate_text_coords(
-            starting_phrase, self.obs, alignment="start"
+        coords1, coords2 = self.ground_text_many(
+            [(starting_phrase, "start"), (ending_phrase, "end")], self.obs
         )
-        coords2 = self.generate_text_coords(ending_phrase, self.obs, alignment="end")
         x1, y1 = coords1
         x2, y2 = coords2
 
@@ -581,7 +824,9 @@ class OSWorldACI(ACI):
 
             logger.info("Executing code agent...")
             result = self.code_agent.execute(
-                task_to_execute, screenshot, self.env.controller
+                task_to_execute,
+                self.planner_transcoder(screenshot),
+                self.env.controller,
             )
 
             # Store the result for the worker to access
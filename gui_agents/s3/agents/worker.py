@@ -1,18 +1,31 @@
+import asyncio
 from functools import partial
 import logging
 import textwrap
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from gui_agents.s3.agents.grounding import ACI
 from gui_agents.s3.core.module import BaseModule
+from gui_agents.s3.core.retry import CircuitOpenError, is_retryable
+from gui_agents.s3.core.telemetry import collect_llm_calls, summarize_llm_calls
+from gui_agents.s3.core.trajectory import TrajectoryStore
 from gui_agents.s3.memory.procedural_memory import PROCEDURAL_MEMORY
 from gui_agents.s3.utils.common_utils import (
+    acall_llm_formatted,
+    acall_llm_safe,
+    action_block_complete,
     call_llm_safe,
     call_llm_formatted,
     parse_code_from_string,
     split_thinking_response,
     create_pyautogui_code,
 )
+from gui_agents.s3.utils.screen_diff import (
+    DEFAULT_CHANGE_THRESHOLD,
+    ScreenChangeDetector,
+    thumbnail_size,
+)
+from gui_agents.s3.utils.transcoding import ScreenshotTranscoder
 from gui_agents.s3.utils.formatters import (
     SINGLE_ACTION_FORMATTER,
     CODE_VALID_FORMATTER,
@@ -57,6 +70,23 @@ class Worker(BaseModule):
         self.grounding_agent = grounding_agent
         self.max_trajectory_length = max_trajectory_length
         self.enable_reflection = enable_reflection
+        # Generator and reflection see the screenshot in the configured image_format
+        self.screenshot_transcoder = ScreenshotTranscoder.from_engine_params(
+            worker_engine_params
+        )
+        # Screenshots repeating an earlier step are sent in full, as a note or as a thumbnail
+        self.unchanged_screenshots = (
+            worker_engine_params.get("unchanged_screenshots") or "full"
+        )
+        if self.unchanged_screenshots not in ("full", "note", "thumbnail"):
+            raise ValueError(
+                f"unchanged_screenshots must be full, note or thumbnail, got '{self.unchanged_screenshots}'"
+            )
+        self.screen_detector = ScreenChangeDetector(
+            worker_engine_params.get(
+                "unchanged_screen_threshold", DEFAULT_CHANGE_THRESHOLD
+            )
+        )
 
         self.reset()
 
@@ -76,9 +106,13 @@ class Worker(BaseModule):
             type(self.grounding_agent), skipped_actions=skipped_actions
         ).replace("CURRENT_OS", self.platform)
 
-        self.generator_agent = self._create_agent(sys_prompt)
+        self.generator_agent = self._create_agent(
+            sys_prompt, role="generator", trajectory=self._trajectory_store(2)
+        )
         self.reflection_agent = self._create_agent(
-            PROCEDURAL_MEMORY.REFLECTION_ON_TRAJECTORY
+            PROCEDURAL_MEMORY.REFLECTION_ON_TRAJECTORY,
+            role="reflection",
+            trajectory=self._trajectory_store(1),
         )
 
         self.turn_count = 0
@@ -86,41 +120,108 @@ class Worker(BaseModule):
         self.reflections = []
         self.cost_this_turn = 0
         self.screenshot_inputs = []
+        self.screen_detector.reset()
+        # Groundings of a previous task say nothing about this one
+        if getattr(self.grounding_agent, "grounding_cache", None) is not None:
+            self.grounding_agent.grounding_cache.clear()
+        # Note and image standing for this step's screenshot in the histories
+        self.step_screen: Tuple[str, Optional[bytes]] = ("", None)
 
-    def flush_messages(self):
-        """Flush messages based on the model's context limits.
+    def _trajectory_store(self, turn_size: int) -> TrajectoryStore:
+        """History window of an agent based on the model's context limits.
 
-        This method ensures that the agent's message history does not exceed the maximum trajectory length.
+        Long-context models keep all text but only the latest images, other models keep only
+        the latest turns. The window trails one step: the current screenshot is sent on top of
+        the max_trajectory_length kept from earlier steps.
 
-        Side Effects:
-            - Modifies the messages of generator, reflection, and bon_judge agents to fit within the context limits.
+        Args:
+            turn_size (int): Messages added per step, 2 for the generator's [user, assistant]
+                rounds and 1 for the reflector's user messages.
         """
         engine_type = self.engine_params.get("engine_type", "")
-
-        # Flush strategy for long-context models: keep all text, only keep latest images
         if engine_type in ["anthropic", "openai", "gemini"]:
-            max_images = self.max_trajectory_length
-            for agent in [self.generator_agent, self.reflection_agent]:
-                if agent is None:
-                    continue
-                # keep latest k images
-                img_count = 0
-                for i in range(len(agent.messages) - 1, -1, -1):
-                    for j in range(len(agent.messages[i]["content"])):
-                        if "image" in agent.messages[i]["content"][j].get("type", ""):
-                            img_count += 1
-                            if img_count > max_images:
-                                del agent.messages[i]["content"][j]
-
-        # Flush strategy for non-long-context models: drop full turns
-        else:
-            # generator msgs are alternating [user, assistant], so 2 per round
-            if len(self.generator_agent.messages) > 2 * self.max_trajectory_length + 1:
-                self.generator_agent.messages.pop(1)
-                self.generator_agent.messages.pop(1)
-            # reflector msgs are all [(user text, user image)], so 1 per round
-            if len(self.reflection_agent.messages) > self.max_trajectory_length + 1:
-                self.reflection_agent.messages.pop(1)
+            return TrajectoryStore(max_images=self.max_trajectory_length + 1)
+        # The generator's current round is incomplete until it answers and sits on top of the
+        # window, the reflector's current message is a complete turn and counts in it
+        max_turns = self.max_trajectory_length + (1 if turn_size == 1 else 0)
+        return TrajectoryStore(max_turns=max_turns, turn_size=turn_size)
+
+    def _observe_screen(self, screenshot: bytes) -> Tuple[str, Optional[bytes]]:
+        """The note and image to send for this step's screenshot.
+
+        A screenshot matching the last one sent in full is replaced by a note pointing to that
+        step, with a thumbnail or no image at all. The full frame is sent again once the matched
+        one may have left the history window.
+
+        Args:
+            screenshot (bytes): The observation screenshot.
+
+        Returns:
+            Tuple[str, Optional[bytes]]: A note for the message text, empty when the screen
+                changed, and the image to attach.
+        """
+        if self.unchanged_screenshots == "full":
+            return "", self.screenshot_transcoder(screenshot)
+        since = self.screen_detector.observe(
+            screenshot, self.turn_count, max_age=self.max_trajectory_length
+        )
+        if since is None:
+            return "", self.screenshot_transcoder(screenshot)
+
+        note = f"The screen is unchanged since step {since + 1}, whose screenshot is shown above.\n"
+        if self.unchanged_screenshots == "note":
+            return note, None
+        thumbnail = ScreenshotTranscoder(
+            size=thumbnail_size(screenshot),
+            image_format=self.screenshot_transcoder.image_format,
+            quality=self.screenshot_transcoder.quality,
+        )
+        return note, thumbnail(screenshot)
+
+    def _load_reflection_context(self, instruction: str, obs: Dict) -> bool:
+        """
+        Load the current observation into the reflection agent's history.
+
+        Args:
+            instruction (str): The task instruction.
+            obs (Dict): The current observation containing the screenshot.
+
+        Returns:
+            bool: Whether a reflection should be generated this turn (turn_count > 0).
+        """
+        if not self.enable_reflection:
+            return False
+        note, image = self.step_screen
+        # Load the initial message
+        if self.turn_count == 0:
+            text_content = textwrap.dedent(f"""
+                Task Description: {instruction}
+                Current Trajectory below:
+                """)
+            updated_sys_prompt = (
+                self.reflection_agent.system_prompt + "\n" + text_content
+            )
+            self.reflection_agent.add_system_prompt(updated_sys_prompt)
+            self.reflection_agent.add_message(
+                text_content="The initial screen is provided. No action has been taken yet.",
+                image_content=image,
+                role="user",
+            )
+            return False
+        # Load the latest action
+        self.reflection_agent.add_message(
+            text_content=self.worker_history[-1] + ("\n" + note if note else ""),
+            image_content=image,
+            role="user",
+        )
+        return True
+
+    def _parse_reflection(self, full_reflection: str) -> Tuple[str, str]:
+        reflection, reflection_thoughts = split_thinking_response(full_reflection)
+        self.reflections.append(reflection)
+        logger.info("REFLECTION THOUGHTS: %s", reflection_thoughts)
+        logger.info("REFLECTION: %s", reflection)
+        return reflection, reflection_thoughts
 
     def _generate_reflection(self, instruction: str, obs: Dict) -> Tuple[str, str]:
         """
@@ -137,57 +238,33 @@ class Worker(BaseModule):
             - Updates reflection agent's history
             - Generates reflection response with API call
         """
-        reflection = None
-        reflection_thoughts = None
-        if self.enable_reflection:
-            # Load the initial message
-            if self.turn_count == 0:
-                text_content = textwrap.dedent(f"""
-                    Task Description: {instruction}
-                    Current Trajectory below:
-                    """)
-                updated_sys_prompt = (
-                    self.reflection_agent.system_prompt + "\n" + text_content
-                )
-                self.reflection_agent.add_system_prompt(updated_sys_prompt)
-                self.reflection_agent.add_message(
-                    text_content="The initial screen is provided. No action has been taken yet.",
-                    image_content=obs["screenshot"],
-                    role="user",
-                )
-            # Load the latest action
-            else:
-                self.reflection_agent.add_message(
-                    text_content=self.worker_history[-1],
-                    image_content=obs["screenshot"],
-                    role="user",
-                )
-                full_reflection = call_llm_safe(
-                    self.reflection_agent,
-                    temperature=self.temperature,
-                    use_thinking=self.use_thinking,
-                )
-                reflection, reflection_thoughts = split_thinking_response(
-                    full_reflection
-                )
-                self.reflections.append(reflection)
-                logger.info("REFLECTION THOUGHTS: %s", reflection_thoughts)
-                logger.info("REFLECTION: %s", reflection)
-        return reflection, reflection_thoughts
-
-    def generate_next_action(self, instruction: str, obs: Dict) -> Tuple[Dict, List]:
-        """
-        Predict the next action(s) based on the current observation.
-        """
+        if not self._load_reflection_context(instruction, obs):
+            return None, None
+        full_reflection = call_llm_safe(
+            self.reflection_agent,
+            temperature=self.temperature,
+            use_thinking=self.use_thinking,
+        )
+        return self._parse_reflection(full_reflection)
+
+    async def _agenerate_reflection(
+        self, instruction: str, obs: Dict
+    ) -> Tuple[str, str]:
+        """Async version of _generate_reflection"""
+        if not self._load_reflection_context(instruction, obs):
+            return None, None
+        full_reflection = await acall_llm_safe(
+            self.reflection_agent,
+            temperature=self.temperature,
+            use_thinking=self.use_thinking,
+        )
+        return self._parse_reflection(full_reflection)
 
+    def _start_step(self, instruction: str, obs: Dict):
+        """Point the grounding agent at the new observation and load the task on the first turn."""
         self.grounding_agent.assign_screenshot(obs)
         self.grounding_agent.set_task_instruction(instruction)
-
-        generator_message = (
-            ""
-            if self.turn_count > 0
-            else "The initial screen is provided. No action has been taken yet."
-        )
+        self.step_screen = self._observe_screen(obs["screenshot"])
 
         # Load the task into the system prompt
         if self.turn_count == 0:
@@ -196,8 +273,17 @@ class Worker(BaseModule):
             )
             self.generator_agent.add_system_prompt(prompt_with_instructions)
 
-        # Get the per-step reflection
-        reflection, reflection_thoughts = self._generate_reflection(instruction, obs)
+    def _add_generator_message(self, obs: Dict, reflection: str):
+        """Build the generator's user message for this turn and add it to its history."""
+        generator_message = (
+            ""
+            if self.turn_count > 0
+            else "The initial screen is provided. No action has been taken yet."
+        )
+
+        note, image = self.step_screen
+        generator_message += note
+
         if reflection:
             generator_message += f"REFLECTION: You may use this reflection on the previous action and overall trajectory:\n{reflection}\n"
 
@@ -303,20 +389,21 @@ class Worker(BaseModule):
 
         # Finalize the generator message
         self.generator_agent.add_message(
-            generator_message, image_content=obs["screenshot"], role="user"
+            generator_message,
+            image_content=image,
+            role="user",
         )
 
-        # Generate the plan and next action
-        format_checkers = [
+    def _format_checkers(self, obs: Dict) -> List:
+        return [
             SINGLE_ACTION_FORMATTER,
             partial(CODE_VALID_FORMATTER, self.grounding_agent, obs),
         ]
-        plan = call_llm_formatted(
-            self.generator_agent,
-            format_checkers,
-            temperature=self.temperature,
-            use_thinking=self.use_thinking,
-        )
+
+    def _finish_step(
+        self, plan: str, obs: Dict, reflection: str, reflection_thoughts: str
+    ) -> Tuple[Dict, List]:
+        """Record the plan, ground its action into executable code and flush the histories."""
         self.worker_history.append(plan)
         self.generator_agent.add_message(plan, role="assistant")
         logger.info("PLAN:\n %s", plan)
@@ -327,6 +414,9 @@ class Worker(BaseModule):
             assert plan_code, "Plan code should not be empty"
             exec_code = create_pyautogui_code(self.grounding_agent, plan_code, obs)
         except Exception as e:
+            if isinstance(e, CircuitOpenError) or is_retryable(e):
+                # Let the runner requeue the task rather than skip a turn
+                raise
             logger.error(
                 f"Could not evaluate the following plan code:\n{plan_code}\nError: {e}"
             )
@@ -348,6 +438,71 @@ class Worker(BaseModule):
             ),
         }
         self.turn_count += 1
-        self.screenshot_inputs.append(obs["screenshot"])
-        self.flush_messages()
+        # A repeated frame is kept as the reference screenshot it matched
+        self.screenshot_inputs.append(
+            obs["screenshot"]
+            if self.step_screen[0] == ""
+            else self.screen_detector.reference
+        )
         return executor_info, [exec_code]
+
+    def generate_next_action(self, instruction: str, obs: Dict) -> Tuple[Dict, List]:
+        """
+        Predict the next action(s) based on the current observation.
+        """
+        with collect_llm_calls() as llm_calls:
+            self._start_step(instruction, obs)
+
+            # Get the per-step reflection
+            reflection, reflection_thoughts = self._generate_reflection(
+                instruction, obs
+            )
+            self._add_generator_message(obs, reflection)
+
+            # Generate the plan and next action
+            plan = call_llm_formatted(
+                self.generator_agent,
+                self._format_checkers(obs),
+                temperature=self.temperature,
+                use_thinking=self.use_thinking,
+                stop_when=action_block_complete,
+            )
+            executor_info, actions = self._finish_step(
+                plan, obs, reflection, reflection_thoughts
+            )
+        self._add_llm_telemetry(executor_info, llm_calls)
+        return executor_info, actions
+
+    async def agenerate_next_action(
+        self, instruction: str, obs: Dict
+    ) -> Tuple[Dict, List]:
+        """
+        Async version of generate_next_action, so one event loop can drive many environments.
+        """
+        with collect_llm_calls() as llm_calls:
+            self._start_step(instruction, obs)
+
+            reflection, reflection_thoughts = await self._agenerate_reflection(
+                instruction, obs
+            )
+            self._add_generator_message(obs, reflection)
+
+            plan = await acall_llm_formatted(
+                self.generator_agent,
+                self._format_checkers(obs),
+                temperature=self.temperature,
+                use_thinking=self.use_thinking,
+                stop_when=action_block_complete,
+            )
+            # Grounding the action still goes through the synchronous ACI
+            executor_info, actions = await asyncio.to_thread(
+                self._finish_step, plan, obs, reflection, reflection_thoughts
+            )
+        self._add_llm_telemetry(executor_info, llm_calls)
+        return executor_info, actions
+
+    @staticmethod
+    def _add_llm_telemetry(executor_info: Dict, llm_calls: List[Dict]):
+        """Attach the step's LLM call records and their per-role totals to the executor info."""
+        executor_info["llm_calls"] = llm_calls
+        executor_info["llm_usage"] = summarize_llm_calls(llm_calls)
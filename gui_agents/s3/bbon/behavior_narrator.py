@@ -18,7 +18,7 @@ import numpy as np
 
 class BehaviorNarrator:
     def __init__(self, engine_params):
-        self.judge_agent = LMMAgent(engine_params=engine_params)
+        self.judge_agent = LMMAgent(engine_params=engine_params, role="judge")
 
     @staticmethod
     def extract_mouse_action(action: str) -> list[str]:
@@ -61,7 +61,7 @@ def image_to_openai_message_format(
 
 class ComparativeJudge:
     def __init__(self, engine_params):
-        self.judge_agent = LMMAgent(engine_params=engine_params)
+        self.judge_agent = LMMAgent(engine_params=engine_params, role="judge")
 
     def judge(
         self,
@@ -315,6 +315,18 @@ def main():
         default=False,
         help="Enable local coding environment for code execution (WARNING: Executes arbitrary code locally)",
     )
+    parser.add_argument(
+        "--parallel_ocr",
+        action="store_true",
+        default=False,
+        help="Run OCR on horizontal bands of the screenshot in a pool of processes, for high-resolution screens",
+    )
+    parser.add_argument(
+        "--ground_incremental_ocr",
+        action="store_true",
+        default=False,
+        help="Run OCR only on the regions that changed since the previous screenshot instead of on the whole screen",
+    )
     parser.add_argument(
         "--task",
         type=str,
@@ -346,6 +358,8 @@ def main():
         "api_key": args.ground_api_key,
         "grounding_width": args.grounding_width,
         "grounding_height": args.grounding_height,
+        "parallel_ocr": args.parallel_ocr,
+        "incremental_ocr": args.ground_incremental_ocr,
     }
 
     # Initialize environment based on user preference
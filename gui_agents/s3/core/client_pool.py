@@ -0,0 +1,120 @@
+"""Process-wide pool of API clients, so engines pointing at the same endpoint share warm connections."""
+
+import asyncio
+import importlib.util
+import logging
+import os
+import threading
+import weakref
+from typing import Dict, Optional
+
+import httpx
+
+logger = logging.getLogger("desktopenv.agent")
+
+# HTTP/2 needs the optional h2 package (pip install "httpx[http2]")
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Connection limits shared by every pooled client, AGENT_S_HTTP_* variables override them
+_pool_settings = {
+    "max_connections": int(os.getenv("AGENT_S_HTTP_MAX_CONNECTIONS", "100")),
+    "max_keepalive_connections": int(os.getenv("AGENT_S_HTTP_MAX_KEEPALIVE", "20")),
+    "keepalive_expiry": float(os.getenv("AGENT_S_HTTP_KEEPALIVE_EXPIRY", "120")),
+    "http2": os.getenv("AGENT_S_HTTP2", "1") != "0",
+}
+
+# Matches the default request timeout of the openai and anthropic SDKs
+DEFAULT_TIMEOUT = httpx.Timeout(timeout=600.0, connect=10.0)
+
+_clients: Dict[tuple, object] = {}
+# Async clients are bound to the event loop their connections were opened on
+_async_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def configure_client_pool(
+    max_connections: Optional[int] = None,
+    max_keepalive_connections: Optional[int] = None,
+    keepalive_expiry: Optional[float] = None,
+    http2: Optional[bool] = None,
+):
+    """Tune the connection pool of clients created from now on.
+
+    Args:
+        max_connections (int): Maximum concurrent connections per client.
+        max_keepalive_connections (int): Idle connections kept open per client.
+        keepalive_expiry (float): Seconds an idle connection is kept open.
+        http2 (bool): Whether to negotiate HTTP/2 when the h2 package is installed.
+    """
+    overrides = {
+        "max_connections": max_connections,
+        "max_keepalive_connections": max_keepalive_connections,
+        "keepalive_expiry": keepalive_expiry,
+        "http2": http2,
+    }
+    _pool_settings.update({k: v for k, v in overrides.items() if v is not None})
+
+
+def _http_client_params() -> Dict:
+    return dict(
+        http2=_pool_settings["http2"] and HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=_pool_settings["max_connections"],
+            max_keepalive_connections=_pool_settings["max_keepalive_connections"],
+            keepalive_expiry=_pool_settings["keepalive_expiry"],
+        ),
+        timeout=DEFAULT_TIMEOUT,
+        follow_redirects=True,
+    )
+
+
+def _sdk_params(client_params: Dict) -> Dict:
+    # The engines' retry layer (see retry.py) owns retries, the SDKs' own would stack under it
+    return {"max_retries": 0, **client_params}
+
+
+def _registry_key(client_class, client_params: Dict) -> tuple:
+    # Covers provider (the client class), base_url, api_key and any other constructor argument
+    return (client_class, tuple(sorted((k, str(v)) for k, v in client_params.items())))
+
+
+def get_client(client_class, **client_params):
+    """Return the shared synchronous client for these constructor arguments.
+
+    Args:
+        client_class: The SDK client class, e.g. OpenAI, AzureOpenAI or Anthropic.
+        **client_params: Keyword arguments of the client constructor.
+
+    Returns:
+        The client, created with a keep-alive httpx pool on first use.
+    """
+    key = _registry_key(client_class, client_params)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = client_class(
+                http_client=httpx.Client(**_http_client_params()),
+                **_sdk_params(client_params),
+            )
+        return _clients[key]
+
+
+def get_async_client(client_class, **client_params):
+    """Async counterpart of get_client, must be called from a running event loop.
+
+    Args:
+        client_class: The SDK client class, e.g. AsyncOpenAI or AsyncAnthropic.
+        **client_params: Keyword arguments of the client constructor.
+
+    Returns:
+        The client shared by every engine on the current event loop.
+    """
+    loop = asyncio.get_running_loop()
+    key = _registry_key(client_class, client_params)
+    with _clients_lock:
+        loop_clients = _async_clients.setdefault(loop, {})
+        if key not in loop_clients:
+            loop_clients[key] = client_class(
+                http_client=httpx.AsyncClient(**_http_client_params()),
+                **_sdk_params(client_params),
+            )
+        return loop_clients[key]
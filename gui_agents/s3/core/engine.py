@@ -1,28 +1,364 @@
+import asyncio
+import logging
 import os
+import time
+from types import SimpleNamespace
+from typing import Dict
 
-import backoff
-from anthropic import Anthropic
+from anthropic import Anthropic, AsyncAnthropic, AsyncStream as AsyncMessageStream
+from anthropic import Stream as MessageStream
+from anthropic.types import Message, RawMessageStreamEvent
 from openai import (
-    AzureOpenAI,
-    APIConnectionError,
-    APIError,
+    AsyncAzureOpenAI,
+    AsyncOpenAI,
+    AsyncStream,
     AzureOpenAI,
     OpenAI,
-    RateLimitError,
+    Stream,
+)
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from gui_agents.s3.core.client_pool import get_async_client, get_client
+from gui_agents.s3.core.rate_limiter import (
+    CHARS_PER_TOKEN,
+    estimate_tokens,
+    get_rate_limiter,
+)
+from gui_agents.s3.core.replay import ReplayScript
+from gui_agents.s3.core.retry import (
+    get_circuit_breaker,
+    request_timeout,
+    with_retries,
 )
+from gui_agents.s3.core.telemetry import (
+    annotate_call,
+    record_first_token,
+    record_usage,
+)
+
+logger = logging.getLogger("desktopenv.agent")
 
 
 class LMMEngine:
-    pass
+    """Base class for LMM engines, holds the request-level plumbing shared by every provider."""
+
+    provider = "default"
+    # Set by LMMAgent to send pre-serialized bodies that reuse the bytes of the stable prefix
+    request_serializer = None
+
+    def _raw_body_unsupported(self, error):
+        """Fall back to the SDK's create method when it cannot post a pre-serialized body."""
+        logger.warning(
+            "The installed %s SDK cannot post serialized request bodies (%s), "
+            "sending requests through its create method instead",
+            self.provider,
+            error,
+        )
+        self.request_serializer = None
+
+    def _init_rate_limiter(self, rate_limit=-1, tokens_per_minute=-1):
+        """Store the per-minute budgets, the limiter itself is created on first request."""
+        self.rate_limit = rate_limit
+        self.tokens_per_minute = tokens_per_minute
+        self.request_interval = 0 if rate_limit == -1 else 60.0 / rate_limit
+        self.rate_limiter = None
+
+    def _get_rate_limiter(self, base_url=None):
+        if self.rate_limiter is None:
+            self.rate_limiter = get_rate_limiter(
+                self.provider,
+                base_url or getattr(self, "base_url", None),
+                getattr(self, "model", None),
+                requests_per_minute=self.rate_limit,
+                tokens_per_minute=self.tokens_per_minute,
+            )
+        return self.rate_limiter
+
+    def _throttle(self, messages, max_new_tokens=None, base_url=None):
+        """Block until the limiter shared by all processes on this endpoint admits the request.
+
+        Returns:
+            int: The token estimate charged to the limiter, to be settled by _record_usage.
+        """
+        estimate = estimate_tokens(messages) + (max_new_tokens or 0)
+        self._get_rate_limiter(base_url).acquire(tokens=estimate)
+        return estimate
+
+    async def _athrottle(self, messages, max_new_tokens=None, base_url=None):
+        """Async version of _throttle"""
+        estimate = estimate_tokens(messages) + (max_new_tokens or 0)
+        await self._get_rate_limiter(base_url).aacquire(tokens=estimate)
+        return estimate
+
+    def circuit_breaker(self):
+        """The breaker of the endpoint this engine calls, shared with other engines on it"""
+        return get_circuit_breaker(
+            self.provider,
+            getattr(self, "base_url", None) or getattr(self, "azure_endpoint", None),
+        )
+
+    def _get_async_client(self, client_class, **client_params):
+        """The async client for the running event loop, shared with every engine on the same endpoint"""
+        if self.allm_client:
+            return self.allm_client
+        return get_async_client(client_class, **client_params)
+
+    def _record_usage(self, estimate, usage):
+        """Report the actual token usage and settle its difference with the estimate."""
+        record_usage(usage)
+        if self.rate_limiter is None or usage is None:
+            return
+        used_tokens = getattr(usage, "total_tokens", None)
+        if used_tokens is None:
+            # Anthropic reports input and output tokens separately
+            used_tokens = (getattr(usage, "input_tokens", 0) or 0) + (
+                getattr(usage, "output_tokens", 0) or 0
+            )
+        self.rate_limiter.adjust(used_tokens - estimate)
+
+    def _record_stream_usage(self, estimate, max_new_tokens, buffer):
+        """Report the usage of a streamed call once its stream is closed.
+
+        Providers send the usage with the end of the stream. A stream dropped early, or served
+        without usage, has its prompt and generated tokens estimated instead.
+        """
+        usage = buffer.usage
+        prompt_tokens = _first_reported(usage, "prompt_tokens", "input_tokens")
+        completion_tokens = _first_reported(usage, "completion_tokens", "output_tokens")
+        if buffer.stopped or prompt_tokens is None or completion_tokens is None:
+            annotate_call(usage_estimated=True)
+            if prompt_tokens is None:
+                prompt_tokens = estimate - (max_new_tokens or 0)
+            generated = estimate_tokens(
+                [{"content": buffer.thinking}, {"content": buffer.text}]
+            )
+            completion_tokens = max(completion_tokens or 0, generated)
+            buffer.add_usage(
+                SimpleNamespace(
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=completion_tokens,
+                    total_tokens=prompt_tokens + completion_tokens,
+                )
+            )
+        self._record_usage(estimate, buffer.usage)
+
+
+def _timeout():
+    """Request options carrying the configured per-attempt timeout, if any."""
+    timeout = request_timeout()
+    return {} if timeout is None else {"timeout": timeout}
+
+
+def _first_reported(usage, *names):
+    for name in names:
+        value = getattr(usage, name, None)
+        if value is not None:
+            return value
+    return None
 
 
-class LMMEngineOpenAI(LMMEngine):
+# Usage fields kept when a streamed call reports its usage in parts
+USAGE_FIELDS = (
+    "prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+    "prompt_tokens_details",
+    "input_tokens",
+    "output_tokens",
+    "cache_read_input_tokens",
+    "cache_creation_input_tokens",
+)
+
+
+class StreamBuffer:
+    """Accumulates a streamed response and tells the reader when to stop early."""
+
+    def __init__(self, stop_when=None):
+        """
+        Args:
+            stop_when: Callable[[str], bool]
+                Called with the answer text received so far, returning True once it holds
+                everything the caller needs
+        """
+        self.stop_when = stop_when
+        self.text = ""
+        self.thinking = ""
+        self.stopped = False
+        self.usage = None
+
+    def add(self, text="", thinking="") -> bool:
+        """Append streamed deltas.
+
+        Returns:
+            bool: True once the rest of the stream can be dropped.
+        """
+        if (text or thinking) and not (self.text or self.thinking):
+            record_first_token()
+        self.thinking += thinking
+        if text:
+            self.text += text
+            if self.stop_when is not None and self.stop_when(self.text):
+                self.stopped = True
+        return self.stopped
+
+    def add_usage(self, usage):
+        """Merge reported usage, later parts overriding the fields they carry."""
+        if usage is None:
+            return
+        if self.usage is None:
+            self.usage = SimpleNamespace()
+        for name in USAGE_FIELDS:
+            value = getattr(usage, name, None)
+            if value is not None:
+                setattr(self.usage, name, value)
+
+
+class ChatCompletionsEngine(LMMEngine):
+    """Base class for engines served through an OpenAI-compatible chat completions API.
+
+    Subclasses only describe how to build the client and the request, the sync and async
+    generation paths are shared.
+    """
+
+    client_class = OpenAI
+    async_client_class = AsyncOpenAI
+
+    def _client_params(self) -> Dict:
+        """Resolve the keyword arguments of the client constructor, validating credentials."""
+        raise NotImplementedError
+
+    def _completion_params(
+        self, messages, temperature=0.0, max_new_tokens=None, **kwargs
+    ) -> Dict:
+        """Build the keyword arguments of chat.completions.create."""
+        raise NotImplementedError
+
+    def _on_completion(self, completion):
+        """Hook called with every successful completion."""
+        pass
+
+    @staticmethod
+    def _endpoint(client_params):
+        return client_params.get("base_url") or client_params.get("azure_endpoint")
+
+    def _create(self, client, params, stream=False):
+        """chat.completions.create, or a raw POST of the incrementally serialized body"""
+        if stream:
+            params = {
+                **params,
+                "stream": True,
+                "stream_options": {"include_usage": True},
+            }
+        if self.request_serializer is not None:
+            try:
+                return client.post(
+                    "/chat/completions",
+                    body=self.request_serializer.serialize(params),
+                    cast_to=ChatCompletion,
+                    options=_timeout(),
+                    stream=stream,
+                    stream_cls=Stream[ChatCompletionChunk],
+                )
+            except TypeError as e:
+                # Raised while building the request, before anything is sent
+                self._raw_body_unsupported(e)
+        return client.chat.completions.create(**params, **_timeout())
+
+    async def _acreate(self, client, params, stream=False):
+        """Async version of _create"""
+        if stream:
+            params = {
+                **params,
+                "stream": True,
+                "stream_options": {"include_usage": True},
+            }
+        if self.request_serializer is not None:
+            try:
+                return await client.post(
+                    "/chat/completions",
+                    body=self.request_serializer.serialize(params),
+                    cast_to=ChatCompletion,
+                    options=_timeout(),
+                    stream=stream,
+                    stream_cls=AsyncStream[ChatCompletionChunk],
+                )
+            except TypeError as e:
+                self._raw_body_unsupported(e)
+        return await client.chat.completions.create(**params, **_timeout())
+
+    @with_retries
+    def generate(
+        self, messages, temperature=0.0, max_new_tokens=None, stop_when=None, **kwargs
+    ):
+        """Generate the next message, streaming it and dropping the rest once stop_when accepts the text"""
+        client_params = self._client_params()
+        if not self.llm_client:
+            self.llm_client = get_client(self.client_class, **client_params)
+        params = self._completion_params(
+            messages, temperature=temperature, max_new_tokens=max_new_tokens, **kwargs
+        )
+        estimate = self._throttle(
+            messages, params.get("max_tokens"), self._endpoint(client_params)
+        )
+        if stop_when is not None:
+            buffer = StreamBuffer(stop_when)
+            stream = self._create(self.llm_client, params, stream=True)
+            try:
+                for chunk in stream:
+                    # The usage comes in a last chunk without choices
+                    buffer.add_usage(getattr(chunk, "usage", None))
+                    if chunk.choices and buffer.add(chunk.choices[0].delta.content):
+                        break
+            finally:
+                stream.close()
+            self._record_stream_usage(estimate, params.get("max_tokens"), buffer)
+            return buffer.text
+        completion = self._create(self.llm_client, params)
+        self._record_usage(estimate, completion.usage)
+        self._on_completion(completion)
+        return completion.choices[0].message.content
+
+    @with_retries
+    async def agenerate(
+        self, messages, temperature=0.0, max_new_tokens=None, stop_when=None, **kwargs
+    ):
+        """Async version of generate"""
+        client_params = self._client_params()
+        allm_client = self._get_async_client(self.async_client_class, **client_params)
+        params = self._completion_params(
+            messages, temperature=temperature, max_new_tokens=max_new_tokens, **kwargs
+        )
+        estimate = await self._athrottle(
+            messages, params.get("max_tokens"), self._endpoint(client_params)
+        )
+        if stop_when is not None:
+            buffer = StreamBuffer(stop_when)
+            stream = await self._acreate(allm_client, params, stream=True)
+            try:
+                async for chunk in stream:
+                    buffer.add_usage(getattr(chunk, "usage", None))
+                    if chunk.choices and buffer.add(chunk.choices[0].delta.content):
+                        break
+            finally:
+                await stream.close()
+            self._record_stream_usage(estimate, params.get("max_tokens"), buffer)
+            return buffer.text
+        completion = await self._acreate(allm_client, params)
+        self._record_usage(estimate, completion.usage)
+        self._on_completion(completion)
+        return completion.choices[0].message.content
+
+
+class LMMEngineOpenAI(ChatCompletionsEngine):
+    provider = "openai"
+
     def __init__(
         self,
         base_url=None,
         api_key=None,
         model=None,
         rate_limit=-1,
+        tokens_per_minute=-1,
         temperature=None,
         organization=None,
         **kwargs,
@@ -32,133 +368,314 @@ class LMMEngineOpenAI(LMMEngine):
         self.base_url = base_url
         self.api_key = api_key
         self.organization = organization
-        self.request_interval = 0 if rate_limit == -1 else 60.0 / rate_limit
+        self._init_rate_limiter(rate_limit, tokens_per_minute)
         self.llm_client = None
+        self.allm_client = None
         self.temperature = temperature  # Can force temperature to be the same (in the case of o3 requiring temperature to be 1)
 
-    @backoff.on_exception(
-        backoff.expo, (APIConnectionError, APIError, RateLimitError), max_time=60
-    )
-    def generate(self, messages, temperature=0.0, max_new_tokens=None, **kwargs):
+    def _client_params(self):
         api_key = self.api_key or os.getenv("OPENAI_API_KEY")
         if api_key is None:
             raise ValueError(
                 "An API Key needs to be provided in either the api_key parameter or as an environment variable named OPENAI_API_KEY"
             )
         organization = self.organization or os.getenv("OPENAI_ORG_ID")
-        if not self.llm_client:
-            if not self.base_url:
-                self.llm_client = OpenAI(api_key=api_key, organization=organization)
-            else:
-                self.llm_client = OpenAI(
-                    base_url=self.base_url, api_key=api_key, organization=organization
-                )
-        return (
-            self.llm_client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                # max_completion_tokens=max_new_tokens if max_new_tokens else 4096,
-                temperature=(
-                    temperature if self.temperature is None else self.temperature
-                ),
-                **kwargs,
-            )
-            .choices[0]
-            .message.content
+        if not self.base_url:
+            return {"api_key": api_key, "organization": organization}
+        return {
+            "base_url": self.base_url,
+            "api_key": api_key,
+            "organization": organization,
+        }
+
+    def _completion_params(
+        self, messages, temperature=0.0, max_new_tokens=None, **kwargs
+    ):
+        return dict(
+            model=self.model,
+            messages=messages,
+            # max_completion_tokens=max_new_tokens if max_new_tokens else 4096,
+            temperature=(temperature if self.temperature is None else self.temperature),
+            **kwargs,
         )
 
 
 class LMMEngineAnthropic(LMMEngine):
+    provider = "anthropic"
+
     def __init__(
         self,
         base_url=None,
         api_key=None,
         model=None,
         thinking=False,
+        rate_limit=-1,
+        tokens_per_minute=-1,
         temperature=None,
+        prompt_caching=True,
         **kwargs,
     ):
         assert model is not None, "model must be provided"
         self.model = model
         self.thinking = thinking
         self.api_key = api_key
+        self._init_rate_limiter(rate_limit, tokens_per_minute)
         self.llm_client = None
+        self.allm_client = None
         self.temperature = temperature
+        self.prompt_caching = prompt_caching
 
-    @backoff.on_exception(
-        backoff.expo, (APIConnectionError, APIError, RateLimitError), max_time=60
-    )
-    def generate(self, messages, temperature=0.0, max_new_tokens=None, **kwargs):
+    def _get_api_key(self):
         api_key = self.api_key or os.getenv("ANTHROPIC_API_KEY")
         if api_key is None:
             raise ValueError(
                 "An API Key needs to be provided in either the api_key parameter or as an environment variable named ANTHROPIC_API_KEY"
             )
-        self.llm_client = Anthropic(api_key=api_key)
-        # Use the instance temperature if not specified in the call
-        temp = self.temperature if temperature is None else temperature
-        if self.thinking:
-            full_response = self.llm_client.messages.create(
-                system=messages[0]["content"][0]["text"],
+        return api_key
+
+    @staticmethod
+    def _cache_breakpoints(turns):
+        """Indices of the turns to end a cached prefix on.
+
+        The last turn before the newest message was sent as is with the previous request, so
+        the next request repeats everything up to it as long as no image is dropped. Once
+        the worker's image window (TrajectoryStore) drops images, oldest first, the prefix
+        before the first image-bearing turn is the part that stays frozen, so it gets a
+        breakpoint of its own.
+        """
+        breakpoints = set()
+        if len(turns) >= 2:
+            breakpoints.add(len(turns) - 2)
+        for i, message in enumerate(turns):
+            content = message["content"]
+            if isinstance(content, list) and any(
+                item.get("type") == "image" for item in content
+            ):
+                if i > 0:
+                    breakpoints.add(i - 1)
+                break
+        return sorted(breakpoints)
+
+    def _cached_request(self, messages):
+        """Split system prompt and turns, adding cache_control breakpoints when prompt caching is on.
+
+        Breakpoints go on the system prompt and on the ends of the stable history prefixes,
+        the request messages themselves are never modified.
+        """
+        system = messages[0]["content"][0]["text"]
+        turns = messages[1:]
+        if not self.prompt_caching:
+            return system, turns
+        cache_control = {"type": "ephemeral"}
+        system = [{"type": "text", "text": system, "cache_control": cache_control}]
+        turns = list(turns)
+        for index in self._cache_breakpoints(turns):
+            if not isinstance(turns[index]["content"], list):
+                continue
+            content = [dict(item) for item in turns[index]["content"]]
+            content[-1]["cache_control"] = cache_control
+            turns[index] = {**turns[index], "content": content}
+        return system, turns
+
+    def _request_params(
+        self, messages, temperature=0.0, max_new_tokens=None, thinking=False, **kwargs
+    ):
+        """Build the keyword arguments of messages.create, thinking mode uses a fixed budget."""
+        system, turns = self._cached_request(messages)
+        if thinking:
+            return dict(
+                system=system,
                 model=self.model,
-                messages=messages[1:],
+                messages=turns,
                 max_tokens=8192,
                 thinking={"type": "enabled", "budget_tokens": 4096},
                 **kwargs,
             )
-            thoughts = full_response.content[0].thinking
-            return full_response.content[1].text
-        return (
-            self.llm_client.messages.create(
-                system=messages[0]["content"][0]["text"],
-                model=self.model,
-                messages=messages[1:],
-                max_tokens=max_new_tokens if max_new_tokens else 4096,
-                temperature=temp,
-                **kwargs,
-            )
-            .content[0]
-            .text
+        # Use the instance temperature if not specified in the call
+        temp = self.temperature if temperature is None else temperature
+        return dict(
+            system=system,
+            model=self.model,
+            messages=turns,
+            max_tokens=max_new_tokens if max_new_tokens else 4096,
+            temperature=temp,
+            **kwargs,
         )
 
-    @backoff.on_exception(
-        backoff.expo, (APIConnectionError, APIError, RateLimitError), max_time=60
-    )
+    @staticmethod
+    def _format_thinking_response(thoughts, answer):
+        return f"<thoughts>\n{thoughts}\n</thoughts>\n\n<answer>\n{answer}\n</answer>\n"
+
+    @staticmethod
+    def _add_stream_event(buffer, event):
+        """Feed one streamed event to the buffer, returning True once reading can stop"""
+        # Input tokens come with the start of the message, output tokens with its end
+        if event.type == "message_start":
+            buffer.add_usage(event.message.usage)
+            return False
+        if event.type == "message_delta":
+            buffer.add_usage(event.usage)
+            return False
+        if event.type != "content_block_delta":
+            return False
+        if event.delta.type == "text_delta":
+            return buffer.add(text=event.delta.text)
+        if event.delta.type == "thinking_delta":
+            return buffer.add(thinking=event.delta.thinking)
+        return False
+
+    def _create(self, client, params, stream=False):
+        """messages.create, or a raw POST of the incrementally serialized body"""
+        if stream:
+            params = {**params, "stream": True}
+        if self.request_serializer is not None:
+            try:
+                return client.post(
+                    "/v1/messages",
+                    content=self.request_serializer.serialize(params),
+                    cast_to=Message,
+                    options=_timeout(),
+                    stream=stream,
+                    stream_cls=MessageStream[RawMessageStreamEvent],
+                )
+            except TypeError as e:
+                # Raised while building the request, before anything is sent
+                self._raw_body_unsupported(e)
+        return client.messages.create(**params, **_timeout())
+
+    async def _acreate(self, client, params, stream=False):
+        """Async version of _create"""
+        if stream:
+            params = {**params, "stream": True}
+        if self.request_serializer is not None:
+            try:
+                return await client.post(
+                    "/v1/messages",
+                    content=self.request_serializer.serialize(params),
+                    cast_to=Message,
+                    options=_timeout(),
+                    stream=stream,
+                    stream_cls=AsyncMessageStream[RawMessageStreamEvent],
+                )
+            except TypeError as e:
+                self._raw_body_unsupported(e)
+        return await client.messages.create(**params, **_timeout())
+
+    def _stream(self, params, stop_when, estimate):
+        buffer = StreamBuffer(stop_when)
+        stream = self._create(self.llm_client, params, stream=True)
+        try:
+            for event in stream:
+                if self._add_stream_event(buffer, event):
+                    break
+        finally:
+            stream.close()
+        self._record_stream_usage(estimate, params["max_tokens"], buffer)
+        return buffer
+
+    async def _astream(self, allm_client, params, stop_when, estimate):
+        buffer = StreamBuffer(stop_when)
+        stream = await self._acreate(allm_client, params, stream=True)
+        try:
+            async for event in stream:
+                if self._add_stream_event(buffer, event):
+                    break
+        finally:
+            await stream.close()
+        self._record_stream_usage(estimate, params["max_tokens"], buffer)
+        return buffer
+
+    @with_retries
+    def generate(
+        self, messages, temperature=0.0, max_new_tokens=None, stop_when=None, **kwargs
+    ):
+        if not self.llm_client:
+            self.llm_client = get_client(Anthropic, api_key=self._get_api_key())
+        params = self._request_params(
+            messages, temperature, max_new_tokens, thinking=self.thinking, **kwargs
+        )
+        estimate = self._throttle(messages, params["max_tokens"])
+        if stop_when is not None:
+            return self._stream(params, stop_when, estimate).text
+        response = self._create(self.llm_client, params)
+        self._record_usage(estimate, response.usage)
+        if self.thinking:
+            return response.content[1].text
+        return response.content[0].text
+
+    @with_retries
     # Compatible with Claude-3.7 Sonnet thinking mode
     def generate_with_thinking(
-        self, messages, temperature=0.0, max_new_tokens=None, **kwargs
+        self, messages, temperature=0.0, max_new_tokens=None, stop_when=None, **kwargs
     ):
         """Generate the next message based on previous messages, and keeps the thinking tokens"""
-        api_key = self.api_key or os.getenv("ANTHROPIC_API_KEY")
-        if api_key is None:
-            raise ValueError(
-                "An API Key needs to be provided in either the api_key parameter or as an environment variable named ANTHROPIC_API_KEY"
-            )
-        self.llm_client = Anthropic(api_key=api_key)
-        full_response = self.llm_client.messages.create(
-            system=messages[0]["content"][0]["text"],
-            model=self.model,
-            messages=messages[1:],
-            max_tokens=8192,
-            thinking={"type": "enabled", "budget_tokens": 4096},
-            **kwargs,
+        if not self.llm_client:
+            self.llm_client = get_client(Anthropic, api_key=self._get_api_key())
+        params = self._request_params(
+            messages, temperature, max_new_tokens, thinking=True, **kwargs
+        )
+        estimate = self._throttle(messages, params["max_tokens"])
+        if stop_when is not None:
+            buffer = self._stream(params, stop_when, estimate)
+            return self._format_thinking_response(buffer.thinking, buffer.text)
+        full_response = self._create(self.llm_client, params)
+        self._record_usage(estimate, full_response.usage)
+        return self._format_thinking_response(
+            full_response.content[0].thinking, full_response.content[1].text
         )
 
-        thoughts = full_response.content[0].thinking
-        answer = full_response.content[1].text
-        full_response = (
-            f"<thoughts>\n{thoughts}\n</thoughts>\n\n<answer>\n{answer}\n</answer>\n"
+    @with_retries
+    async def agenerate(
+        self, messages, temperature=0.0, max_new_tokens=None, stop_when=None, **kwargs
+    ):
+        """Async version of generate"""
+        allm_client = self._get_async_client(
+            AsyncAnthropic, api_key=self._get_api_key()
+        )
+        params = self._request_params(
+            messages, temperature, max_new_tokens, thinking=self.thinking, **kwargs
+        )
+        estimate = await self._athrottle(messages, params["max_tokens"])
+        if stop_when is not None:
+            return (await self._astream(allm_client, params, stop_when, estimate)).text
+        response = await self._acreate(allm_client, params)
+        self._record_usage(estimate, response.usage)
+        if self.thinking:
+            return response.content[1].text
+        return response.content[0].text
+
+    @with_retries
+    async def agenerate_with_thinking(
+        self, messages, temperature=0.0, max_new_tokens=None, stop_when=None, **kwargs
+    ):
+        """Async version of generate_with_thinking"""
+        allm_client = self._get_async_client(
+            AsyncAnthropic, api_key=self._get_api_key()
+        )
+        params = self._request_params(
+            messages, temperature, max_new_tokens, thinking=True, **kwargs
+        )
+        estimate = await self._athrottle(messages, params["max_tokens"])
+        if stop_when is not None:
+            buffer = await self._astream(allm_client, params, stop_when, estimate)
+            return self._format_thinking_response(buffer.thinking, buffer.text)
+        full_response = await self._acreate(allm_client, params)
+        self._record_usage(estimate, full_response.usage)
+        return self._format_thinking_response(
+            full_response.content[0].thinking, full_response.content[1].text
         )
-        return full_response
 
 
-class LMMEngineGemini(LMMEngine):
+class LMMEngineGemini(ChatCompletionsEngine):
+    provider = "gemini"
+
     def __init__(
         self,
         base_url=None,
         api_key=None,
         model=None,
         rate_limit=-1,
+        tokens_per_minute=-1,
         temperature=None,
         **kwargs,
     ):
@@ -166,14 +683,12 @@ class LMMEngineGemini(LMMEngine):
         self.model = model
         self.base_url = base_url
         self.api_key = api_key
-        self.request_interval = 0 if rate_limit == -1 else 60.0 / rate_limit
+        self._init_rate_limiter(rate_limit, tokens_per_minute)
         self.llm_client = None
+        self.allm_client = None
         self.temperature = temperature
 
-    @backoff.on_exception(
-        backoff.expo, (APIConnectionError, APIError, RateLimitError), max_time=60
-    )
-    def generate(self, messages, temperature=0.0, max_new_tokens=None, **kwargs):
+    def _client_params(self):
         api_key = self.api_key or os.getenv("GEMINI_API_KEY")
         if api_key is None:
             raise ValueError(
@@ -184,30 +699,32 @@ class LMMEngineGemini(LMMEngine):
             raise ValueError(
                 "An endpoint URL needs to be provided in either the endpoint_url parameter or as an environment variable named GEMINI_ENDPOINT_URL"
             )
-        if not self.llm_client:
-            self.llm_client = OpenAI(base_url=base_url, api_key=api_key)
+        return {"base_url": base_url, "api_key": api_key}
+
+    def _completion_params(
+        self, messages, temperature=0.0, max_new_tokens=None, **kwargs
+    ):
         # Use the temperature passed to generate, otherwise use the instance's temperature, otherwise default to 0.0
         temp = self.temperature if temperature is None else temperature
-        return (
-            self.llm_client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=max_new_tokens if max_new_tokens else 4096,
-                temperature=temp,
-                **kwargs,
-            )
-            .choices[0]
-            .message.content
+        return dict(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_new_tokens if max_new_tokens else 4096,
+            temperature=temp,
+            **kwargs,
         )
 
 
-class LMMEngineOpenRouter(LMMEngine):
+class LMMEngineOpenRouter(ChatCompletionsEngine):
+    provider = "open_router"
+
     def __init__(
         self,
         base_url=None,
         api_key=None,
         model=None,
         rate_limit=-1,
+        tokens_per_minute=-1,
         temperature=None,
         **kwargs,
     ):
@@ -215,14 +732,12 @@ class LMMEngineOpenRouter(LMMEngine):
         self.model = model
         self.base_url = base_url
         self.api_key = api_key
-        self.request_interval = 0 if rate_limit == -1 else 60.0 / rate_limit
+        self._init_rate_limiter(rate_limit, tokens_per_minute)
         self.llm_client = None
+        self.allm_client = None
         self.temperature = temperature
 
-    @backoff.on_exception(
-        backoff.expo, (APIConnectionError, APIError, RateLimitError), max_time=60
-    )
-    def generate(self, messages, temperature=0.0, max_new_tokens=None, **kwargs):
+    def _client_params(self):
         api_key = self.api_key or os.getenv("OPENROUTER_API_KEY")
         if api_key is None:
             raise ValueError(
@@ -233,24 +748,27 @@ class LMMEngineOpenRouter(LMMEngine):
             raise ValueError(
                 "An endpoint URL needs to be provided in either the endpoint_url parameter or as an environment variable named OPEN_ROUTER_ENDPOINT_URL"
             )
-        if not self.llm_client:
-            self.llm_client = OpenAI(base_url=base_url, api_key=api_key)
+        return {"base_url": base_url, "api_key": api_key}
+
+    def _completion_params(
+        self, messages, temperature=0.0, max_new_tokens=None, **kwargs
+    ):
         # Use self.temperature if set, otherwise use the temperature argument
         temp = self.temperature if self.temperature is not None else temperature
-        return (
-            self.llm_client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=max_new_tokens if max_new_tokens else 4096,
-                temperature=temp,
-                **kwargs,
-            )
-            .choices[0]
-            .message.content
+        return dict(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_new_tokens if max_new_tokens else 4096,
+            temperature=temp,
+            **kwargs,
         )
 
 
-class LMMEngineAzureOpenAI(LMMEngine):
+class LMMEngineAzureOpenAI(ChatCompletionsEngine):
+    provider = "azure"
+    client_class = AzureOpenAI
+    async_client_class = AsyncAzureOpenAI
+
     def __init__(
         self,
         base_url=None,
@@ -259,6 +777,7 @@ class LMMEngineAzureOpenAI(LMMEngine):
         model=None,
         api_version=None,
         rate_limit=-1,
+        tokens_per_minute=-1,
         temperature=None,
         **kwargs,
     ):
@@ -267,15 +786,13 @@ class LMMEngineAzureOpenAI(LMMEngine):
         self.api_version = api_version
         self.api_key = api_key
         self.azure_endpoint = azure_endpoint
-        self.request_interval = 0 if rate_limit == -1 else 60.0 / rate_limit
+        self._init_rate_limiter(rate_limit, tokens_per_minute)
         self.llm_client = None
+        self.allm_client = None
         self.cost = 0.0
         self.temperature = temperature
 
-    @backoff.on_exception(
-        backoff.expo, (APIConnectionError, APIError, RateLimitError), max_time=60
-    )
-    def generate(self, messages, temperature=0.0, max_new_tokens=None, **kwargs):
+    def _client_params(self):
         api_key = self.api_key or os.getenv("AZURE_OPENAI_API_KEY")
         if api_key is None:
             raise ValueError(
@@ -291,33 +808,40 @@ class LMMEngineAzureOpenAI(LMMEngine):
             raise ValueError(
                 "An Azure API endpoint needs to be provided in either the azure_endpoint parameter or as an environment variable named AZURE_OPENAI_ENDPOINT"
             )
-        if not self.llm_client:
-            self.llm_client = AzureOpenAI(
-                azure_endpoint=azure_endpoint,
-                api_key=api_key,
-                api_version=api_version,
-            )
+        return {
+            "azure_endpoint": azure_endpoint,
+            "api_key": api_key,
+            "api_version": api_version,
+        }
+
+    def _completion_params(
+        self, messages, temperature=0.0, max_new_tokens=None, **kwargs
+    ):
         # Use self.temperature if set, otherwise use the temperature argument
         temp = self.temperature if self.temperature is not None else temperature
-        completion = self.llm_client.chat.completions.create(
+        return dict(
             model=self.model,
             messages=messages,
             max_tokens=max_new_tokens if max_new_tokens else 4096,
             temperature=temp,
             **kwargs,
         )
+
+    def _on_completion(self, completion):
         total_tokens = completion.usage.total_tokens
         self.cost += 0.02 * ((total_tokens + 500) / 1000)
-        return completion.choices[0].message.content
 
 
-class LMMEnginevLLM(LMMEngine):
+class LMMEnginevLLM(ChatCompletionsEngine):
+    provider = "vllm"
+
     def __init__(
         self,
         base_url=None,
         api_key=None,
         model=None,
         rate_limit=-1,
+        tokens_per_minute=-1,
         temperature=None,
         **kwargs,
     ):
@@ -325,22 +849,12 @@ class LMMEnginevLLM(LMMEngine):
         self.model = model
         self.api_key = api_key
         self.base_url = base_url
-        self.request_interval = 0 if rate_limit == -1 else 60.0 / rate_limit
+        self._init_rate_limiter(rate_limit, tokens_per_minute)
         self.llm_client = None
+        self.allm_client = None
         self.temperature = temperature
 
-    @backoff.on_exception(
-        backoff.expo, (APIConnectionError, APIError, RateLimitError), max_time=60
-    )
-    def generate(
-        self,
-        messages,
-        temperature=0.0,
-        top_p=0.8,
-        repetition_penalty=1.05,
-        max_new_tokens=512,
-        **kwargs,
-    ):
+    def _client_params(self):
         api_key = self.api_key or os.getenv("vLLM_API_KEY")
         if api_key is None:
             raise ValueError(
@@ -351,11 +865,20 @@ class LMMEnginevLLM(LMMEngine):
             raise ValueError(
                 "An endpoint URL needs to be provided in either the endpoint_url parameter or as an environment variable named vLLM_ENDPOINT_URL"
             )
-        if not self.llm_client:
-            self.llm_client = OpenAI(base_url=base_url, api_key=api_key)
+        return {"base_url": base_url, "api_key": api_key}
+
+    def _completion_params(
+        self,
+        messages,
+        temperature=0.0,
+        max_new_tokens=512,
+        top_p=0.8,
+        repetition_penalty=1.05,
+        **kwargs,
+    ):
         # Use self.temperature if set, otherwise use the temperature argument
         temp = self.temperature if self.temperature is not None else temperature
-        completion = self.llm_client.chat.completions.create(
+        return dict(
             model=self.model,
             messages=messages,
             max_tokens=max_new_tokens if max_new_tokens else 4096,
@@ -363,20 +886,21 @@ class LMMEnginevLLM(LMMEngine):
             top_p=top_p,
             extra_body={"repetition_penalty": repetition_penalty},
         )
-        return completion.choices[0].message.content
 
 
-class LMMEngineHuggingFace(LMMEngine):
-    def __init__(self, base_url=None, api_key=None, rate_limit=-1, **kwargs):
+class LMMEngineHuggingFace(ChatCompletionsEngine):
+    provider = "huggingface"
+
+    def __init__(
+        self, base_url=None, api_key=None, rate_limit=-1, tokens_per_minute=-1, **kwargs
+    ):
         self.base_url = base_url
         self.api_key = api_key
-        self.request_interval = 0 if rate_limit == -1 else 60.0 / rate_limit
+        self._init_rate_limiter(rate_limit, tokens_per_minute)
         self.llm_client = None
+        self.allm_client = None
 
-    @backoff.on_exception(
-        backoff.expo, (APIConnectionError, APIError, RateLimitError), max_time=60
-    )
-    def generate(self, messages, temperature=0.0, max_new_tokens=None, **kwargs):
+    def _client_params(self):
         api_key = self.api_key or os.getenv("HF_TOKEN")
         if api_key is None:
             raise ValueError(
@@ -387,36 +911,41 @@ class LMMEngineHuggingFace(LMMEngine):
             raise ValueError(
                 "HuggingFace endpoint must be provided as base_url parameter or as an environment variable named HF_ENDPOINT_URL."
             )
-        if not self.llm_client:
-            self.llm_client = OpenAI(base_url=base_url, api_key=api_key)
-        return (
-            self.llm_client.chat.completions.create(
-                model="tgi",
-                messages=messages,
-                max_tokens=max_new_tokens if max_new_tokens else 4096,
-                temperature=temperature,
-                **kwargs,
-            )
-            .choices[0]
-            .message.content
+        return {"base_url": base_url, "api_key": api_key}
+
+    def _completion_params(
+        self, messages, temperature=0.0, max_new_tokens=None, **kwargs
+    ):
+        return dict(
+            model="tgi",
+            messages=messages,
+            max_tokens=max_new_tokens if max_new_tokens else 4096,
+            temperature=temperature,
+            **kwargs,
         )
 
 
-class LMMEngineParasail(LMMEngine):
+class LMMEngineParasail(ChatCompletionsEngine):
+    provider = "parasail"
+
     def __init__(
-        self, base_url=None, api_key=None, model=None, rate_limit=-1, **kwargs
+        self,
+        base_url=None,
+        api_key=None,
+        model=None,
+        rate_limit=-1,
+        tokens_per_minute=-1,
+        **kwargs,
     ):
         assert model is not None, "Parasail model id must be provided"
         self.base_url = base_url
         self.model = model
         self.api_key = api_key
-        self.request_interval = 0 if rate_limit == -1 else 60.0 / rate_limit
+        self._init_rate_limiter(rate_limit, tokens_per_minute)
         self.llm_client = None
+        self.allm_client = None
 
-    @backoff.on_exception(
-        backoff.expo, (APIConnectionError, APIError, RateLimitError), max_time=60
-    )
-    def generate(self, messages, temperature=0.0, max_new_tokens=None, **kwargs):
+    def _client_params(self):
         api_key = self.api_key or os.getenv("PARASAIL_API_KEY")
         if api_key is None:
             raise ValueError(
@@ -427,19 +956,104 @@ class LMMEngineParasail(LMMEngine):
             raise ValueError(
                 "Parasail endpoint must be provided as base_url parameter or as an environment variable named PARASAIL_ENDPOINT_URL"
             )
-        if not self.llm_client:
-            self.llm_client = OpenAI(
-                base_url=base_url if base_url else "https://api.parasail.io/v1",
-                api_key=api_key,
+        return {
+            "base_url": base_url if base_url else "https://api.parasail.io/v1",
+            "api_key": api_key,
+        }
+
+    def _completion_params(
+        self, messages, temperature=0.0, max_new_tokens=None, **kwargs
+    ):
+        return dict(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_new_tokens if max_new_tokens else 4096,
+            temperature=temperature,
+            **kwargs,
+        )
+
+
+class LMMEngineReplay(LMMEngine):
+    """Serves canned responses with synthetic latency, for running the agent loop offline."""
+
+    provider = "replay"
+
+    # Size of the pieces a response is streamed in when stop_when is given
+    STREAM_CHUNK_CHARS = 16
+
+    def __init__(
+        self,
+        fixture=None,
+        responses=None,
+        latency=None,
+        seed=None,
+        model="replay",
+        role=None,
+        grounding_width=None,
+        grounding_height=None,
+        **kwargs,
+    ):
+        """
+        Args:
+            fixture: str
+                JSON fixture, traj.jsonl or result directory to load responses from (see ReplayScript.from_file)
+            responses: Dict[str, List[str]]
+                Canned responses per agent role, used when no fixture is given
+            latency: float or Dict
+                Synthetic latency spec, or specs per role (see LatencyModel)
+            seed: int
+                Seed of the latency sampling
+            role: str
+                Role of the agent owning the engine, selects its response queue
+        """
+        if fixture:
+            self.script = ReplayScript.from_file(fixture, latency=latency, seed=seed)
+        else:
+            self.script = ReplayScript(responses, latency=latency, seed=seed)
+        self.model = model
+        self.role = role
+        self.temperature = None
+        # Without a scripted answer, grounding requests get the center of the screen
+        self.fallback_response = None
+        if role == "grounding" and grounding_width and grounding_height:
+            self.fallback_response = (
+                f"({grounding_width // 2}, {grounding_height // 2})"
             )
-        return (
-            self.llm_client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=max_new_tokens if max_new_tokens else 4096,
-                temperature=temperature,
-                **kwargs,
+
+    def _next_response(self, messages):
+        response = self.script.next_response(self.role, self.fallback_response)
+        record_usage(
+            SimpleNamespace(
+                prompt_tokens=estimate_tokens(messages),
+                completion_tokens=len(response) // CHARS_PER_TOKEN,
             )
-            .choices[0]
-            .message.content
         )
+        return response
+
+    def _stream(self, response, stop_when):
+        if stop_when is None:
+            return response
+        buffer = StreamBuffer(stop_when)
+        for i in range(0, len(response), self.STREAM_CHUNK_CHARS):
+            if buffer.add(response[i : i + self.STREAM_CHUNK_CHARS]):
+                break
+        return buffer.text
+
+    def generate(
+        self, messages, temperature=0.0, max_new_tokens=None, stop_when=None, **kwargs
+    ):
+        response = self._next_response(messages)
+        time.sleep(self.script.sample_latency(self.role))
+        return self._stream(response, stop_when)
+
+    async def agenerate(
+        self, messages, temperature=0.0, max_new_tokens=None, stop_when=None, **kwargs
+    ):
+        """Async version of generate"""
+        response = self._next_response(messages)
+        await asyncio.sleep(self.script.sample_latency(self.role))
+        return self._stream(response, stop_when)
+
+    # Scripted responses already carry any <thoughts>/<answer> tags they need
+    generate_with_thinking = generate
+    agenerate_with_thinking = agenerate
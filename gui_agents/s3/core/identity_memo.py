@@ -0,0 +1,52 @@
+"""Bounded memo of values derived from objects, keyed by the identity of the object."""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Tuple
+
+
+class IdentityMemo:
+    """Least recently used memo keyed by ``id()`` of the source object and optional settings.
+
+    Hashing a screenshot or a message would cost about as much as the work memoized, so
+    entries are keyed by identity instead. Each entry holds on to its source object: while
+    the entry lives the object cannot be collected, so its id cannot be reused by another
+    object and a hit is always a value derived from the very same object.
+    """
+
+    def __init__(self, max_entries: int):
+        """
+        Args:
+            max_entries: int
+                Entries kept, the least recently used are dropped beyond it
+        """
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Tuple[Any, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, source: Any, compute: Callable[[], Any], *settings: Hashable) -> Any:
+        """The memoized value of a source object, computing it on a miss.
+
+        Args:
+            source (Any): The object the value is derived from, never mutated afterwards.
+            compute (Callable): Computes the value, called outside the lock.
+            settings (Hashable): Further key parts, e.g. the parameters of the computation.
+
+        Returns:
+            Any: The value.
+        """
+        key = (id(source),) + settings
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is source:
+                self._entries.move_to_end(key)
+                return entry[1]
+        value = compute()
+        with self._lock:
+            self._entries[key] = (source, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,166 @@
+"""Memoized base64 encoding of images, so a screenshot shared by several agents is encoded once."""
+
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# Upper bound of the encoded payloads kept in memory
+DEFAULT_MAX_BYTES = int(float(os.getenv("AGENT_S_IMAGE_CACHE_MB", "64")) * 1024 * 1024)
+
+# Leading bytes of the formats screenshots are sent in
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def detect_media_type(data: bytes) -> str:
+    """MIME type of encoded image bytes, PNG when the format is not recognized."""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, media_type in _SIGNATURES:
+        if data[: len(signature)] == signature:
+            return media_type
+    return "image/png"
+
+
+class _Entry:
+    __slots__ = ("digest", "source", "encoded", "media_type", "data_urls", "size")
+
+    def __init__(self, digest: bytes, source: bytes, encoded: str):
+        self.digest = digest
+        # Holding the source keeps its id from being reused while the entry lives
+        self.source = source
+        self.encoded = encoded
+        self.media_type = detect_media_type(source)
+        self.data_urls: Dict[str, str] = {}
+        self.size = len(source) + len(encoded)
+
+
+class ImageEncodingCache:
+    """LRU cache of base64 payloads and data URLs, bounded by their total size.
+
+    Lookups first try the identity of the bytes object (the same screenshot handed to the
+    generator, reflection and grounding agents), then a hash of its content, so equal
+    screenshots read twice from disk also hit.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Args:
+            max_bytes: int
+                Total size of the cached sources, payloads and data URLs before eviction
+        """
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[bytes, _Entry]" = OrderedDict()
+        self._by_identity: Dict[tuple, bytes] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _read(image_content) -> bytes:
+        if isinstance(image_content, str):
+            with open(image_content, "rb") as image_file:
+                return image_file.read()
+        if isinstance(image_content, (bytes, bytearray)):
+            return image_content
+        # numpy arrays and other buffers
+        return bytes(memoryview(image_content))
+
+    def _lookup(self, data: bytes) -> Optional[_Entry]:
+        """Find the entry of these bytes by identity, then by content hash."""
+        digest = self._by_identity.get((id(data), len(data)))
+        if digest is not None and self._entries[digest].source is data:
+            self._entries.move_to_end(digest)
+            return self._entries[digest]
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        entry = self._entries.get(digest)
+        if entry is not None:
+            self._entries.move_to_end(digest)
+            if isinstance(data, bytes):
+                # Equal content in another object, track the newest one by identity
+                self._by_identity.pop((id(entry.source), len(entry.source)), None)
+                entry.source = data
+                self._by_identity[(id(data), len(data))] = digest
+        return entry
+
+    def _entry(self, image_content) -> _Entry:
+        data = self._read(image_content)
+        with self._lock:
+            entry = self._lookup(data)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            self.misses += 1
+        source = bytes(data)
+        digest = hashlib.blake2b(source, digest_size=16).digest()
+        entry = _Entry(digest, source, base64.b64encode(source).decode("utf-8"))
+        with self._lock:
+            previous = self._entries.pop(digest, None)
+            if previous is not None:
+                self._size -= previous.size
+            self._entries[digest] = entry
+            self._by_identity[(id(source), len(source))] = digest
+            self._size += entry.size
+            self._evict()
+        return entry
+
+    def _evict(self):
+        # Always keep the newest entry, even if it alone exceeds the bound
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self._by_identity.pop((id(entry.source), len(entry.source)), None)
+            self._size -= entry.size
+
+    def encode(self, image_content) -> str:
+        """Base64 payload of an image given as bytes, a numpy buffer or a file path."""
+        return self._entry(image_content).encoded
+
+    def media_type(self, image_content) -> str:
+        """MIME type of an image, detected from its bytes."""
+        return self._entry(image_content).media_type
+
+    def data_url(self, image_content, media_type: Optional[str] = None) -> str:
+        """``data:`` URL of an image, built once per media type and reused afterwards.
+
+        The media type defaults to the one detected from the image bytes.
+        """
+        entry = self._entry(image_content)
+        media_type = media_type or entry.media_type
+        url = entry.data_urls.get(media_type)
+        if url is None:
+            url = f"data:{media_type};base64,{entry.encoded}"
+            with self._lock:
+                if media_type not in entry.data_urls:
+                    entry.data_urls[media_type] = url
+                    entry.size += len(url)
+                    # Unless it was evicted meanwhile, the entry's growth counts against the bound
+                    if self._entries.get(entry.digest) is entry:
+                        self._size += len(url)
+                        self._evict()
+        return url
+
+
+_image_cache = ImageEncodingCache()
+
+
+def encode_image(image_content) -> str:
+    """Base64-encode an image through the process-wide cache."""
+    return _image_cache.encode(image_content)
+
+
+def image_media_type(image_content) -> str:
+    """MIME type of an image through the process-wide cache."""
+    return _image_cache.media_type(image_content)
+
+
+def image_data_url(image_content, media_type: Optional[str] = None) -> str:
+    """Data URL of an image through the process-wide cache."""
+    return _image_cache.data_url(image_content, media_type)
@@ -0,0 +1,236 @@
+"""Spreads requests over several replicas of one model, with optional request hedging."""
+
+import asyncio
+import contextvars
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional
+
+from gui_agents.s3.core.telemetry import annotate_call
+
+logger = logging.getLogger("desktopenv.agent")
+
+# Latency samples kept per replica for the percentile estimates
+LATENCY_WINDOW = 200
+# Samples needed before a replica's p95 is trusted as the hedging delay
+MIN_HEDGE_SAMPLES = 20
+
+
+def _percentile(samples: List[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Replica:
+    """One endpoint of a load-balanced model, with its in-flight count and recent latencies."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.outstanding = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    @property
+    def name(self) -> str:
+        return getattr(self.engine, "base_url", None) or repr(self.engine)
+
+    def tripped(self) -> bool:
+        """Whether the replica's circuit breaker currently rejects calls"""
+        circuit_breaker = getattr(self.engine, "circuit_breaker", None)
+        return circuit_breaker is not None and circuit_breaker().is_open()
+
+    def p50(self) -> Optional[float]:
+        return _percentile(list(self.latencies), 0.5)
+
+    def p95(self) -> Optional[float]:
+        return _percentile(list(self.latencies), 0.95)
+
+
+class LoadBalancedEngine:
+    """Engine facade spreading calls over replicas by outstanding requests and median latency.
+
+    When hedging is enabled and a call outlives the p95 latency observed on its replica, a
+    duplicate is sent to the next best replica and whichever answers first wins. Attributes
+    such as ``model`` or ``temperature`` are read from the first replica.
+    """
+
+    def __init__(self, engines: List, hedge: bool = False):
+        """
+        Args:
+            engines: List[LMMEngine]
+                One engine per replica, all serving the same model
+            hedge: bool
+                Whether to send a duplicate request once a call exceeds the replica's p95 latency
+        """
+        assert engines, "At least one replica engine must be provided"
+        self.replicas = [Replica(engine) for engine in engines]
+        self.hedge = hedge and len(self.replicas) > 1
+        self._lock = threading.Lock()
+        self._executor = (
+            ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+            if self.hedge
+            else None
+        )
+
+    def __getattr__(self, name):
+        # Only called for attributes missing on the balancer itself
+        if name == "replicas":
+            raise AttributeError(name)
+        return getattr(self.replicas[0].engine, name)
+
+    @property
+    def primary_engine(self):
+        """The engine whose message format and settings the balancer presents"""
+        return self.replicas[0].engine
+
+    def _pick(self, exclude: Optional[Replica] = None) -> Replica:
+        """Power of two choices among the healthy replicas.
+
+        Two random candidates are compared on outstanding requests. A tie, which is every
+        call when calls are sequential, is broken at random weighted by inverse median
+        latency, so faster replicas get more calls without taking all of them.
+        """
+        with self._lock:
+            candidates = [r for r in self.replicas if r is not exclude]
+            healthy = [r for r in candidates if not r.tripped()]
+            candidates = healthy or candidates
+            if len(candidates) == 1:
+                return candidates[0]
+            first, second = random.sample(candidates, 2)
+            if first.outstanding != second.outstanding:
+                return min(first, second, key=lambda r: r.outstanding)
+            medians = [r.p50() for r in candidates]
+            known = [m for m in medians if m]
+            # Replicas without samples yet are weighted as average ones
+            default = sum(known) / len(known) if known else 1.0
+            weights = [1.0 / (r.p50() or default) for r in (first, second)]
+            return random.choices((first, second), weights=weights)[0]
+
+    def _hedge_delay(self, replica: Replica) -> Optional[float]:
+        if not self.hedge or len(replica.latencies) < MIN_HEDGE_SAMPLES:
+            return None
+        return replica.p95()
+
+    def _start(self, replica: Replica) -> float:
+        with self._lock:
+            replica.outstanding += 1
+        return time.time()
+
+    def _finish(self, replica: Replica, started: float, success: bool):
+        with self._lock:
+            replica.outstanding -= 1
+            if success:
+                replica.latencies.append(time.time() - started)
+
+    def _call(self, replica: Replica, method: str, *args, **kwargs):
+        started = self._start(replica)
+        success = False
+        try:
+            result = getattr(replica.engine, method)(*args, **kwargs)
+            success = True
+            return result
+        finally:
+            self._finish(replica, started, success)
+
+    async def _acall(self, replica: Replica, method: str, *args, **kwargs):
+        started = self._start(replica)
+        success = False
+        try:
+            result = await getattr(replica.engine, method)(*args, **kwargs)
+            success = True
+            return result
+        finally:
+            self._finish(replica, started, success)
+
+    def _dispatch(self, method: str, *args, **kwargs):
+        primary = self._pick()
+        annotate_call(endpoint=primary.name)
+        delay = self._hedge_delay(primary)
+        if delay is None:
+            return self._call(primary, method, *args, **kwargs)
+
+        # Each attempt runs in a copy of the caller's context so telemetry still reaches the call record
+        def submit(replica):
+            context = contextvars.copy_context()
+            return self._executor.submit(
+                context.run, self._call, replica, method, *args, **kwargs
+            )
+
+        pending = {submit(primary)}
+        done, pending = wait(pending, timeout=delay)
+        if not done:
+            backup = self._pick(exclude=primary)
+            logger.debug("Hedging %s after %.2fs on %s", method, delay, backup.name)
+            annotate_call(hedged=True, hedge_endpoint=backup.name)
+            pending.add(submit(backup))
+        error = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                raise error
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+    async def _adispatch(self, method: str, *args, **kwargs):
+        primary = self._pick()
+        annotate_call(endpoint=primary.name)
+        delay = self._hedge_delay(primary)
+        if delay is None:
+            return await self._acall(primary, method, *args, **kwargs)
+
+        pending = {asyncio.ensure_future(self._acall(primary, method, *args, **kwargs))}
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            backup = self._pick(exclude=primary)
+            annotate_call(hedged=True, hedge_endpoint=backup.name)
+            pending.add(
+                asyncio.ensure_future(self._acall(backup, method, *args, **kwargs))
+            )
+        error = None
+        try:
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+        finally:
+            # Unlike threads, the losing request can actually be cancelled
+            for task in pending:
+                task.cancel()
+
+    def generate(self, *args, **kwargs):
+        return self._dispatch("generate", *args, **kwargs)
+
+    def generate_with_thinking(self, *args, **kwargs):
+        return self._dispatch("generate_with_thinking", *args, **kwargs)
+
+    async def agenerate(self, *args, **kwargs):
+        return await self._adispatch("agenerate", *args, **kwargs)
+
+    async def agenerate_with_thinking(self, *args, **kwargs):
+        return await self._adispatch("agenerate_with_thinking", *args, **kwargs)
+
+    def stats(self) -> Dict[str, Dict]:
+        """Outstanding requests and p50/p95 latency of every replica, keyed by endpoint."""
+        with self._lock:
+            return {
+                replica.name: {
+                    "outstanding": replica.outstanding,
+                    "p50": replica.p50(),
+                    "p95": replica.p95(),
+                    "samples": len(replica.latencies),
+                }
+                for replica in self.replicas
+            }
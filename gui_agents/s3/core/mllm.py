@@ -1,4 +1,4 @@
-import base64
+import asyncio
 
 import numpy as np
 
@@ -9,13 +9,43 @@ from gui_agents.s3.core.engine import (
     LMMEngineOpenAI,
     LMMEngineOpenRouter,
     LMMEngineParasail,
+    LMMEngineReplay,
     LMMEnginevLLM,
     LMMEngineGemini,
 )
+from gui_agents.s3.core.image_encoding import (
+    encode_image,
+    image_data_url,
+    image_media_type,
+)
+from gui_agents.s3.core.load_balancer import LoadBalancedEngine
+from gui_agents.s3.core.response_cache import get_response_cache, make_cache_key
+from gui_agents.s3.core.serialization import RequestSerializer
+from gui_agents.s3.core.telemetry import track_llm_call
+from gui_agents.s3.core.tokens import ContextPacker, TokenCounter
+from gui_agents.s3.core.trajectory import TrajectoryStore
 
 
 class LMMAgent:
-    def __init__(self, engine_params=None, system_prompt=None, engine=None):
+    def __init__(
+        self,
+        engine_params=None,
+        system_prompt=None,
+        engine=None,
+        role=None,
+        trajectory=None,
+    ):
+        if engine is None and engine_params is not None:
+            base_urls = engine_params.get("base_url")
+            if isinstance(base_urls, (list, tuple)):
+                # Several replicas of one model, each request goes to the least loaded one
+                engine = LoadBalancedEngine(
+                    [
+                        LMMAgent({**engine_params, "base_url": url}, role=role).engine
+                        for url in base_urls
+                    ],
+                    hedge=engine_params.get("hedge", False),
+                )
         if engine is None:
             if engine_params is not None:
                 engine_type = engine_params.get("engine_type")
@@ -35,6 +65,9 @@ class LMMAgent:
                     self.engine = LMMEngineOpenRouter(**engine_params)
                 elif engine_type == "parasail":
                     self.engine = LMMEngineParasail(**engine_params)
+                elif engine_type == "replay":
+                    # Offline responses are scripted per agent role
+                    self.engine = LMMEngineReplay(role=role, **engine_params)
                 elif engine_type == "ollama":
                     # Reuse LMMEngineOpenAI for Ollama
                     if not engine_params.get("base_url"):
@@ -105,7 +138,30 @@ class LMMAgent:
         else:
             self.engine = engine
 
-        self.messages = []  # Empty messages
+        # Azure routes requests by the model field of the body, which it cannot read from raw bytes
+        if (
+            engine is None
+            and engine_params.get("incremental_serialization")
+            and not isinstance(self.engine, LMMEngineAzureOpenAI)
+        ):
+            self.engine.request_serializer = RequestSerializer()
+
+        # Message history, rendered through the store's window when read as self.messages
+        self.trajectory = trajectory if trajectory is not None else TrajectoryStore()
+        self.role = role  # What the agent is used for, reported in the call telemetry
+        self.response_cache = get_response_cache(engine_params)
+        # Replaying a sampled response would pin it for every later run, opt-in only
+        self.cache_sampled = bool(engine_params and engine_params.get("cache_sampled"))
+        # Streaming with early stop is opt-in, callers pass stop_when regardless
+        self.early_stop = bool(engine_params and engine_params.get("early_stop"))
+        # Requests over the model's context window are packed down instead of failing
+        self.context_packer = None
+        if engine_params and engine_params.get("max_context_tokens"):
+            self.context_packer = ContextPacker(
+                TokenCounter(engine_params.get("engine_type", "openai")),
+                engine_params["max_context_tokens"],
+                reserve_tokens=engine_params.get("context_reserve_tokens", 4096),
+            )
 
         if system_prompt:
             self.add_system_prompt(system_prompt)
@@ -113,64 +169,63 @@ class LMMAgent:
             self.add_system_prompt("You are a helpful assistant.")
 
     def encode_image(self, image_content):
-        # if image_content is a path to an image file, check type of the image_content to verify
-        if isinstance(image_content, str):
-            with open(image_content, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode("utf-8")
-        else:
-            return base64.b64encode(image_content).decode("utf-8")
+        """Base64 payload of an image (bytes or file path), shared with every agent encoding it"""
+        return encode_image(image_content)
+
+    @property
+    def messages(self):
+        """The messages sent to the model: system prompt followed by the trajectory window"""
+        return self.trajectory.render()
+
+    @messages.setter
+    def messages(self, messages):
+        self.trajectory.load(messages)
 
     def reset(
         self,
     ):
 
-        self.messages = [
+        self.trajectory.reset(
             {
                 "role": "system",
                 "content": [{"type": "text", "text": self.system_prompt}],
             }
-        ]
+        )
 
     def add_system_prompt(self, system_prompt):
         self.system_prompt = system_prompt
-        if len(self.messages) > 0:
-            self.messages[0] = {
+        self.trajectory.set_system(
+            {
                 "role": "system",
                 "content": [{"type": "text", "text": self.system_prompt}],
             }
-        else:
-            self.messages.append(
-                {
-                    "role": "system",
-                    "content": [{"type": "text", "text": self.system_prompt}],
-                }
-            )
+        )
 
     def remove_message_at(self, index):
         """Remove a message at a given index"""
-        if index < len(self.messages):
-            self.messages.pop(index)
+        if index < len(self.trajectory):
+            self.trajectory.pop(index)
 
     def replace_message_at(
         self, index, text_content, image_content=None, image_detail="high"
     ):
         """Replace a message at a given index"""
-        if index < len(self.messages):
-            self.messages[index] = {
-                "role": self.messages[index]["role"],
+        if index < len(self.trajectory):
+            message = {
+                "role": self.trajectory.message_at(index)["role"],
                 "content": [{"type": "text", "text": text_content}],
             }
             if image_content:
-                base64_image = self.encode_image(image_content)
-                self.messages[index]["content"].append(
+                message["content"].append(
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/png;base64,{base64_image}",
+                            "url": image_data_url(image_content),
                             "detail": image_detail,
                         },
                     }
                 )
+            self.trajectory.replace(index, message)
 
     def add_message(
         self,
@@ -181,10 +236,31 @@ class LMMAgent:
         put_text_last=False,
     ):
         """Add a new message to the list of messages"""
+        self.trajectory.append(
+            self.build_message(
+                text_content,
+                image_content=image_content,
+                role=role,
+                image_detail=image_detail,
+                put_text_last=put_text_last,
+            )
+        )
+
+    def build_message(
+        self,
+        text_content,
+        image_content=None,
+        role=None,
+        image_detail="high",
+        put_text_last=False,
+    ):
+        """Build a message in the engine's format without adding it to the list of messages"""
+        # A load-balanced engine takes the message format of its replicas
+        engine = getattr(self.engine, "primary_engine", self.engine)
 
         # API-style inference from OpenAI and AzureOpenAI
         if isinstance(
-            self.engine,
+            engine,
             (
                 LMMEngineOpenAI,
                 LMMEngineAzureOpenAI,
@@ -192,15 +268,16 @@ class LMMAgent:
                 LMMEngineGemini,
                 LMMEngineOpenRouter,
                 LMMEngineParasail,
+                LMMEngineReplay,
             ),
         ):
             # infer role from previous message
             if role != "user":
-                if self.messages[-1]["role"] == "system":
+                if self.trajectory.last()["role"] == "system":
                     role = "user"
-                elif self.messages[-1]["role"] == "user":
+                elif self.trajectory.last()["role"] == "user":
                     role = "assistant"
-                elif self.messages[-1]["role"] == "assistant":
+                elif self.trajectory.last()["role"] == "assistant":
                     role = "user"
 
             message = {
@@ -213,24 +290,22 @@ class LMMAgent:
                 if isinstance(image_content, list):
                     # If image_content is a list of images, loop through each image
                     for image in image_content:
-                        base64_image = self.encode_image(image)
                         message["content"].append(
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image/png;base64,{base64_image}",
+                                    "url": image_data_url(image),
                                     "detail": image_detail,
                                 },
                             }
                         )
                 else:
                     # If image_content is a single image, handle it directly
-                    base64_image = self.encode_image(image_content)
                     message["content"].append(
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}",
+                                "url": image_data_url(image_content),
                                 "detail": image_detail,
                             },
                         }
@@ -241,17 +316,17 @@ class LMMAgent:
                 text_content = message["content"].pop(0)
                 message["content"].append(text_content)
 
-            self.messages.append(message)
+            return message
 
         # For API-style inference from Anthropic
-        elif isinstance(self.engine, LMMEngineAnthropic):
+        elif isinstance(engine, LMMEngineAnthropic):
             # infer role from previous message
             if role != "user":
-                if self.messages[-1]["role"] == "system":
+                if self.trajectory.last()["role"] == "system":
                     role = "user"
-                elif self.messages[-1]["role"] == "user":
+                elif self.trajectory.last()["role"] == "user":
                     role = "assistant"
-                elif self.messages[-1]["role"] == "assistant":
+                elif self.trajectory.last()["role"] == "assistant":
                     role = "user"
 
             message = {
@@ -270,7 +345,7 @@ class LMMAgent:
                                 "type": "image",
                                 "source": {
                                     "type": "base64",
-                                    "media_type": "image/png",
+                                    "media_type": image_media_type(image),
                                     "data": base64_image,
                                 },
                             }
@@ -283,22 +358,22 @@ class LMMAgent:
                             "type": "image",
                             "source": {
                                 "type": "base64",
-                                "media_type": "image/png",
+                                "media_type": image_media_type(image_content),
                                 "data": base64_image,
                             },
                         }
                     )
-            self.messages.append(message)
+            return message
 
         # Locally hosted vLLM model inference
-        elif isinstance(self.engine, LMMEnginevLLM):
+        elif isinstance(engine, LMMEnginevLLM):
             # infer role from previous message
             if role != "user":
-                if self.messages[-1]["role"] == "system":
+                if self.trajectory.last()["role"] == "system":
                     role = "user"
-                elif self.messages[-1]["role"] == "user":
+                elif self.trajectory.last()["role"] == "user":
                     role = "assistant"
-                elif self.messages[-1]["role"] == "assistant":
+                elif self.trajectory.last()["role"] == "assistant":
                     role = "user"
 
             message = {
@@ -311,26 +386,26 @@ class LMMAgent:
                 if isinstance(image_content, list):
                     # If image_content is a list of images, loop through each image
                     for image in image_content:
-                        base64_image = self.encode_image(image)
                         message["content"].append(
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image;base64,{base64_image}"
+                                    "url": image_data_url(image, media_type="image")
                                 },
                             }
                         )
                 else:
                     # If image_content is a single image, handle it directly
-                    base64_image = self.encode_image(image_content)
                     message["content"].append(
                         {
                             "type": "image_url",
-                            "image_url": {"url": f"data:image;base64,{base64_image}"},
+                            "image_url": {
+                                "url": image_data_url(image_content, media_type="image")
+                            },
                         }
                     )
 
-            self.messages.append(message)
+            return message
         else:
             raise ValueError("engine_type is not supported")
 
@@ -344,25 +419,130 @@ class LMMAgent:
         **kwargs,
     ):
         """Generate the next response based on previous messages"""
+        if user_message:
+            user_turn = {
+                "role": "user",
+                "content": [{"type": "text", "text": user_message}],
+            }
+            if messages is None:
+                self.trajectory.append(user_turn)
+            else:
+                messages.append(user_turn)
         if messages is None:
             messages = self.messages
-        if user_message:
-            messages.append(
-                {"role": "user", "content": [{"type": "text", "text": user_message}]}
+        if self.context_packer is not None:
+            messages = self.context_packer.pack(messages)
+
+        stop_when = kwargs.pop("stop_when", None)
+        if self.early_stop and stop_when is not None:
+            kwargs["stop_when"] = stop_when
+        with track_llm_call(self.role, getattr(self.engine, "model", None)) as call:
+            cache_key = self._cache_key(
+                messages, temperature, max_new_tokens, use_thinking, kwargs
             )
+            if cache_key is not None:
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    call["cached_response"] = True
+                    return cached
+
+            # Regular generation
+            if use_thinking:
+                response = self.engine.generate_with_thinking(
+                    messages,
+                    temperature=temperature,
+                    max_new_tokens=max_new_tokens,
+                    **kwargs,
+                )
+            else:
+                response = self.engine.generate(
+                    messages,
+                    temperature=temperature,
+                    max_new_tokens=max_new_tokens,
+                    **kwargs,
+                )
 
-        # Regular generation
-        if use_thinking:
-            return self.engine.generate_with_thinking(
-                messages,
-                temperature=temperature,
-                max_new_tokens=max_new_tokens,
-                **kwargs,
+            if cache_key is not None:
+                self.response_cache.put(cache_key, response)
+            return response
+
+    async def aget_response(
+        self,
+        user_message=None,
+        messages=None,
+        temperature=0.0,
+        max_new_tokens=None,
+        use_thinking=False,
+        **kwargs,
+    ):
+        """Async version of get_response, lets independent calls overlap on one event loop"""
+        if user_message:
+            user_turn = {
+                "role": "user",
+                "content": [{"type": "text", "text": user_message}],
+            }
+            if messages is None:
+                self.trajectory.append(user_turn)
+            else:
+                messages.append(user_turn)
+        if messages is None:
+            messages = self.messages
+        if self.context_packer is not None:
+            messages = self.context_packer.pack(messages)
+
+        stop_when = kwargs.pop("stop_when", None)
+        if self.early_stop and stop_when is not None:
+            kwargs["stop_when"] = stop_when
+        with track_llm_call(self.role, getattr(self.engine, "model", None)) as call:
+            cache_key = self._cache_key(
+                messages, temperature, max_new_tokens, use_thinking, kwargs
             )
+            if cache_key is not None:
+                cached = await asyncio.to_thread(self.response_cache.get, cache_key)
+                if cached is not None:
+                    call["cached_response"] = True
+                    return cached
+
+            if use_thinking:
+                response = await self.engine.agenerate_with_thinking(
+                    messages,
+                    temperature=temperature,
+                    max_new_tokens=max_new_tokens,
+                    **kwargs,
+                )
+            else:
+                response = await self.engine.agenerate(
+                    messages,
+                    temperature=temperature,
+                    max_new_tokens=max_new_tokens,
+                    **kwargs,
+                )
 
-        return self.engine.generate(
+            if cache_key is not None:
+                await asyncio.to_thread(self.response_cache.put, cache_key, response)
+            return response
+
+    def _cache_key(self, messages, temperature, max_new_tokens, use_thinking, kwargs):
+        """Key of the request in the response cache, None when the call is not cached"""
+        if self.response_cache is None:
+            return None
+        # Engines may pin the temperature regardless of what the caller asks for
+        forced_temperature = getattr(self.engine, "temperature", None)
+        if forced_temperature is not None:
+            temperature = forced_temperature
+        if temperature != 0 and not self.cache_sampled:
+            return None
+        params = dict(kwargs)
+        if params.get("stop_when") is not None:
+            # Identify the detector by name, its repr changes between runs
+            params["stop_when"] = params["stop_when"].__qualname__
+        return make_cache_key(
+            getattr(self.engine, "model", None),
             messages,
-            temperature=temperature,
+            temperature,
+            method="generate_with_thinking" if use_thinking else "generate",
+            engine=type(getattr(self.engine, "primary_engine", self.engine)).__name__,
+            thinking=getattr(self.engine, "thinking", False),
             max_new_tokens=max_new_tokens,
-            **kwargs,
+            **params,
         )
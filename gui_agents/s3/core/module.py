@@ -1,5 +1,6 @@
 from typing import Dict, Optional
 from gui_agents.s3.core.mllm import LMMAgent
+from gui_agents.s3.core.trajectory import TrajectoryStore
 
 
 class BaseModule:
@@ -8,10 +9,16 @@ class BaseModule:
         self.platform = platform
 
     def _create_agent(
-        self, system_prompt: str = None, engine_params: Optional[Dict] = None
+        self,
+        system_prompt: str = None,
+        engine_params: Optional[Dict] = None,
+        role: Optional[str] = None,
+        trajectory: Optional[TrajectoryStore] = None,
     ) -> LMMAgent:
         """Create a new LMMAgent instance"""
-        agent = LMMAgent(engine_params or self.engine_params)
+        agent = LMMAgent(
+            engine_params or self.engine_params, role=role, trajectory=trajectory
+        )
         if system_prompt:
             agent.add_system_prompt(system_prompt)
         return agent
@@ -0,0 +1,245 @@
+"""Token-bucket rate limiting shared by every process that talks to the same LLM endpoint."""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock, fall back to a per-process bucket
+    fcntl = None
+
+logger = logging.getLogger("desktopenv.agent")
+
+# Directory holding one bucket state file per (provider, base_url, model)
+DEFAULT_RATE_LIMIT_DIR = os.path.join(tempfile.gettempdir(), "gui_agents_rate_limits")
+
+# Rough token cost used for rate limiting when the real count is not known yet
+CHARS_PER_TOKEN = 4
+IMAGE_TOKEN_ESTIMATE = 1500
+
+
+def estimate_tokens(messages: List[Dict]) -> int:
+    """Cheaply estimate the prompt tokens of a list of chat messages.
+
+    Args:
+        messages (List[Dict]): Messages in OpenAI or Anthropic format.
+
+    Returns:
+        int: The estimated number of prompt tokens.
+    """
+    num_chars = 0
+    num_images = 0
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, str):
+            num_chars += len(content)
+            continue
+        for item in content:
+            if "image" in item.get("type", ""):
+                num_images += 1
+            else:
+                num_chars += len(item.get("text", ""))
+    return num_chars // CHARS_PER_TOKEN + num_images * IMAGE_TOKEN_ESTIMATE
+
+
+class RateLimiter:
+    """Token bucket over requests-per-minute and tokens-per-minute budgets.
+
+    The bucket state lives in a small JSON file guarded by an exclusive file lock, so every
+    process limiting the same key draws from one shared budget. Each bucket holds at most one
+    minute of allowance and refills continuously at ``headroom`` times the configured rate, which
+    keeps aggregate throughput just below the provider ceiling.
+    """
+
+    def __init__(
+        self,
+        key: Tuple,
+        requests_per_minute: float = -1,
+        tokens_per_minute: float = -1,
+        headroom: float = 0.95,
+        state_dir: Optional[str] = None,
+    ):
+        """
+        Args:
+            key: Tuple
+                Identifies the shared budget, usually (provider, base_url, model)
+            requests_per_minute: float
+                Request budget, -1 disables it
+            tokens_per_minute: float
+                Token budget (prompt + completion), -1 disables it
+            headroom: float
+                Fraction of the configured budgets to actually use
+            state_dir: str
+                Directory for the bucket state files, defaults to $AGENT_S_RATE_LIMIT_DIR or the temp dir
+        """
+        self.key = key
+        self.requests_per_minute = requests_per_minute or -1
+        self.tokens_per_minute = tokens_per_minute or -1
+        self.headroom = headroom
+        self._thread_lock = threading.Lock()
+
+        self.state_path = None
+        if self.enabled and fcntl is not None:
+            state_dir = (
+                state_dir
+                or os.getenv("AGENT_S_RATE_LIMIT_DIR")
+                or DEFAULT_RATE_LIMIT_DIR
+            )
+            os.makedirs(state_dir, exist_ok=True)
+            digest = hashlib.sha1("|".join(map(str, key)).encode("utf-8")).hexdigest()
+            self.state_path = os.path.join(state_dir, f"{digest[:16]}.json")
+        elif self.enabled:
+            logger.warning(
+                "File locking is unavailable, rate limit for %s is enforced per process only",
+                key,
+            )
+        self._local_state = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests_per_minute > 0 or self.tokens_per_minute > 0
+
+    def _budgets(self) -> Dict[str, float]:
+        """Effective per-minute rate of every active bucket."""
+        budgets = {}
+        if self.requests_per_minute > 0:
+            budgets["requests"] = self.requests_per_minute * self.headroom
+        if self.tokens_per_minute > 0:
+            budgets["tokens"] = self.tokens_per_minute * self.headroom
+        return budgets
+
+    @contextmanager
+    def _locked_state(self):
+        """Yield the bucket state dict with the cross-process lock held, persisting changes on exit."""
+        with self._thread_lock:
+            if self.state_path is None:
+                yield self._local_state
+                return
+            with open(self.state_path, "a+", encoding="utf-8") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        state = json.loads(f.read() or "{}")
+                    except json.JSONDecodeError:
+                        state = {}
+                    yield state
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _refill(self, state: Dict, budgets: Dict[str, float], now: float):
+        elapsed = max(0.0, now - state.get("updated", now))
+        for name, rate in budgets.items():
+            available = state.get(name, rate)
+            state[name] = min(rate, available + elapsed * rate / 60.0)
+        state["updated"] = now
+
+    def _try_acquire(self, tokens: int) -> float:
+        """Take one request and ``tokens`` tokens if available.
+
+        Returns:
+            float: 0 if the budget was taken, otherwise the seconds to wait before retrying.
+        """
+        budgets = self._budgets()
+        needed = {"requests": 1, "tokens": tokens}
+        with self._locked_state() as state:
+            self._refill(state, budgets, time.time())
+            wait = 0.0
+            for name, rate in budgets.items():
+                # A single request larger than the whole bucket would otherwise never pass
+                need = min(needed[name], rate)
+                if state[name] < need:
+                    wait = max(wait, (need - state[name]) * 60.0 / rate)
+            if wait == 0.0:
+                for name, rate in budgets.items():
+                    state[name] -= min(needed[name], rate)
+            return wait
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Block until the request fits within every budget.
+
+        Args:
+            tokens (int): Estimated tokens the request will consume.
+
+        Returns:
+            float: Total seconds spent waiting.
+        """
+        if not self.enabled:
+            return 0.0
+        waited = 0.0
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait == 0.0:
+                if waited > 0:
+                    logger.debug("Rate limiter %s waited %.2fs", self.key, waited)
+                return waited
+            # Jitter keeps processes that woke up together from colliding again
+            wait += random.uniform(0, 0.05)
+            time.sleep(wait)
+            waited += wait
+
+    async def aacquire(self, tokens: int = 0) -> float:
+        """Async version of acquire that yields to the event loop while waiting."""
+        if not self.enabled:
+            return 0.0
+        waited = 0.0
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait == 0.0:
+                if waited > 0:
+                    logger.debug("Rate limiter %s waited %.2fs", self.key, waited)
+                return waited
+            wait += random.uniform(0, 0.05)
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def adjust(self, tokens: int):
+        """Correct the token bucket once the real usage of a request is known.
+
+        Args:
+            tokens (int): Actual tokens minus the estimate passed to acquire, may be negative.
+        """
+        if self.tokens_per_minute <= 0 or not tokens:
+            return
+        budgets = self._budgets()
+        with self._locked_state() as state:
+            self._refill(state, budgets, time.time())
+            rate = budgets["tokens"]
+            state["tokens"] = max(-rate, min(rate, state["tokens"] - tokens))
+
+
+_rate_limiters: Dict[Tuple, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(
+    provider: str,
+    base_url: Optional[str],
+    model: Optional[str],
+    requests_per_minute: float = -1,
+    tokens_per_minute: float = -1,
+) -> RateLimiter:
+    """Return the process-wide limiter for an endpoint, creating it on first use."""
+    key = (provider, base_url or "default", model or "default")
+    with _rate_limiters_lock:
+        registry_key = (key, requests_per_minute, tokens_per_minute)
+        if registry_key not in _rate_limiters:
+            _rate_limiters[registry_key] = RateLimiter(
+                key,
+                requests_per_minute=requests_per_minute,
+                tokens_per_minute=tokens_per_minute,
+            )
+        return _rate_limiters[registry_key]
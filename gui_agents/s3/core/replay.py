@@ -0,0 +1,154 @@
+"""Scripted model responses and synthetic latencies, used to run the agent loop without live endpoints."""
+
+import itertools
+import json
+import os
+import random
+import threading
+from typing import Dict, List, Optional, Union
+
+# Trajectory fields holding the responses of each agent role
+TRAJECTORY_FIELDS = {"generator": "plan", "reflection": "reflection"}
+
+
+class LatencyModel:
+    """Samples synthetic request latencies in seconds.
+
+    A spec is either a number of seconds, or a dict with a ``distribution`` key:
+    ``{"distribution": "fixed", "value": 1.0}``,
+    ``{"distribution": "uniform", "low": 0.5, "high": 2.0}``,
+    ``{"distribution": "normal", "mean": 1.0, "std": 0.2}`` or
+    ``{"distribution": "lognormal", "median": 1.0, "sigma": 0.5}``.
+    """
+
+    def __init__(self, spec: Union[None, float, Dict] = None, seed=None):
+        self.spec = spec
+        self._random = random.Random(seed)
+
+    def sample(self) -> float:
+        spec = self.spec
+        if not spec:
+            return 0.0
+        if isinstance(spec, (int, float)):
+            return float(spec)
+        distribution = spec.get("distribution", "fixed")
+        if distribution == "fixed":
+            return float(spec["value"])
+        if distribution == "uniform":
+            return self._random.uniform(spec["low"], spec["high"])
+        if distribution == "normal":
+            return max(0.0, self._random.gauss(spec["mean"], spec["std"]))
+        if distribution == "lognormal":
+            # Parameterized by the median, which is easier to read off latency dashboards
+            median = spec["median"]
+            return self._random.lognormvariate(0, spec["sigma"]) * median
+        raise ValueError(f"Unknown latency distribution '{distribution}'")
+
+
+class ReplayScript:
+    """Per-key queues of canned responses with per-key latency models.
+
+    Keys are agent roles (generator, reflection, grounding, ...) for the replay engine and model
+    names for the stub server, ``default`` is used for keys without their own entry. Each queue
+    cycles once exhausted, so a short script can drive an arbitrarily long run.
+    """
+
+    def __init__(
+        self,
+        responses: Optional[Dict[str, List[str]]] = None,
+        latency: Union[None, float, Dict] = None,
+        seed=None,
+    ):
+        """
+        Args:
+            responses: Dict[str, List[str]]
+                Canned responses per key
+            latency: float or Dict
+                A single latency spec, or a dict of specs per key (see LatencyModel)
+            seed: int
+                Seed of the latency sampling
+        """
+        self.responses = {key: list(value) for key, value in (responses or {}).items()}
+        self._cycles = {
+            key: itertools.cycle(value)
+            for key, value in self.responses.items()
+            if value
+        }
+        if isinstance(latency, dict) and "distribution" not in latency:
+            self._latencies = {
+                key: LatencyModel(spec, seed) for key, spec in latency.items()
+            }
+        else:
+            self._latencies = {"default": LatencyModel(latency, seed)}
+        self._lock = threading.Lock()
+
+    def _resolve(self, table: Dict, key: Optional[str]):
+        if key in table:
+            return table[key]
+        return table.get("default")
+
+    def next_response(self, key: Optional[str], fallback: Optional[str] = None) -> str:
+        """Return the next canned response for ``key``.
+
+        Raises:
+            KeyError: If neither ``key`` nor ``default`` has responses and no fallback is given.
+        """
+        with self._lock:
+            responses = self._resolve(self._cycles, key)
+            if responses is not None:
+                return next(responses)
+        if fallback is not None:
+            return fallback
+        raise KeyError(f"The replay script has no responses for '{key}'")
+
+    def sample_latency(self, key: Optional[str]) -> float:
+        latency = self._resolve(self._latencies, key)
+        return latency.sample() if latency is not None else 0.0
+
+    @classmethod
+    def from_file(
+        cls, path: str, latency: Union[None, float, Dict] = None, seed=None
+    ) -> "ReplayScript":
+        """Load a script from a fixture or a recorded trajectory.
+
+        Args:
+            path (str): A JSON fixture ``{"responses": {...}, "latency": ...}``, a ``traj.jsonl``
+                file, or a result directory containing one.
+            latency (float or Dict): Overrides the latency of the fixture.
+            seed (int): Seed of the latency sampling.
+
+        Returns:
+            ReplayScript: The loaded script.
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, "traj.jsonl")
+        if path.endswith(".jsonl"):
+            return cls(load_trajectory_responses(path), latency=latency, seed=seed)
+        with open(path, "r", encoding="utf-8") as f:
+            fixture = json.load(f)
+        return cls(
+            fixture.get("responses", {}),
+            latency=latency if latency is not None else fixture.get("latency"),
+            seed=seed,
+        )
+
+
+def load_trajectory_responses(traj_path: str) -> Dict[str, List[str]]:
+    """Extract the recorded generator and reflection responses of a ``traj.jsonl``.
+
+    Args:
+        traj_path (str): Path of the trajectory written by lib_run_single.
+
+    Returns:
+        Dict[str, List[str]]: Responses per role, in step order.
+    """
+    responses = {role: [] for role in TRAJECTORY_FIELDS}
+    with open(traj_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            step = json.loads(line)
+            for role, field in TRAJECTORY_FIELDS.items():
+                if step.get(field):
+                    responses[role].append(step[field])
+    return responses
@@ -0,0 +1,256 @@
+"""Content-addressed on-disk cache of LLM responses, used to make re-runs cheap and repeatable."""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("desktopenv.agent")
+
+# Cache modes
+# read_write: serve hits, store misses
+# read_only: serve hits, never write (misses still call the model)
+# record: always call the model and overwrite the stored response
+CACHE_MODES = ("read_write", "read_only", "record")
+
+DEFAULT_MAX_SIZE_MB = 1024
+
+# Evict down to this fraction of the size bound so eviction does not run on every insert
+EVICTION_TARGET = 0.9
+
+
+def _hash_data_url(url: str) -> str:
+    """Hash an image data URL by its decoded bytes, so equal images share a key."""
+    if url.startswith("data:") and "," in url:
+        url = url.split(",", 1)[1]
+        try:
+            return hashlib.sha256(base64.b64decode(url)).hexdigest()
+        except ValueError:
+            pass
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def normalize_messages(messages: List[Dict]) -> List[Dict]:
+    """Reduce messages to a provider-agnostic form suitable for hashing.
+
+    String contents become a single text item, and every image (OpenAI ``image_url`` or
+    Anthropic ``image`` item) is replaced by the SHA-256 of its decoded bytes, so
+    re-encoding the same screenshot or switching image detail does not change the key.
+
+    Args:
+        messages (List[Dict]): Messages in OpenAI or Anthropic format.
+
+    Returns:
+        List[Dict]: The normalized messages.
+    """
+    normalized = []
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        items = []
+        for item in content:
+            item_type = item.get("type", "")
+            if item_type == "image_url":
+                items.append(
+                    {
+                        "type": "image",
+                        "sha256": _hash_data_url(item["image_url"]["url"]),
+                    }
+                )
+            elif item_type == "image":
+                source = item.get("source", {})
+                digest = hashlib.sha256(
+                    base64.b64decode(source.get("data", ""))
+                ).hexdigest()
+                items.append({"type": "image", "sha256": digest})
+            else:
+                items.append(item)
+        normalized.append({"role": message.get("role"), "content": items})
+    return normalized
+
+
+def make_cache_key(
+    model: Optional[str],
+    messages: List[Dict],
+    temperature: Optional[float],
+    method: str = "generate",
+    **params,
+) -> str:
+    """Build the stable key of a request.
+
+    Args:
+        model (str): The model name.
+        messages (List[Dict]): The request messages.
+        temperature (float): The temperature actually sent to the model.
+        method (str): The engine method, e.g. "generate" or "generate_with_thinking".
+        **params: Any other request parameters that change the response.
+
+    Returns:
+        str: Hex digest identifying the request.
+    """
+    payload = {
+        "model": model,
+        "temperature": temperature,
+        "method": method,
+        "params": params,
+        "messages": normalize_messages(messages),
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed response store with size-bounded LRU eviction.
+
+    SQLite takes care of locking, so one cache file can be shared by every environment
+    process of a run.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        mode: str = "read_write",
+        max_size_mb: float = DEFAULT_MAX_SIZE_MB,
+    ):
+        """
+        Args:
+            cache_dir: str
+                Directory holding the ``llm_cache.sqlite`` database
+            mode: str
+                One of read_write, read_only or record
+            max_size_mb: float
+                Bound on the stored response bytes, least recently used entries are evicted first
+        """
+        if mode not in CACHE_MODES:
+            raise ValueError(
+                f"Unknown cache mode '{mode}', expected one of {', '.join(CACHE_MODES)}"
+            )
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "llm_cache.sqlite")
+        self.mode = mode
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)"
+            )
+            # Running total of the stored sizes, kept in the database so every process sharing
+            # the file sees the same one; created from the entries of older cache files
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage (id INTEGER PRIMARY KEY CHECK (id = 0), "
+                "total INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "INSERT OR IGNORE INTO usage SELECT 0, COALESCE(SUM(size), 0) FROM responses"
+            )
+
+    @property
+    def readable(self) -> bool:
+        return self.mode in ("read_write", "read_only")
+
+    @property
+    def writable(self) -> bool:
+        return self.mode in ("read_write", "record")
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the stored response for ``key``, or None on a miss."""
+        if not self.readable:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if self.writable:
+                with self._conn:
+                    self._conn.execute(
+                        "UPDATE responses SET last_access = ? WHERE key = ?",
+                        (time.time(), key),
+                    )
+        return json.loads(row[0])
+
+    def put(self, key: str, response):
+        """Store a response, evicting least recently used entries past the size bound."""
+        if not self.writable or response is None:
+            return
+        encoded = json.dumps(response)
+        now = time.time()
+        with self._lock, self._conn:
+            replaced = self._conn.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, encoded, len(encoded), now, now),
+            )
+            self._add_usage(len(encoded) - (replaced[0] if replaced else 0))
+            self._evict()
+
+    def _add_usage(self, delta: int):
+        self._conn.execute("UPDATE usage SET total = total + ? WHERE id = 0", (delta,))
+
+    def size(self) -> int:
+        """Stored response bytes"""
+        with self._lock:
+            return self._conn.execute("SELECT total FROM usage").fetchone()[0]
+
+    def _evict(self):
+        total = self._conn.execute("SELECT total FROM usage").fetchone()[0]
+        if total <= self.max_size_bytes:
+            return
+        target = self.max_size_bytes * EVICTION_TARGET
+        evicted = 0
+        freed = 0
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access"
+        ).fetchall():
+            if total - freed <= target:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            freed += size
+            evicted += 1
+        self._add_usage(-freed)
+        logger.debug("Response cache %s evicted %d entries", self.path, evicted)
+
+
+_response_caches: Dict[tuple, ResponseCache] = {}
+_response_caches_lock = threading.Lock()
+
+
+def get_response_cache(engine_params: Optional[Dict]) -> Optional[ResponseCache]:
+    """Return the process-wide cache configured by ``engine_params``, if caching is enabled.
+
+    Caching is opt-in through the ``cache_dir`` engine param, with ``cache_mode`` and
+    ``cache_max_size_mb`` refining it. Only greedy (temperature 0) calls are cached unless
+    ``cache_sampled`` is set, see LMMAgent.
+    """
+    if not engine_params or not engine_params.get("cache_dir"):
+        return None
+    cache_dir = engine_params["cache_dir"]
+    mode = engine_params.get("cache_mode") or "read_write"
+    max_size_mb = engine_params.get("cache_max_size_mb") or DEFAULT_MAX_SIZE_MB
+    with _response_caches_lock:
+        registry_key = (os.path.abspath(cache_dir), mode, max_size_mb)
+        if registry_key not in _response_caches:
+            _response_caches[registry_key] = ResponseCache(
+                cache_dir, mode=mode, max_size_mb=max_size_mb
+            )
+        return _response_caches[registry_key]
@@ -0,0 +1,327 @@
+"""Single retry layer of the engines: jittered backoff honouring Retry-After, a per-call deadline
+and per-endpoint circuit breakers that fail fast while a backend is down."""
+
+import asyncio
+import email.utils
+import functools
+import logging
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import anthropic
+import httpx
+import openai
+
+from gui_agents.s3.core.telemetry import record_retry
+
+logger = logging.getLogger("desktopenv.agent")
+
+# Status codes worth retrying, anything else in the 4xx range is a bug in the request
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+_TRANSPORT_ERRORS = (
+    openai.APIConnectionError,
+    anthropic.APIConnectionError,
+    httpx.TransportError,
+)
+_STATUS_ERRORS = (openai.APIStatusError, anthropic.APIStatusError)
+
+# Retry and breaker policy; set AGENT_S_RETRY_* / AGENT_S_BREAKER_* before the run, or call
+# configure_retries from each worker process
+_retry_settings = {
+    "max_attempts": int(os.getenv("AGENT_S_RETRY_MAX_ATTEMPTS", "6")),
+    "base_delay": float(os.getenv("AGENT_S_RETRY_BASE_DELAY", "1.0")),
+    "max_delay": float(os.getenv("AGENT_S_RETRY_MAX_DELAY", "30.0")),
+    "deadline": float(os.getenv("AGENT_S_RETRY_DEADLINE", "120.0")),
+    "failure_threshold": int(os.getenv("AGENT_S_BREAKER_FAILURES", "5")),
+    "reset_timeout": float(os.getenv("AGENT_S_BREAKER_RESET", "30.0")),
+    # Timeout of a single attempt, None keeps the client's default (DEFAULT_TIMEOUT)
+    "request_timeout": (
+        float(os.environ["AGENT_S_REQUEST_TIMEOUT"])
+        if os.getenv("AGENT_S_REQUEST_TIMEOUT")
+        else None
+    ),
+}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without contacting the endpoint while its circuit breaker is open."""
+
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(
+            f"Circuit open for {endpoint}, next probe in {max(retry_in, 0):.1f}s"
+        )
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+def configure_retries(
+    max_attempts: Optional[int] = None,
+    base_delay: Optional[float] = None,
+    max_delay: Optional[float] = None,
+    deadline: Optional[float] = None,
+    failure_threshold: Optional[int] = None,
+    reset_timeout: Optional[float] = None,
+    request_timeout: Optional[float] = None,
+):
+    """Tune the retry policy and the circuit breakers created from now on.
+
+    Args:
+        max_attempts (int): Attempts per call, including the first one.
+        base_delay (float): Backoff before the first retry, doubled on every attempt.
+        max_delay (float): Cap of a single backoff.
+        deadline (float): Seconds after which a call stops retrying. It bounds the backoff
+            and whether another attempt starts, not how long an attempt may run.
+        failure_threshold (int): Consecutive endpoint failures that open its breaker.
+        reset_timeout (float): Seconds an open breaker waits before letting a probe through.
+        request_timeout (float): Timeout of a single attempt, by default the client's own.
+    """
+    overrides = {
+        "max_attempts": max_attempts,
+        "base_delay": base_delay,
+        "max_delay": max_delay,
+        "deadline": deadline,
+        "failure_threshold": failure_threshold,
+        "reset_timeout": reset_timeout,
+        "request_timeout": request_timeout,
+    }
+    _retry_settings.update({k: v for k, v in overrides.items() if v is not None})
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    if isinstance(error, _STATUS_ERRORS):
+        return error.status_code
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether the error is transient: a connection failure, a timeout, throttling or a 5xx."""
+    if isinstance(error, _TRANSPORT_ERRORS):
+        return True
+    status = _status_code(error)
+    return status is not None and (status in RETRYABLE_STATUS_CODES or status >= 500)
+
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """Whether the error says the endpoint is unhealthy, throttling does not count."""
+    if isinstance(error, _TRANSPORT_ERRORS):
+        return True
+    status = _status_code(error)
+    return status is not None and status >= 500
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the provider asked to wait, from the retry-after-ms or Retry-After header."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    # Retry-After may also be an HTTP date
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, parsed.timestamp() - time.time())
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker of one endpoint.
+
+    After ``failure_threshold`` consecutive endpoint failures the breaker opens and calls fail
+    with CircuitOpenError. Once ``reset_timeout`` has passed a single probe is let through, its
+    success closes the breaker and its failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def is_open(self) -> bool:
+        """True while calls would be rejected without reaching the endpoint."""
+        state = self.state
+        return state == "open" or (state == "half_open" and self._probing)
+
+    def before_call(self):
+        """Admit a call or raise CircuitOpenError."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return
+            raise CircuitOpenError(
+                self.name, self.opened_at + self.reset_timeout - time.monotonic()
+            )
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._probing:
+                    logger.warning(
+                        "Opening circuit breaker of %s after %d failures",
+                        self.name,
+                        self.failures,
+                    )
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def release(self):
+        """End a probe that neither succeeded nor failed on the endpoint's account."""
+        with self._lock:
+            self._probing = False
+
+
+_breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(provider: str, endpoint: Optional[str]) -> CircuitBreaker:
+    """Return the process-wide breaker of an endpoint.
+
+    Args:
+        provider (str): Provider name, e.g. openai or anthropic.
+        endpoint (str): Base URL of the endpoint, None for the provider's default one.
+
+    Returns:
+        CircuitBreaker: The breaker shared by every engine calling this endpoint.
+    """
+    key = (provider, endpoint or "default")
+    with _breakers_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker(
+                f"{provider}:{endpoint or 'default'}",
+                _retry_settings["failure_threshold"],
+                _retry_settings["reset_timeout"],
+            )
+        return _breakers[key]
+
+
+def request_timeout() -> Optional[float]:
+    """Configured timeout of a single request, None to keep the client's default."""
+    return _retry_settings["request_timeout"]
+
+
+def _backoff_delay(attempt: int, error: Exception) -> float:
+    requested = retry_after(error)
+    if requested is not None:
+        return requested
+    # Full jitter keeps parallel workers from retrying in lockstep
+    cap = min(
+        _retry_settings["max_delay"], _retry_settings["base_delay"] * 2 ** (attempt - 1)
+    )
+    return random.uniform(0, cap)
+
+
+def _next_delay(attempt: int, error: Exception, deadline: float) -> Optional[float]:
+    """The wait before the next attempt, or None when the error must be raised."""
+    if not is_retryable(error) or attempt >= _retry_settings["max_attempts"]:
+        return None
+    delay = _backoff_delay(attempt, error)
+    if time.monotonic() + delay >= deadline:
+        logger.warning("Giving up retrying %r, its deadline would pass", error)
+        return None
+    record_retry()
+    logger.info("Retrying in %.1fs after %r (attempt %d)", delay, error, attempt)
+    return delay
+
+
+def _settle(breaker: CircuitBreaker, error: Optional[Exception]):
+    if error is None:
+        breaker.record_success()
+    elif is_endpoint_failure(error):
+        breaker.record_failure()
+    else:
+        breaker.release()
+
+
+def with_retries(method):
+    """Decorate an engine method (sync or async) with the retry policy and its endpoint breaker.
+
+    The engine must provide ``circuit_breaker()``. Transient errors are retried with jittered
+    exponential backoff, or after the delay requested through Retry-After, until the attempts
+    or the deadline run out. Other errors and CircuitOpenError are raised immediately.
+    """
+    if asyncio.iscoroutinefunction(method):
+
+        @functools.wraps(method)
+        async def async_wrapper(self, *args, **kwargs):
+            breaker = self.circuit_breaker()
+            deadline = time.monotonic() + _retry_settings["deadline"]
+            attempt = 0
+            while True:
+                attempt += 1
+                breaker.before_call()
+                try:
+                    result = await method(self, *args, **kwargs)
+                except Exception as e:
+                    _settle(breaker, e)
+                    delay = _next_delay(attempt, e, deadline)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    continue
+                _settle(breaker, None)
+                return result
+
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        breaker = self.circuit_breaker()
+        deadline = time.monotonic() + _retry_settings["deadline"]
+        attempt = 0
+        while True:
+            attempt += 1
+            breaker.before_call()
+            try:
+                result = method(self, *args, **kwargs)
+            except Exception as e:
+                _settle(breaker, e)
+                delay = _next_delay(attempt, e, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            _settle(breaker, None)
+            return result
+
+    return wrapper
@@ -0,0 +1,156 @@
+"""Incremental JSON serialization of request bodies, reusing the bytes of the stable message prefix."""
+
+import json
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+def dumps(value) -> bytes:
+    # Same settings httpx uses for json= bodies, so the payload matches what the SDKs would send
+    return json.dumps(
+        value, ensure_ascii=False, separators=(",", ":"), allow_nan=False
+    ).encode("utf-8")
+
+
+class RequestSerializer:
+    """Builds request bodies while keeping the serialized messages of the previous request.
+
+    Agent histories only ever grow at the tail and their messages are never mutated (see
+    TrajectoryStore), so a message object seen in the previous request serializes to the same
+    bytes. The longest run of such messages at the head of the list is copied from the previous
+    body rather than re-encoded, which keeps it byte-identical across steps. Past that run, when
+    the window drops a turn or an image, the bytes of each message, or of each content item of
+    a rebuilt message, seen in the previous request are spliced in; only new objects, typically
+    the latest user turn and its screenshot, are serialized.
+    """
+
+    def __init__(self, messages_key: str = "messages"):
+        """
+        Args:
+            messages_key: str
+                Body field holding the growing list of messages
+        """
+        self.messages_key = messages_key
+        # Messages of the previous request, held so their ids stay valid, and the end offset of each in _joined
+        self._messages: List[Dict] = []
+        self._offsets: List[int] = []
+        self._joined = b""
+        # Encoded messages and content items of the previous request by id, with the object
+        # held so the id cannot be reused
+        self._encoded_messages: Dict[int, Tuple[Dict, bytes]] = {}
+        self._encoded_items: Dict[int, Tuple[Dict, bytes]] = {}
+        self._lock = threading.Lock()
+        self.reused_bytes = 0
+        self.serialized_bytes = 0
+
+    def _common_prefix(self, messages: List[Dict]) -> int:
+        count = 0
+        for previous, message in zip(self._messages, messages):
+            if previous is not message:
+                break
+            count += 1
+        return count
+
+    @staticmethod
+    def _cached(cache: Dict, kept: Dict, value: Dict) -> Optional[bytes]:
+        """Encoded bytes of an object seen in the previous request, kept for the next one."""
+        entry = cache.get(id(value))
+        if entry is None or entry[0] is not value:
+            return None
+        kept[id(value)] = entry
+        return entry[1]
+
+    def _retain(self, message: Dict, messages: Dict, items: Dict) -> Optional[bytes]:
+        """Encoded bytes of a message of the previous request, keeping them and its items."""
+        encoded = self._cached(self._encoded_messages, messages, message)
+        if encoded is not None and isinstance(message.get("content"), list):
+            for item in message["content"]:
+                self._cached(self._encoded_items, items, item)
+        return encoded
+
+    def _encode_message(self, message: Dict, messages: Dict, items: Dict) -> bytes:
+        """Encoded message, splicing in the bytes of known content items."""
+        encoded = self._retain(message, messages, items)
+        if encoded is not None:
+            self.reused_bytes += len(encoded)
+            return encoded
+        content = message.get("content")
+        if not isinstance(content, list):
+            encoded = dumps(message)
+            self.serialized_bytes += len(encoded)
+        else:
+            parts = []
+            reused = 0
+            for item in content:
+                encoded_item = self._cached(self._encoded_items, items, item)
+                if encoded_item is not None:
+                    reused += len(encoded_item)
+                else:
+                    encoded_item = dumps(item)
+                    items[id(item)] = (item, encoded_item)
+                parts.append(encoded_item)
+            # Same layout as dumps, fields in insertion order
+            fields = [
+                dumps(key)
+                + b":"
+                + (b"[" + b",".join(parts) + b"]" if key == "content" else dumps(value))
+                for key, value in message.items()
+            ]
+            encoded = b"{" + b",".join(fields) + b"}"
+            self.reused_bytes += reused
+            self.serialized_bytes += len(encoded) - reused
+        messages[id(message)] = (message, encoded)
+        return encoded
+
+    def _join_messages(self, messages: List[Dict]) -> bytes:
+        with self._lock:
+            reused = self._common_prefix(messages)
+            joined = self._joined[: self._offsets[reused - 1]] if reused else b""
+            offsets = self._offsets[:reused]
+            parts = [joined]
+            length = len(joined)
+            kept_messages, kept_items = {}, {}
+            for message in messages[:reused]:
+                self._retain(message, kept_messages, kept_items)
+            for message in messages[reused:]:
+                encoded = self._encode_message(message, kept_messages, kept_items)
+                if length:
+                    parts.append(b",")
+                    length += 1
+                parts.append(encoded)
+                length += len(encoded)
+                offsets.append(length)
+            self.reused_bytes += len(joined)
+            self._encoded_messages = kept_messages
+            self._encoded_items = kept_items
+            self._joined = b"".join(parts)
+            self._messages = list(messages)
+            self._offsets = offsets
+            return self._joined
+
+    def serialize(self, params: Dict) -> bytes:
+        """JSON body of a request.
+
+        Args:
+            params (Dict): Keyword arguments the SDK's create method would take. ``extra_body``
+                is merged into the top level like the SDKs do.
+
+        Returns:
+            bytes: The body, with the messages last so the prefix sits at a stable offset.
+        """
+        fields = {
+            key: value
+            for key, value in params.items()
+            if key not in (self.messages_key, "extra_body")
+        }
+        fields.update(params.get("extra_body") or {})
+        messages = self._join_messages(params[self.messages_key])
+        head = dumps(fields)[:-1]
+        separator = b"," if len(head) > 1 else b""
+        return b"".join(
+            (head, separator, dumps(self.messages_key), b":[", messages, b"]}")
+        )
+
+    def stats(self) -> Tuple[int, int]:
+        """Bytes reused from previous requests and bytes serialized, since creation."""
+        return self.reused_bytes, self.serialized_bytes
@@ -0,0 +1,170 @@
+"""Per-call usage and latency records of LLM requests, collected per agent step."""
+
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("desktopenv.agent")
+
+# Records of the calls made while a collect_llm_calls block is active
+_collected_calls: ContextVar[Optional[List[Dict]]] = ContextVar(
+    "collected_llm_calls", default=None
+)
+# Record of the call currently in flight, filled in by the engines
+_current_call: ContextVar[Optional[Dict]] = ContextVar("current_llm_call", default=None)
+
+
+@contextmanager
+def collect_llm_calls():
+    """Collect a record of every LLM call made inside the block.
+
+    The collector follows the context into asyncio tasks and ``asyncio.to_thread`` calls, so
+    concurrent calls made on behalf of a step are collected too.
+
+    Yields:
+        List[Dict]: The call records, appended as calls finish.
+    """
+    calls = []
+    token = _collected_calls.set(calls)
+    try:
+        yield calls
+    finally:
+        _collected_calls.reset(token)
+
+
+@contextmanager
+def track_llm_call(role: Optional[str], model: Optional[str]):
+    """Time one LLM call and add its record to the active collector.
+
+    Args:
+        role (str): What the call is for, e.g. generator, reflection, grounding, text_span, code_agent or judge.
+        model (str): The model name.
+
+    Yields:
+        Dict: The call record, engines fill in tokens, time to first token and retries.
+    """
+    record = {
+        "role": role,
+        "model": model,
+        "started_at": time.time(),
+        "prompt_tokens": None,
+        "completion_tokens": None,
+        "cached_tokens": None,
+        "cache_write_tokens": None,
+        "time_to_first_token": None,
+        "latency": None,
+        "retries": 0,
+        "cached_response": False,
+    }
+    token = _current_call.set(record)
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        _current_call.reset(token)
+        record["latency"] = round(time.time() - record["started_at"], 3)
+        logger.debug("LLM call: %s", record)
+        calls = _collected_calls.get()
+        if calls is not None:
+            calls.append(record)
+
+
+def _first_not_none(*values):
+    for value in values:
+        if value is not None:
+            return value
+    return None
+
+
+def record_usage(usage):
+    """Store the token usage reported by the provider on the call in flight.
+
+    Handles the OpenAI (prompt/completion tokens) and Anthropic (input/output tokens) shapes,
+    fields missing from ``usage`` keep their previous value so streamed usage can arrive in parts.
+    """
+    record = _current_call.get()
+    if record is None or usage is None:
+        return
+    prompt_details = getattr(usage, "prompt_tokens_details", None)
+    prompt_tokens = _first_not_none(
+        getattr(usage, "prompt_tokens", None), getattr(usage, "input_tokens", None)
+    )
+    completion_tokens = _first_not_none(
+        getattr(usage, "completion_tokens", None),
+        getattr(usage, "output_tokens", None),
+    )
+    cached_tokens = _first_not_none(
+        getattr(prompt_details, "cached_tokens", None),
+        getattr(usage, "cache_read_input_tokens", None),
+    )
+    # Only Anthropic bills prompt cache writes separately
+    cache_write_tokens = getattr(usage, "cache_creation_input_tokens", None)
+    for name, value in (
+        ("prompt_tokens", prompt_tokens),
+        ("completion_tokens", completion_tokens),
+        ("cached_tokens", cached_tokens),
+        ("cache_write_tokens", cache_write_tokens),
+    ):
+        if value is not None:
+            record[name] = value
+
+
+def record_first_token():
+    """Mark the arrival of the first streamed token of the call in flight."""
+    record = _current_call.get()
+    if record is not None and record["time_to_first_token"] is None:
+        record["time_to_first_token"] = round(time.time() - record["started_at"], 3)
+
+
+def record_retry():
+    """Count a retry of the call in flight."""
+    record = _current_call.get()
+    if record is not None:
+        record["retries"] += 1
+
+
+def annotate_call(**fields):
+    """Attach extra fields (e.g. the endpoint that served it) to the record of the call in flight."""
+    record = _current_call.get()
+    if record is not None:
+        record.update(fields)
+
+
+def summarize_llm_calls(calls: List[Dict]) -> Dict[str, Dict]:
+    """Aggregate call records per role.
+
+    Args:
+        calls (List[Dict]): Records produced by track_llm_call.
+
+    Returns:
+        Dict[str, Dict]: For every role, the number of calls, summed tokens, latency and retries.
+    """
+    summary = {}
+    for call in calls:
+        totals = summary.setdefault(
+            call["role"] or "unknown",
+            {
+                "calls": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "cached_tokens": 0,
+                "cache_write_tokens": 0,
+                "latency": 0.0,
+                "retries": 0,
+            },
+        )
+        totals["calls"] += 1
+        totals["retries"] += call["retries"]
+        totals["latency"] = round(totals["latency"] + (call["latency"] or 0), 3)
+        for name in (
+            "prompt_tokens",
+            "completion_tokens",
+            "cached_tokens",
+            "cache_write_tokens",
+        ):
+            totals[name] += call[name] or 0
+    return summary
@@ -0,0 +1,207 @@
+"""Token accounting of chat messages and a context packer fitting histories to a model budget."""
+
+import base64
+import functools
+import logging
+import math
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from gui_agents.s3.core.identity_memo import IdentityMemo
+from gui_agents.s3.core.rate_limiter import CHARS_PER_TOKEN
+
+logger = logging.getLogger("desktopenv.agent")
+
+# Tokens added by the chat format around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+# Per-message counts kept in memory
+MAX_MEMOIZED_MESSAGES = 4096
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(name: str = "cl100k_base"):
+    """The tiktoken encoding, loaded once per process, or None if it cannot be loaded.
+
+    tiktoken downloads its vocabularies on first use, so offline machines fall back to a
+    characters-per-token estimate.
+    """
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning(
+            "Tokenizer %s unavailable (%s), estimating %d characters per token",
+            name,
+            e,
+            CHARS_PER_TOKEN,
+        )
+        return None
+
+
+@functools.lru_cache(maxsize=8192)
+def count_text_tokens(text: str, encoding_name: str = "cl100k_base") -> int:
+    """Tokens of a text, memoized so unchanged history is never re-tokenized."""
+    encoding = get_encoding(encoding_name)
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def image_tokens(
+    provider: str, width: int, height: int, detail: Optional[str] = "high"
+) -> int:
+    """Prompt tokens billed for an image, following each provider's published sizing rules.
+
+    Args:
+        provider (str): Engine provider, e.g. openai, anthropic or gemini.
+        width (int): Image width in pixels.
+        height (int): Image height in pixels.
+        detail (str): OpenAI detail level, low images cost a flat fee.
+
+    Returns:
+        int: The image's token cost.
+    """
+    if provider == "anthropic":
+        # Downscaled to fit 1568px on the long edge, then about one token per 750 pixels
+        scale = min(1.0, 1568 / max(width, height))
+        return math.ceil(width * scale * height * scale / 750)
+    if provider == "gemini":
+        # Small images are one tile, larger ones are cut into 768px tiles
+        if width <= 384 and height <= 384:
+            return 258
+        return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+    # OpenAI tiling, also the default for OpenAI-compatible servers
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def _image_item_size(item: Dict) -> Tuple[int, int]:
+    """Pixel size of an image content item, in OpenAI (data URL) or Anthropic (base64 source) form."""
+    if item.get("type") == "image_url":
+        data = item["image_url"]["url"].split(",", 1)[-1]
+    else:
+        data = item.get("source", {}).get("data", "")
+    try:
+        return Image.open(BytesIO(base64.b64decode(data))).size
+    except Exception:
+        # Remote URLs or unreadable data, assume a full HD screenshot
+        return 1920, 1080
+
+
+class TokenCounter:
+    """Counts the prompt tokens of messages for one provider, memoizing per message.
+
+    Agent histories are append-only (see TrajectoryStore), so counts are memoized by message
+    identity and a step only tokenizes its new messages.
+    """
+
+    def __init__(self, provider: str = "openai", encoding_name: str = "cl100k_base"):
+        """
+        Args:
+            provider: str
+                Engine provider, decides the image token costs
+            encoding_name: str
+                tiktoken encoding used for text
+        """
+        self.provider = provider
+        self.encoding_name = encoding_name
+        self._memo = IdentityMemo(MAX_MEMOIZED_MESSAGES)
+
+    def _count(self, message: Dict) -> int:
+        content = message.get("content", "")
+        if isinstance(content, str):
+            return MESSAGE_OVERHEAD_TOKENS + count_text_tokens(
+                content, self.encoding_name
+            )
+        tokens = MESSAGE_OVERHEAD_TOKENS
+        for item in content:
+            if item.get("type") == "text":
+                tokens += count_text_tokens(item["text"], self.encoding_name)
+            elif "image" in item.get("type", ""):
+                detail = item.get("image_url", {}).get("detail", "high")
+                tokens += image_tokens(self.provider, *_image_item_size(item), detail)
+        return tokens
+
+    def message_tokens(self, message: Dict) -> int:
+        """Prompt tokens of one message."""
+        return self._memo.get(message, lambda: self._count(message))
+
+    def messages_tokens(self, messages: List[Dict]) -> int:
+        """Prompt tokens of a list of messages."""
+        return sum(self.message_tokens(message) for message in messages)
+
+
+def _without_images(message: Dict) -> Dict:
+    content = message["content"]
+    if isinstance(content, str):
+        return message
+    return {
+        **message,
+        "content": [item for item in content if "image" not in item.get("type", "")],
+    }
+
+
+class ContextPacker:
+    """Fits a request into the model's context budget before it is sent.
+
+    Over budget, images are removed oldest first, then the oldest turns after the system
+    prompt are dropped. The latest message is always kept and the first kept turn is a user
+    turn, as chat APIs expect.
+    """
+
+    def __init__(self, counter: TokenCounter, max_tokens: int, reserve_tokens: int = 0):
+        """
+        Args:
+            counter: TokenCounter
+                Token accounting of the target model
+            max_tokens: int
+                Context window of the model
+            reserve_tokens: int
+                Tokens kept free for the response
+        """
+        self.counter = counter
+        self.budget = max_tokens - reserve_tokens
+
+    def pack(self, messages: List[Dict]) -> List[Dict]:
+        """Return the messages unchanged when they fit, or a trimmed copy of the list."""
+        counts = [self.counter.message_tokens(message) for message in messages]
+        total = sum(counts)
+        if total <= self.budget:
+            return messages
+
+        packed = list(messages)
+        has_system = bool(packed) and packed[0].get("role") == "system"
+        first = 1 if has_system else 0
+        last = len(packed) - 1
+        # Drop images, oldest first, never the latest message's
+        for i in range(first, last):
+            if total <= self.budget:
+                break
+            stripped = _without_images(packed[i])
+            if stripped is not packed[i]:
+                stripped_count = self.counter.message_tokens(stripped)
+                total -= counts[i] - stripped_count
+                packed[i], counts[i] = stripped, stripped_count
+        # Then drop whole turns, oldest first
+        while total > self.budget and len(packed) - first > 1:
+            total -= counts.pop(first)
+            packed.pop(first)
+            while len(packed) - first > 1 and packed[first].get("role") != "user":
+                total -= counts.pop(first)
+                packed.pop(first)
+        logger.info(
+            "Packed %d messages into %d (%d tokens, budget %d)",
+            len(messages),
+            len(packed),
+            total,
+            self.budget,
+        )
+        return packed
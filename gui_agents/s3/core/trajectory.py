@@ -0,0 +1,149 @@
+"""Append-only message history of an agent, rendered into the payload sent to the model on demand."""
+
+from typing import Dict, Iterable, List, Optional
+
+
+def _is_image(item: Dict) -> bool:
+    return "image" in item.get("type", "")
+
+
+def _count_images(message: Dict) -> int:
+    content = message["content"]
+    if not isinstance(content, list):
+        return 0
+    return sum(1 for item in content if _is_image(item))
+
+
+def _keep_last_images(message: Dict, keep: int) -> Dict:
+    """Copy of the message holding only its last ``keep`` images, the original is untouched."""
+    content = []
+    to_drop = _count_images(message) - keep
+    for item in message["content"]:
+        if _is_image(item) and to_drop > 0:
+            to_drop -= 1
+            continue
+        content.append(item)
+    return {**message, "content": content}
+
+
+class TrajectoryStore:
+    """The system message and the turns of an agent, each turn appended once and never modified.
+
+    The payload is rendered through one of two windows:
+
+    - ``max_images``: all text, but only the latest images (long-context engines)
+    - ``max_turns``: only the latest turns of ``turn_size`` messages (other engines)
+
+    Turns that can no longer enter the window are rendered once into a frozen prefix, so the
+    per-step work is proportional to the window rather than to the trajectory. The original
+    turns stay in ``turns`` for logging.
+    """
+
+    def __init__(
+        self,
+        max_images: Optional[int] = None,
+        max_turns: Optional[int] = None,
+        turn_size: int = 1,
+    ):
+        """
+        Args:
+            max_images: int
+                Number of latest images rendered, None keeps every image
+            max_turns: int
+                Number of latest complete turns rendered, None keeps every turn
+            turn_size: int
+                Messages per turn, e.g. 2 for alternating user/assistant messages
+        """
+        self.max_images = max_images
+        self.max_turns = max_turns
+        self.turn_size = turn_size
+        self.system: Optional[Dict] = None
+        self.turns: List[Dict] = []
+        self._reset_window()
+
+    def _reset_window(self):
+        # Rendered forms of turns[:_frozen_upto], final since their images left the window
+        self._frozen: List[Dict] = []
+        self._frozen_upto = 0
+        # Images in turns[_frozen_upto:]
+        self._live_images = sum(_count_images(turn) for turn in self.turns)
+        self._advance()
+
+    def _advance(self):
+        """Freeze the oldest live turns whose images are all out of the window."""
+        if self.max_images is None:
+            return
+        while self._frozen_upto < len(self.turns):
+            turn = self.turns[self._frozen_upto]
+            images = _count_images(turn)
+            if self._live_images - images < self.max_images:
+                break
+            self._frozen.append(_keep_last_images(turn, 0) if images else turn)
+            self._live_images -= images
+            self._frozen_upto += 1
+
+    def reset(self, system: Dict):
+        """Start a new trajectory from a system message."""
+        self.system = system
+        self.turns = []
+        self._reset_window()
+
+    def load(self, messages: Iterable[Dict]):
+        """Replace the whole history by a list of messages, the first one being the system message."""
+        messages = list(messages)
+        self.system = messages[0] if messages else None
+        self.turns = messages[1:]
+        self._reset_window()
+
+    def set_system(self, system: Dict):
+        self.system = system
+
+    def append(self, message: Dict):
+        self.turns.append(message)
+        self._live_images += _count_images(message)
+        self._advance()
+
+    def last(self) -> Dict:
+        """The latest message, the system message if no turn was added yet."""
+        return self.turns[-1] if self.turns else self.system
+
+    def message_at(self, index: int) -> Dict:
+        """The original message at ``index``, counting the system message as index 0."""
+        return self.system if index == 0 else self.turns[index - 1]
+
+    def replace(self, index: int, message: Dict):
+        """Replace the message at ``index``, counting the system message as index 0."""
+        if index == 0:
+            self.system = message
+            return
+        self.turns[index - 1] = message
+        self._reset_window()
+
+    def pop(self, index: int) -> Dict:
+        """Remove the message at ``index``, counting the system message as index 0."""
+        if index == 0:
+            system, self.system = self.system, None
+            return system
+        message = self.turns.pop(index - 1)
+        self._reset_window()
+        return message
+
+    def __len__(self) -> int:
+        return len(self.turns) + (self.system is not None)
+
+    def render(self) -> List[Dict]:
+        """The messages to send: the system message followed by the window over the turns."""
+        head = [self.system] if self.system is not None else []
+        if self.max_turns is not None:
+            complete_turns = len(self.turns) // self.turn_size
+            start = max(0, complete_turns - self.max_turns) * self.turn_size
+            return head + self.turns[start:]
+        if self.max_images is None:
+            return head + self.turns
+
+        live = self.turns[self._frozen_upto :]
+        # The oldest live turn may hold more images than still fit in the window
+        if live and self._live_images > self.max_images:
+            excess = self._live_images - self.max_images
+            live[0] = _keep_last_images(live[0], _count_images(live[0]) - excess)
+        return head + self._frozen + live
@@ -0,0 +1,176 @@
+"""Compiles the agent's action code into a checked call of an ACI method, without eval().
+
+The code block of a plan is parsed once (parses are memoized by source), its single
+``agent.<action>(...)`` call is matched against the ``@agent_action`` methods of the ACI, and
+its arguments, which must be literals, are bound to the method signature and type-checked.
+Formatting checks, validation and execution all run from that result, and no code from the
+model is ever executed.
+"""
+
+import ast
+import copy
+import functools
+import inspect
+import typing
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class ActionCompileError(ValueError):
+    """The code is not a single valid call of an agent action."""
+
+
+@dataclass(frozen=True)
+class CompiledAction:
+    """One validated agent action call.
+
+    Attributes:
+        name (str): Name of the ACI method.
+        arguments (Dict[str, Any]): Arguments bound to the method's parameters by name.
+        grounding_queries (Tuple[str, ...]): Element descriptions the action grounds visually.
+        text_queries (Tuple[str, ...]): Phrases the action grounds through OCR.
+    """
+
+    name: str
+    arguments: Dict[str, Any]
+    grounding_queries: Tuple[str, ...] = ()
+    text_queries: Tuple[str, ...] = ()
+
+    def run(self, agent) -> str:
+        """Call the action on the agent, returning the code it generates."""
+        # Arguments are shared by every run of a memoized compilation, methods get their own copy
+        return getattr(agent, self.name)(**copy.deepcopy(self.arguments))
+
+
+@functools.lru_cache(maxsize=256)
+def parse_code(code: str) -> Optional[ast.Module]:
+    """The syntax tree of an action code block, None if it does not parse."""
+    try:
+        return ast.parse(code.strip())
+    except SyntaxError:
+        return None
+
+
+def _agent_call(statement: ast.stmt) -> Optional[ast.Call]:
+    if not isinstance(statement, ast.Expr):
+        return None
+    call = statement.value
+    if (
+        isinstance(call, ast.Call)
+        and isinstance(call.func, ast.Attribute)
+        and isinstance(call.func.value, ast.Name)
+        and call.func.value.id == "agent"
+    ):
+        return call
+    return None
+
+
+def agent_calls(code: str) -> List[ast.Call]:
+    """The ``agent.<action>(...)`` calls among the statements of the code."""
+    tree = parse_code(code)
+    if tree is None:
+        return []
+    return [call for call in map(_agent_call, tree.body) if call is not None]
+
+
+def is_single_action(code: str) -> bool:
+    """Whether the code consists of exactly one ``agent.<action>(...)`` call."""
+    tree = parse_code(code)
+    return tree is not None and len(tree.body) == 1 and len(agent_calls(code)) == 1
+
+
+def _matches(value: Any, annotation: Any) -> bool:
+    """Loose check of a literal against a parameter annotation, unknown annotations pass."""
+    if annotation is inspect.Parameter.empty or annotation is Any:
+        return True
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        return any(_matches(value, member) for member in typing.get_args(annotation))
+    annotation = origin or annotation
+    if annotation is type(None):
+        return value is None
+    if annotation is float:
+        return isinstance(value, (int, float))
+    if annotation in (list, List, tuple, Tuple):
+        return isinstance(value, (list, tuple))
+    if annotation in (dict, Dict):
+        return isinstance(value, dict)
+    if isinstance(annotation, type):
+        return isinstance(value, annotation)
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def _signature(agent_type: type, name: str) -> inspect.Signature:
+    method = getattr(agent_type, name, None)
+    if not callable(method) or not getattr(method, "is_agent_action", False):
+        raise ActionCompileError(f"agent.{name} is not an agent action")
+    signature = inspect.signature(method)
+    # Drop self, the action is called on an instance
+    return signature.replace(parameters=list(signature.parameters.values())[1:])
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(code: str, agent_type: type) -> CompiledAction:
+    if parse_code(code) is None:
+        raise ActionCompileError("The action code is not valid Python")
+    if not is_single_action(code):
+        raise ActionCompileError("The code must be exactly one agent action call")
+    call = agent_calls(code)[0]
+    name = call.func.attr
+    signature = _signature(agent_type, name)
+
+    try:
+        args = [ast.literal_eval(arg) for arg in call.args]
+        kwargs = {
+            keyword.arg: ast.literal_eval(keyword.value) for keyword in call.keywords
+        }
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError) as e:
+        raise ActionCompileError(f"Arguments of agent.{name} must be literals") from e
+    if None in kwargs:
+        raise ActionCompileError(f"Arguments of agent.{name} cannot be unpacked")
+    try:
+        bound = signature.bind(*args, **kwargs)
+    except TypeError as e:
+        raise ActionCompileError(f"agent.{name}: {e}") from e
+
+    for parameter_name, value in bound.arguments.items():
+        parameter = signature.parameters[parameter_name]
+        if value is None and parameter.default is None:
+            continue
+        if not _matches(value, parameter.annotation):
+            raise ActionCompileError(
+                f"agent.{name}: {parameter_name} has the wrong type {type(value).__name__}"
+            )
+
+    return CompiledAction(
+        name=name,
+        arguments=dict(bound.arguments),
+        grounding_queries=tuple(
+            value
+            for key, value in bound.arguments.items()
+            if key.endswith("description") and isinstance(value, str)
+        ),
+        text_queries=tuple(
+            value
+            for key, value in bound.arguments.items()
+            if key.endswith("phrase") and isinstance(value, str)
+        ),
+    )
+
+
+def compile_action(code: str, agent) -> CompiledAction:
+    """Compile action code against the agent actions of an ACI.
+
+    Args:
+        code (str): The code block of the plan, e.g. ``agent.click("the OK button")``.
+        agent (ACI): The ACI whose ``@agent_action`` methods the code may call.
+
+    Returns:
+        CompiledAction: The validated call, memoized per code and ACI class.
+
+    Raises:
+        ActionCompileError: If the code is not one call of an agent action with valid literal
+            arguments.
+    """
+    return _compile(code.strip(), type(agent))
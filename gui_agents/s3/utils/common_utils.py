@@ -1,3 +1,4 @@
+import asyncio
 import re
 import time
 from io import BytesIO
@@ -5,6 +6,8 @@ from PIL import Image
 
 from typing import Tuple, Dict
 
+from gui_agents.s3.core.retry import CircuitOpenError, is_retryable
+from gui_agents.s3.utils.action_compiler import compile_action, is_single_action
 from gui_agents.s3.memory.procedural_memory import PROCEDURAL_MEMORY
 
 import logging
@@ -14,7 +17,7 @@ logger = logging.getLogger("desktopenv.agent")
 
 def create_pyautogui_code(agent, code: str, obs: Dict) -> str:
     """
-    Attempts to evaluate the code into a pyautogui code snippet with grounded actions using the observation screenshot.
+    Attempts to compile the code into a pyautogui code snippet with grounded actions using the observation screenshot.
 
     Args:
         agent (ACI): The grounding agent to use for evaluation.
@@ -25,10 +28,18 @@ def create_pyautogui_code(agent, code: str, obs: Dict) -> str:
         exec_code (str): The pyautogui code to execute the grounded action.
 
     Raises:
-        Exception: If there is an error in evaluating the code.
+        Exception: If the code is not a valid agent action (ActionCompileError) or grounding it fails.
     """
     agent.assign_screenshot(obs)  # Necessary for grounding
-    exec_code = eval(code)
+    # Validation and execution evaluate the same action on the same observation, a successful
+    # grounding is reused so it happens once. Failures are not kept, they may be transient.
+    grounded = getattr(agent, "grounded_code", None)
+    code = code.strip()
+    if grounded is not None and code in grounded:
+        return grounded[code]
+    exec_code = compile_action(code, agent).run(agent)
+    if grounded is not None:
+        grounded[code] = exec_code
     return exec_code
 
 
@@ -48,6 +59,9 @@ def call_llm_safe(
             print("Response success!")
             break  # If successful, break out of the loop
         except Exception as e:
+            if isinstance(e, CircuitOpenError) or is_retryable(e):
+                # Transient failures already had their retries and deadline in the engine
+                raise
             attempt += 1
             print(f"Attempt {attempt} failed: {e}")
             if attempt == max_retries:
@@ -56,6 +70,33 @@ def call_llm_safe(
     return response if response is not None else ""
 
 
+async def acall_llm_safe(
+    agent, temperature: float = 0.0, use_thinking: bool = False, **kwargs
+) -> str:
+    """Async version of call_llm_safe"""
+    max_retries = 3  # Set the maximum number of retries
+    attempt = 0
+    response = ""
+    while attempt < max_retries:
+        try:
+            response = await agent.aget_response(
+                temperature=temperature, use_thinking=use_thinking, **kwargs
+            )
+            assert response is not None, "Response from agent should not be None"
+            logger.debug("Response success!")
+            break  # If successful, break out of the loop
+        except Exception as e:
+            if isinstance(e, CircuitOpenError) or is_retryable(e):
+                # Transient failures already had their retries and deadline in the engine
+                raise
+            attempt += 1
+            logger.warning("Attempt %d failed: %s", attempt, e)
+            if attempt == max_retries:
+                logger.warning("Max retries reached. Handling failure.")
+        await asyncio.sleep(1.0)
+    return response if response is not None else ""
+
+
 def call_llm_formatted(generator, format_checkers, **kwargs):
     """
     Calls the generator agent's LLM and ensures correct formatting.
@@ -64,7 +105,7 @@ def call_llm_formatted(generator, format_checkers, **kwargs):
         generator (ACI): The generator agent to call.
         obs (Dict): The current observation containing the screenshot.
         format_checkers (Callable): Functions that take the response and return a tuple of (success, feedback).
-        **kwargs: Additional keyword arguments for the LLM call.
+        **kwargs: Additional keyword arguments for the LLM call, e.g. stop_when to stream the response and stop once it is complete.
 
     Returns:
         response (str): The formatted response from the generator agent.
@@ -94,29 +135,7 @@ def call_llm_formatted(generator, format_checkers, **kwargs):
         logger.error(
             f"Response formatting error on attempt {attempt} for {generator.engine.model}. Response: {response} {', '.join(feedback_msgs)}"
         )
-        messages.append(
-            {
-                "role": "assistant",
-                "content": [{"type": "text", "text": response}],
-            }
-        )
-        logger.info(f"Bad response: {response}")
-        delimiter = "\n- "
-        formatting_feedback = f"- {delimiter.join(feedback_msgs)}"
-        messages.append(
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": PROCEDURAL_MEMORY.FORMATTING_FEEDBACK_PROMPT.replace(
-                            "FORMATTING_FEEDBACK", formatting_feedback
-                        ),
-                    }
-                ],
-            }
-        )
-        logger.info("Feedback:\n%s", formatting_feedback)
+        _append_formatting_feedback(messages, response, feedback_msgs)
 
         attempt += 1
         if attempt == max_retries:
@@ -127,6 +146,74 @@ def call_llm_formatted(generator, format_checkers, **kwargs):
     return response
 
 
+async def acall_llm_formatted(generator, format_checkers, **kwargs):
+    """
+    Async version of call_llm_formatted.
+
+    Format checkers may block (e.g. CODE_VALID_FORMATTER grounds the action), so they are run in a worker thread to keep the event loop free.
+    """
+    max_retries = 3  # Set the maximum number of retries
+    attempt = 0
+    response = ""
+    if kwargs.get("messages") is None:
+        messages = (
+            generator.messages.copy()
+        )  # Copy messages to avoid modifying the original
+    else:
+        messages = kwargs["messages"]
+        del kwargs["messages"]  # Remove messages from kwargs to avoid passing it twice
+    while attempt < max_retries:
+        response = await acall_llm_safe(generator, messages=messages, **kwargs)
+
+        # Prepare feedback messages for incorrect formatting
+        feedback_msgs = []
+        for format_checker in format_checkers:
+            success, feedback = await asyncio.to_thread(format_checker, response)
+            if not success:
+                feedback_msgs.append(feedback)
+        if not feedback_msgs:
+            break
+        logger.error(
+            f"Response formatting error on attempt {attempt} for {generator.engine.model}. Response: {response} {', '.join(feedback_msgs)}"
+        )
+        _append_formatting_feedback(messages, response, feedback_msgs)
+
+        attempt += 1
+        if attempt == max_retries:
+            logger.error(
+                "Max retries reached when formatting response. Handling failure."
+            )
+        await asyncio.sleep(1.0)
+    return response
+
+
+def _append_formatting_feedback(messages, response, feedback_msgs):
+    """Append the badly formatted response and the formatting feedback to the messages"""
+    messages.append(
+        {
+            "role": "assistant",
+            "content": [{"type": "text", "text": response}],
+        }
+    )
+    logger.info(f"Bad response: {response}")
+    delimiter = "\n- "
+    formatting_feedback = f"- {delimiter.join(feedback_msgs)}"
+    messages.append(
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": PROCEDURAL_MEMORY.FORMATTING_FEEDBACK_PROMPT.replace(
+                        "FORMATTING_FEEDBACK", formatting_feedback
+                    ),
+                }
+            ],
+        }
+    )
+    logger.info("Feedback:\n%s", formatting_feedback)
+
+
 def split_thinking_response(full_response: str) -> Tuple[str, str]:
     try:
         # Extract thoughts section
@@ -179,6 +266,41 @@ def extract_agent_functions(code):
     return re.findall(pattern, code)
 
 
+def action_block_complete(response: str) -> bool:
+    """Checks whether a (partial) response already holds a closed code block with a single agent call.
+
+    Used as the stop_when condition when streaming the worker response, since everything after the
+    grounded action block is discarded by parse_code_from_string.
+
+    Args:
+        response (str): The response text received so far.
+
+    Returns:
+        bool: True if the last closed code block is exactly one syntactically complete agent.<action>(...) call.
+    """
+    if response.count("```") < 2:
+        return False
+    return is_single_action(parse_code_from_string(response))
+
+
+def answer_block_complete(response: str) -> bool:
+    """Checks whether a (partial) <thoughts>/<answer> response already holds its whole answer.
+
+    The answer is complete once </answer> arrives or once a code block inside <answer> is closed.
+
+    Args:
+        response (str): The response text received so far.
+
+    Returns:
+        bool: True if the rest of the response can be dropped.
+    """
+    if "</answer>" in response:
+        return True
+    if "<answer>" not in response:
+        return False
+    return response.split("<answer>")[-1].count("```") >= 2
+
+
 def compress_image(image_bytes: bytes = None, image: Image = None) -> bytes:
     """Compresses an image represented as bytes.
 
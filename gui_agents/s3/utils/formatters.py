@@ -1,14 +1,15 @@
 """This file contains various formatting checks used to reprompt an agent for correctly formatted responses."""
 
+from gui_agents.s3.core.retry import CircuitOpenError, is_retryable
+from gui_agents.s3.utils.action_compiler import is_single_action
 from gui_agents.s3.utils.common_utils import (
-    extract_agent_functions,
     parse_code_from_string,
     create_pyautogui_code,
     split_thinking_response,
 )
 
-single_action_check = (
-    lambda response: len(extract_agent_functions(parse_code_from_string(response))) == 1
+single_action_check = lambda response: is_single_action(
+    parse_code_from_string(response)
 )
 single_action_error_msg = (
     "Incorrect code: There must be a single agent action in the code response."
@@ -24,6 +25,9 @@ def _attempt_code_creation(agent, code, obs):
     try:
         return create_pyautogui_code(agent, code, obs)
     except Exception as e:
+        if isinstance(e, CircuitOpenError) or is_retryable(e):
+            # A grounding backend failure is not a malformed action
+            raise
         return None
 
 
@@ -0,0 +1,134 @@
+"""Reuse of grounding results across steps for elements that have not moved.
+
+An entry maps a normalized element description to the coordinates the grounding model returned
+and to the pixels around them. A later lookup is a hit only when that neighborhood still looks
+the same in the new screenshot and the overall layout of the screen did not change, e.g. because
+another window came to the front.
+"""
+
+import logging
+import re
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from gui_agents.s3.utils.screen_diff import changed_fraction
+
+logger = logging.getLogger("desktopenv.agent")
+
+# Size in screen pixels of the neighborhood fingerprinted around the coordinates
+PATCH_SIZE = (160, 80)
+# Share of neighborhood pixels allowed to change, e.g. a hover highlight or a blinking caret
+PATCH_TOLERANCE = 0.02
+# Downscaling factor of the layout fingerprint, 1920x1080 compares as 120x68
+LAYOUT_REDUCTION = 16
+# Share of layout pixels allowed to change before every entry is dropped
+LAYOUT_TOLERANCE = 0.1
+# Descriptions kept
+MAX_ENTRIES = 256
+
+
+def normalize_description(description: str) -> str:
+    """Case, whitespace and surrounding punctuation do not change which element is meant."""
+    return re.sub(r"\s+", " ", description).strip(" .,;:!?\"'").lower()
+
+
+class GroundingCache:
+    """Coordinates of described elements, validated against each new screenshot before reuse."""
+
+    def __init__(self, coordinate_space: Tuple[int, int]):
+        """
+        Args:
+            coordinate_space: Tuple[int, int]
+                (width, height) of the grounding model's coordinates
+        """
+        self.coordinate_space = coordinate_space
+        self._entries: "OrderedDict[str, Tuple[List[int], np.ndarray]]" = OrderedDict()
+        self._layout: Optional[np.ndarray] = None
+        # Decoded form of the latest screenshot, which is looked up many times within a step
+        self._frame: Optional[Tuple[bytes, np.ndarray, np.ndarray]] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _decode(self, screenshot: bytes) -> Tuple[np.ndarray, np.ndarray]:
+        """Grayscale pixels and layout fingerprint of a screenshot."""
+        if self._frame is not None and self._frame[0] is screenshot:
+            return self._frame[1], self._frame[2]
+        image = Image.open(BytesIO(screenshot)).convert("L")
+        pixels = np.asarray(image, dtype=np.int16)
+        layout = np.asarray(image.reduce(LAYOUT_REDUCTION), dtype=np.int16)
+        self._frame = (screenshot, pixels, layout)
+        return pixels, layout
+
+    def _patch(self, pixels: np.ndarray, coords: List[int]) -> np.ndarray:
+        """Neighborhood of grounding-space coordinates in the screenshot's pixels."""
+        height, width = pixels.shape
+        x = round(coords[0] * width / self.coordinate_space[0])
+        y = round(coords[1] * height / self.coordinate_space[1])
+        half_width, half_height = PATCH_SIZE[0] // 2, PATCH_SIZE[1] // 2
+        return pixels[
+            max(0, y - half_height) : y + half_height,
+            max(0, x - half_width) : x + half_width,
+        ]
+
+    def _check_layout(self, layout: np.ndarray):
+        """Drop every entry when the screen's layout changed."""
+        if self._layout is not None and self._layout is not layout:
+            if changed_fraction(self._layout, layout) > LAYOUT_TOLERANCE:
+                if self._entries:
+                    logger.debug(
+                        "Screen layout changed, dropping %d grounding cache entries",
+                        len(self._entries),
+                    )
+                self._entries.clear()
+        self._layout = layout
+
+    def get(self, description: str, screenshot: bytes) -> Optional[List[int]]:
+        """Cached coordinates of an element if its neighborhood is unchanged in the screenshot.
+
+        Args:
+            description (str): The element description given to the grounding model.
+            screenshot (bytes): The screenshot the coordinates are for.
+
+        Returns:
+            Optional[List[int]]: Coordinates in the grounding model's space, None on a miss.
+        """
+        key = normalize_description(description)
+        with self._lock:
+            pixels, layout = self._decode(screenshot)
+            self._check_layout(layout)
+            entry = self._entries.get(key)
+            if entry is not None:
+                coords, patch = entry
+                if changed_fraction(patch, self._patch(pixels, coords)) <= (
+                    PATCH_TOLERANCE
+                ):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    logger.info("Grounding cache hit for '%s': %s", key, coords)
+                    return list(coords)
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, description: str, screenshot: bytes, coords: List[int]):
+        """Remember the coordinates the grounding model returned for an element."""
+        key = normalize_description(description)
+        with self._lock:
+            pixels, layout = self._decode(screenshot)
+            self._check_layout(layout)
+            self._entries[key] = (list(coords), self._patch(pixels, coords).copy())
+            self._entries.move_to_end(key)
+            while len(self._entries) > MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._layout = None
+            self._frame = None
@@ -0,0 +1,318 @@
+"""OCR that only re-reads the parts of the screen that changed since the previous frame.
+
+Consecutive desktop frames usually differ in a small region (a menu, a dialog, a typed cell).
+The screen is cut into tiles and compared with the previous frame; changed tiles are grouped
+into regions, each region is grown by a margin and by the previous words it touches so no word
+is cut, and only those regions are read again. Words outside them are carried over, and the
+merged words are put back in reading order so the element table and its ids only change where
+the screen did.
+"""
+
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from gui_agents.s3.utils.screen_diff import PIXEL_TOLERANCE
+
+logger = logging.getLogger("desktopenv.agent")
+
+# Side of the square tiles frames are compared on, in pixels
+TILE_SIZE = 64
+# Pixels added around changed tiles, for words extending past them
+REGION_MARGIN = 24
+# Space kept around the previous words a region is grown over, so they do not touch its border
+WORD_PADDING = 4
+# Share of changed tiles above which the whole screen is read again
+FULL_OCR_THRESHOLD = 0.4
+
+# A word: text, block_num, left, top, width and height in screen pixels
+Word = Dict
+Box = Tuple[int, int, int, int]  # left, top, right, bottom
+
+
+def _word_box(word: Word) -> Box:
+    return (
+        word["left"],
+        word["top"],
+        word["left"] + word["width"],
+        word["top"] + word["height"],
+    )
+
+
+def _intersects(a: Box, b: Box) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _union(a: Box, b: Box) -> Box:
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+def _pad(box: Box, padding: int, size: Tuple[int, int]) -> Box:
+    return (
+        max(0, box[0] - padding),
+        max(0, box[1] - padding),
+        min(size[0], box[2] + padding),
+        min(size[1], box[3] + padding),
+    )
+
+
+def _center_in(word: Word, box: Box) -> bool:
+    x = word["left"] + word["width"] / 2
+    y = word["top"] + word["height"] / 2
+    return box[0] <= x < box[2] and box[1] <= y < box[3]
+
+
+def _area(box: Box) -> int:
+    return (box[2] - box[0]) * (box[3] - box[1])
+
+
+def _lines(words: List[Word]) -> List[List[Word]]:
+    """Words of a block grouped into lines, top to bottom and each left to right."""
+    lines: List[List[Word]] = []
+    bottom = None
+    for word in sorted(words, key=lambda w: (w["top"], w["left"])):
+        center = word["top"] + word["height"] / 2
+        if bottom is None or center >= bottom:
+            lines.append([])
+            bottom = word["top"] + word["height"]
+        lines[-1].append(word)
+    return [sorted(line, key=lambda w: w["left"]) for line in lines]
+
+
+def reading_order(previous: List[Word], words: List[Word]) -> List[Word]:
+    """Merged words in reading order.
+
+    Words read again take the block of the previous frame their center falls in, so a changed
+    region inside a paragraph stays part of it. Blocks keep their previous order, new blocks
+    go before the first previous block that starts below them.
+
+    Args:
+        previous (List[Word]): The previous frame's words, in reading order.
+        words (List[Word]): The kept and freshly read words.
+
+    Returns:
+        List[Word]: The words, block by block, line by line.
+    """
+    extents: Dict[int, Box] = {}
+    for word in previous:
+        block = word["block_num"]
+        box = _word_box(word)
+        extents[block] = _union(extents[block], box) if block in extents else box
+    rank = {block: (i, 0, 0) for i, block in enumerate(extents)}
+
+    blocks: Dict[int, List[Word]] = {}
+    for word in words:
+        if word["block_num"] not in rank:
+            containing = [b for b, box in extents.items() if _center_in(word, box)]
+            if containing:
+                block = min(containing, key=lambda b: _area(extents[b]))
+                word = {**word, "block_num": block}
+        blocks.setdefault(word["block_num"], []).append(word)
+
+    for block, block_words in blocks.items():
+        if block in rank:
+            continue
+        top, left = min((w["top"], w["left"]) for w in block_words)
+        later = [
+            rank[b][0] for b, box in extents.items() if (box[1], box[0]) > (top, left)
+        ]
+        rank[block] = (min(later) - 0.5 if later else len(extents), top, left)
+
+    return [
+        word
+        for block in sorted(blocks, key=lambda b: rank[b])
+        for line in _lines(blocks[block])
+        for word in line
+    ]
+
+
+def changed_tiles(previous: np.ndarray, current: np.ndarray) -> np.ndarray:
+    """Boolean grid of the tiles holding at least one changed pixel."""
+    changed = np.abs(previous - current) > PIXEL_TOLERANCE
+    rows = -(-changed.shape[0] // TILE_SIZE)
+    cols = -(-changed.shape[1] // TILE_SIZE)
+    padded = np.zeros((rows * TILE_SIZE, cols * TILE_SIZE), dtype=bool)
+    padded[: changed.shape[0], : changed.shape[1]] = changed
+    return padded.reshape(rows, TILE_SIZE, cols, TILE_SIZE).any(axis=(1, 3))
+
+
+def tile_regions(tiles: np.ndarray) -> List[Box]:
+    """Bounding boxes in pixels of the connected groups of changed tiles."""
+    seen = np.zeros_like(tiles)
+    regions = []
+    for row, col in zip(*np.nonzero(tiles)):
+        if seen[row, col]:
+            continue
+        seen[row, col] = True
+        top, left, bottom, right = row, col, row, col
+        queue = deque([(row, col)])
+        while queue:
+            r, c = queue.popleft()
+            top, left = min(top, r), min(left, c)
+            bottom, right = max(bottom, r), max(right, c)
+            for nr in range(r - 1, r + 2):
+                for nc in range(c - 1, c + 2):
+                    if (
+                        0 <= nr < tiles.shape[0]
+                        and 0 <= nc < tiles.shape[1]
+                        and tiles[nr, nc]
+                        and not seen[nr, nc]
+                    ):
+                        seen[nr, nc] = True
+                        queue.append((nr, nc))
+        regions.append(
+            (
+                left * TILE_SIZE,
+                top * TILE_SIZE,
+                (right + 1) * TILE_SIZE,
+                (bottom + 1) * TILE_SIZE,
+            )
+        )
+    return regions
+
+
+class IncrementalOCR:
+    """Reads the words of successive screenshots, re-running OCR only on changed regions."""
+
+    def __init__(self, read_words: Callable[[Image.Image], List[Word]]):
+        """
+        Args:
+            read_words: Callable[[Image.Image], List[Word]]
+                Full OCR of an image, returning its words in reading order
+        """
+        self.read_words = read_words
+        self._pixels: Optional[np.ndarray] = None
+        self._words: List[Word] = []
+        self._next_block = 0
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self._pixels = None
+            self._words = []
+            self._next_block = 0
+
+    def _read_all(self, image: Image.Image) -> List[Word]:
+        words = self.read_words(image)
+        self._next_block = max((word["block_num"] for word in words), default=0) + 1
+        return words
+
+    def _settle(self, region: Box, size: Tuple[int, int]) -> Box:
+        """Grow a region over every previous word it touches, until it cuts none."""
+        while True:
+            grown = region
+            for word in self._words:
+                box = _word_box(word)
+                if _intersects(grown, box):
+                    grown = _union(grown, _pad(box, WORD_PADDING, size))
+            if grown == region:
+                return region
+            region = grown
+
+    @staticmethod
+    def _merge_overlapping(regions: List[Box]) -> List[Box]:
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(regions)):
+                for j in range(i + 1, len(regions)):
+                    if _intersects(regions[i], regions[j]):
+                        regions[i] = _union(regions[i], regions.pop(j))
+                        merged = True
+                        break
+                if merged:
+                    break
+        return regions
+
+    def _read_region(self, image: Image.Image, region: Box) -> List[Word]:
+        """Words of one region in screen coordinates, dropping the ones cut by its border."""
+        left, top, right, bottom = region
+        words = []
+        blocks = {}
+        for word in self.read_words(image.crop(region)):
+            box = (
+                word["left"] + left,
+                word["top"] + top,
+                word["left"] + left + word["width"],
+                word["top"] + top + word["height"],
+            )
+            cut = (
+                (box[0] <= left and left > 0)
+                or (box[1] <= top and top > 0)
+                or (box[2] >= right and right < image.width)
+                or (box[3] >= bottom and bottom < image.height)
+            )
+            if cut:
+                continue
+            # Block numbers of a region are renumbered so they do not collide with the kept ones
+            if word["block_num"] not in blocks:
+                blocks[word["block_num"]] = self._next_block
+                self._next_block += 1
+            words.append(
+                {
+                    **word,
+                    "block_num": blocks[word["block_num"]],
+                    "left": box[0],
+                    "top": box[1],
+                }
+            )
+        return words
+
+    def __call__(self, image: Image.Image) -> List[Word]:
+        """The words of a screenshot.
+
+        Args:
+            image (Image.Image): The screenshot.
+
+        Returns:
+            List[Word]: Words kept from the previous frame and words read in the changed
+                regions, in reading order.
+        """
+        pixels = np.asarray(image.convert("L"), dtype=np.int16)
+        with self._lock:
+            previous, self._pixels = self._pixels, pixels
+            if previous is None or previous.shape != pixels.shape:
+                self._words = self._read_all(image)
+                return list(self._words)
+
+            tiles = changed_tiles(previous, pixels)
+            if not tiles.any():
+                return list(self._words)
+            if tiles.mean() > FULL_OCR_THRESHOLD:
+                self._words = self._read_all(image)
+                return list(self._words)
+
+            regions = [
+                _pad(region, REGION_MARGIN, image.size)
+                for region in tile_regions(tiles)
+            ]
+            # Merged regions may touch more words, settle until nothing moves
+            while True:
+                settled = self._merge_overlapping(
+                    [self._settle(region, image.size) for region in regions]
+                )
+                if settled == regions:
+                    break
+                regions = settled
+            kept = [
+                word
+                for word in self._words
+                if not any(_intersects(_word_box(word), region) for region in regions)
+            ]
+            fresh = [
+                word for region in regions for word in self._read_region(image, region)
+            ]
+            logger.debug(
+                "Incremental OCR: %d of %d tiles changed, %d regions, %d words kept, %d read",
+                int(tiles.sum()),
+                tiles.size,
+                len(regions),
+                len(kept),
+                len(fresh),
+            )
+            self._words = reading_order(self._words, kept + fresh)
+            return list(self._words)
@@ -0,0 +1,190 @@
+"""Grounding of element descriptions that name a visible text label, from the OCR words alone.
+
+Descriptions often quote the label of their target, e.g. "the 'OK' button" or "the menu item
+'Format Cells...'". Such a label that appears exactly once on screen locates the element
+without a grounding model call. Labels are looked up in an index of the OCR words by
+normalized text, and multi-word labels must continue on the same line.
+"""
+
+import logging
+import random
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from gui_agents.s3.utils.phrase_matcher import normalize_token
+
+logger = logging.getLogger("desktopenv.agent")
+
+# Quoted labels, in straight or curly quotes, apostrophes inside words do not count
+QUOTED_LABEL = re.compile(
+    r"(?<!\w)\"([^\"]+)\"|(?<!\w)'([^']+)'(?!\w)|“([^”]+)”|‘([^’]+)’"
+)
+# Runs of capitalized words, e.g. Save or Format Cells
+CAPITALIZED_LABEL = re.compile(r"\b[A-Z][\w.&-]*(?:\s+[A-Z][\w.&-]*)*")
+# Capitalized words that are not labels
+STOP_WORDS = {"the", "a", "an", "click", "select", "button", "menu", "icon", "in"}
+# Horizontal gap allowed between the words of a label, in word heights
+MAX_WORD_GAP = 1.5
+
+Box = Tuple[int, int, int, int]  # left, top, right, bottom
+
+
+def extract_labels(description: str, capitalized: bool = False) -> List[str]:
+    """Candidate labels of a description.
+
+    Args:
+        description (str): The element description.
+        capitalized (bool): Without quotes, take a single run of capitalized words as the
+            label. Such runs are often app names or text beside the control, so this is off
+            by default.
+
+    Returns:
+        List[str]: The quoted labels, or the capitalized one, or nothing.
+    """
+    quoted = [
+        next(group for group in match.groups() if group)
+        for match in QUOTED_LABEL.finditer(description)
+    ]
+    if quoted or not capitalized:
+        return quoted
+    labels = []
+    for match in CAPITALIZED_LABEL.finditer(description):
+        # Possessives name an owner (an app, a window), not a label
+        if description.startswith("'s", match.end()):
+            return []
+        words = [w for w in match.group().split() if w.lower() not in STOP_WORDS]
+        if words:
+            labels.append(" ".join(words))
+    # Several runs are too ambiguous to pick from
+    return labels if len(labels) == 1 else []
+
+
+def _box(element: Dict) -> Box:
+    return (
+        element["left"],
+        element["top"],
+        element["left"] + element["width"],
+        element["top"] + element["height"],
+    )
+
+
+def _continues_line(previous: Dict, word: Dict) -> bool:
+    """Whether a word follows another on the same line."""
+    p_left, p_top, p_right, p_bottom = _box(previous)
+    left, top, right, bottom = _box(word)
+    overlap = min(p_bottom, bottom) - max(p_top, top)
+    height = max(p_bottom - p_top, bottom - top, 1)
+    return overlap > height / 2 and 0 <= left - p_right <= MAX_WORD_GAP * height
+
+
+class LabelResolver:
+    """Finds unique on-screen occurrences of the labels named in element descriptions.
+
+    Hits, and on a sample of them the agreement with the grounding model, are counted and
+    logged so the stage can be tuned before it is trusted more widely.
+    """
+
+    def __init__(self, audit_rate: float = 0.0, capitalized_labels: bool = False):
+        """
+        Args:
+            audit_rate: float
+                Share of hits also sent to the grounding model, whose answer is then used
+            capitalized_labels: bool
+                Also resolve unquoted runs of capitalized words, see extract_labels
+        """
+        self.audit_rate = audit_rate
+        self.capitalized_labels = capitalized_labels
+        self.lookups = 0
+        self.hits = 0
+        self.audits = 0
+        self.disagreements = 0
+        self._lock = threading.Lock()
+
+    def labels(self, description: str) -> List[str]:
+        return extract_labels(description, self.capitalized_labels)
+
+    def resolve(self, description: str, ocr_elements: List[Dict]) -> Optional[Box]:
+        """Screen box of the unique occurrence of a label of the description, if any.
+
+        Args:
+            description (str): The element description.
+            ocr_elements (List[Dict]): The OCR words of the screenshot, in reading order.
+
+        Returns:
+            Optional[Box]: The (left, top, right, bottom) box of the label, None when no label
+                occurs exactly once.
+        """
+        labels = self.labels(description)
+        if not labels:
+            return None
+        index = defaultdict(list)
+        for position, element in enumerate(ocr_elements):
+            index[normalize_token(element["text"])].append(position)
+
+        found = None
+        for label in labels:
+            tokens = [token for token in map(normalize_token, label.split()) if token]
+            if not tokens:
+                continue
+            matches = []
+            for start in index.get(tokens[0], []):
+                end = start + len(tokens)
+                if end > len(ocr_elements):
+                    continue
+                if all(
+                    normalize_token(ocr_elements[start + i]["text"]) == token
+                    and _continues_line(
+                        ocr_elements[start + i - 1], ocr_elements[start + i]
+                    )
+                    for i, token in enumerate(tokens[1:], 1)
+                ):
+                    matches.append((start, end))
+            if len(matches) == 1:
+                start, end = matches[0]
+                boxes = [_box(element) for element in ocr_elements[start:end]]
+                found = (
+                    min(b[0] for b in boxes),
+                    min(b[1] for b in boxes),
+                    max(b[2] for b in boxes),
+                    max(b[3] for b in boxes),
+                )
+                break
+
+        with self._lock:
+            self.lookups += 1
+            self.hits += found is not None
+            logger.info(
+                "Label grounding %s for '%s' (hit rate %d/%d)",
+                "hit" if found else "miss",
+                description,
+                self.hits,
+                self.lookups,
+            )
+        return found
+
+    def should_audit(self) -> bool:
+        return random.random() < self.audit_rate
+
+    def record_audit(self, box: Box, model_point: List[int]):
+        """Compare a hit with the grounding model's answer, in screen coordinates."""
+        left, top, right, bottom = box
+        # The label may sit beside its control (e.g. a checkbox), allow some slack
+        slack = max(bottom - top, 10)
+        agrees = (
+            left - slack <= model_point[0] <= right + slack
+            and top - slack <= model_point[1] <= bottom + slack
+        )
+        with self._lock:
+            self.audits += 1
+            self.disagreements += not agrees
+            log = logger.info if agrees else logger.warning
+            log(
+                "Label grounding %s with the grounding model: label %s, model %s (%d/%d disagreements)",
+                "agrees" if agrees else "disagrees",
+                box,
+                model_point,
+                self.disagreements,
+                self.audits,
+            )
@@ -0,0 +1,146 @@
+"""Tesseract word extraction, serial or split into bands read in parallel processes.
+
+A single ``pytesseract.image_to_data`` call is single-threaded and takes seconds on 1440p and
+4K screens. ParallelOCR cuts the screen into horizontal bands that overlap by more than half
+a line of text. Each band is read in a persistent process pool, and every word is kept only
+by the band whose core holds its vertical center. Words therefore come out once each, whole,
+with the same boxes as the serial path.
+"""
+
+import logging
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import pytesseract
+from PIL import Image
+from pytesseract import Output
+
+logger = logging.getLogger("desktopenv.agent")
+
+# Extra rows read above and below each band's core, covering words up to twice as tall
+BAND_OVERLAP = 48
+# Bands are not made shorter than this, below it the screen is read serially
+MIN_BAND_HEIGHT = 360
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def read_words(image: Image.Image) -> List[Dict]:
+    """Words of an image in Tesseract's reading order.
+
+    Returns:
+        List[Dict]: Words with their text, block_num, left, top, width and height.
+    """
+    image_data = pytesseract.image_to_data(image, output_type=Output.DICT)
+
+    words = []
+    for i, word in enumerate(image_data["text"]):
+        # Clean text by removing leading and trailing spaces and non-alphabetical characters, but keeping punctuation
+        text = re.sub(r"^[^a-zA-Z\s.,!?;:\-\+]+|[^a-zA-Z\s.,!?;:\-\+]+$", "", word)
+        if text:
+            words.append(
+                {
+                    "text": text,
+                    "block_num": image_data["block_num"][i],
+                    "left": image_data["left"][i],
+                    "top": image_data["top"][i],
+                    "width": image_data["width"][i],
+                    "height": image_data["height"][i],
+                }
+            )
+    return words
+
+
+def get_ocr_pool(workers: int) -> ProcessPoolExecutor:
+    """The process pool shared by every ParallelOCR, started once and kept warm across steps."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned rather than forked, the agent process runs threads
+            _pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            logger.info("Started an OCR process pool of %d workers", workers)
+        return _pool
+
+
+class ParallelOCR:
+    """Reads large screenshots as overlapping bands in parallel, small ones serially."""
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        executor: Optional[Executor] = None,
+        read=read_words,
+    ):
+        """
+        Args:
+            workers: int
+                Bands read at once, defaults to the number of cores
+            executor: Executor
+                Executor reading the bands, defaults to the shared process pool
+            read: Callable[[Image.Image], List[Dict]]
+                Word reader of one band, must be picklable for a process pool
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.read = read
+        self._executor = executor
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = get_ocr_pool(self.workers)
+        return self._executor
+
+    def _band_count(self, height: int) -> int:
+        return max(1, min(self.workers, height // MIN_BAND_HEIGHT))
+
+    def __call__(self, image: Image.Image) -> List[Dict]:
+        """Words of an image, in band order and within a band in Tesseract's reading order.
+
+        Args:
+            image (Image.Image): The screenshot.
+
+        Returns:
+            List[Dict]: The words, in the schema of read_words.
+        """
+        count = self._band_count(image.height)
+        if count == 1:
+            return self.read(image)
+
+        # Cores partition the rows, each band adds the overlap on both sides
+        edges = [round(i * image.height / count) for i in range(count + 1)]
+        bands = []
+        for core_top, core_bottom in zip(edges, edges[1:]):
+            top = max(0, core_top - BAND_OVERLAP)
+            bottom = min(image.height, core_bottom + BAND_OVERLAP)
+            bands.append((core_top, core_bottom, top, bottom))
+        futures = [
+            self.executor.submit(self.read, image.crop((0, top, image.width, bottom)))
+            for _, _, top, bottom in bands
+        ]
+
+        words = []
+        block_offset = 0
+        for (core_top, core_bottom, top, _), future in zip(bands, futures):
+            band_words = future.result()
+            for word in band_words:
+                word_top = word["top"] + top
+                center = word_top + word["height"] / 2
+                if not core_top <= center < core_bottom:
+                    continue
+                words.append(
+                    {
+                        **word,
+                        "top": word_top,
+                        "block_num": word["block_num"] + block_offset,
+                    }
+                )
+            # Blocks of different bands are different groups
+            block_offset += max((word["block_num"] for word in band_words), default=0)
+        return words
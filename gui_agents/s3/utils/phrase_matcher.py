@@ -0,0 +1,107 @@
+"""Deterministic matching of a phrase against the OCR word sequence.
+
+Text grounding only needs the id of the first or last word of a phrase. When the phrase occurs
+once in the OCR words, up to case, punctuation and OCR misreadings, that id is found locally.
+Missing and ambiguous matches return None so the caller can fall back to the text span agent.
+"""
+
+import difflib
+import functools
+import re
+import unicodedata
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Score a match needs to be used without asking the model
+MATCH_THRESHOLD = 0.85
+# Another match scoring within this margin of the best one makes the phrase ambiguous
+AMBIGUITY_MARGIN = 0.05
+# Word similarity above which a word can anchor a match of the phrase's first or last word
+ANCHOR_SIMILARITY = 0.5
+
+
+def normalize_token(text: str) -> str:
+    """Lowercased letters and digits of a word, so case and punctuation do not count."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return re.sub(r"[^\w]|_", "", text)
+
+
+@functools.lru_cache(maxsize=65536)
+def token_similarity(a: str, b: str) -> float:
+    """Similarity of two normalized words, from 0 to 1."""
+    if a == b:
+        return 1.0
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+
+def token_edit_distance(a: Sequence[str], b: Sequence[str]) -> float:
+    """Levenshtein distance over words, a substitution costing the words' dissimilarity."""
+    previous = [float(j) for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [float(i)] + [0.0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + 1 - token_similarity(a[i - 1], b[j - 1]),
+            )
+        previous = current
+    return previous[-1]
+
+
+def _candidate_windows(tokens: List[str], words: List[str]) -> set:
+    """Windows of about the phrase's length starting or ending on a word like its first or last."""
+    n = len(tokens)
+    sizes = {max(1, n - 1), n, n + 1}
+    windows = set()
+    for index, word in enumerate(words):
+        if token_similarity(word, tokens[0]) >= ANCHOR_SIMILARITY:
+            windows.update((index, index + size) for size in sizes)
+        if token_similarity(word, tokens[-1]) >= ANCHOR_SIMILARITY:
+            windows.update((index + 1 - size, index + 1) for size in sizes)
+    return {(start, end) for start, end in windows if start >= 0 and end <= len(words)}
+
+
+def match_phrase(
+    phrase: str, ocr_elements: List[Dict], alignment: str = ""
+) -> Optional[int]:
+    """Index of the OCR word a phrase resolves to, if the phrase matches once with confidence.
+
+    Args:
+        phrase (str): The phrase to find.
+        ocr_elements (List[Dict]): OCR words in reading order, each with its "text".
+        alignment (str): "start" for the phrase's first word, "end" for its last word, empty
+            for the first word of a single word phrase.
+
+    Returns:
+        Optional[int]: Index into ocr_elements, None when no match is confident and unique.
+    """
+    tokens = [token for token in map(normalize_token, phrase.split()) if token]
+    if not tokens:
+        return None
+    # Words normalizing to nothing (stray punctuation) are skipped, keeping their positions
+    positions = [
+        index
+        for index, element in enumerate(ocr_elements)
+        if normalize_token(element["text"])
+    ]
+    words = [normalize_token(ocr_elements[index]["text"]) for index in positions]
+
+    scored: List[Tuple[float, int, int, int]] = []
+    for start, end in _candidate_windows(tokens, words):
+        window = words[start:end]
+        distance = token_edit_distance(tokens, window)
+        score = 1 - distance / max(len(tokens), len(window))
+        scored.append((score, -abs(len(window) - len(tokens)), start, end))
+    if not scored:
+        return None
+    scored.sort(reverse=True)
+    best_score, _, best_start, best_end = scored[0]
+    if best_score < MATCH_THRESHOLD:
+        return None
+    for score, _, start, end in scored[1:]:
+        if score < best_score - AMBIGUITY_MARGIN:
+            break
+        # Variants of the same occurrence overlap it, another occurrence does not
+        if end <= best_start or start >= best_end:
+            return None
+    return positions[best_end - 1 if alignment == "end" else best_start]
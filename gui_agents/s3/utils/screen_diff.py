@@ -0,0 +1,107 @@
+"""Cheap detection of screenshots that repeat an earlier frame.
+
+Waits, missed clicks and note-taking actions leave the screen as it was. Frames are compared on
+a downscaled grayscale copy: a pixel counts as changed when it moves by more than a few gray
+levels, and a frame is unchanged when the share of changed pixels stays under a threshold. That
+absorbs compression noise and stray pixels while a typed character or an opened menu counts.
+"""
+
+import logging
+from io import BytesIO
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger("desktopenv.agent")
+
+# Downscaling factor of the fingerprints, 1920x1080 compares as 480x270
+FINGERPRINT_REDUCTION = 4
+# Gray levels a fingerprint pixel may move by before it counts as changed
+PIXEL_TOLERANCE = 8
+# Share of changed fingerprint pixels under which two frames are the same screen, a single pixel
+# at 480x270. Strict on purpose: a missed change misleads the agent, a missed repeat only costs
+# an image
+DEFAULT_CHANGE_THRESHOLD = 0.00001
+# Width of the thumbnails sent in place of unchanged screenshots
+THUMBNAIL_WIDTH = 480
+
+
+def fingerprint(screenshot: bytes) -> np.ndarray:
+    """Downscaled grayscale pixels of a screenshot, the representation frames are compared on."""
+    image = Image.open(BytesIO(screenshot)).convert("L")
+    return np.asarray(image.reduce(FINGERPRINT_REDUCTION), dtype=np.int16)
+
+
+def thumbnail_size(screenshot: bytes, width: int = THUMBNAIL_WIDTH) -> Tuple[int, int]:
+    """Size of a thumbnail of the screenshot keeping its aspect ratio, read from the header only."""
+    screen_width, screen_height = Image.open(BytesIO(screenshot)).size
+    width = min(width, screen_width)
+    return width, max(1, round(screen_height * width / screen_width))
+
+
+def changed_fraction(a: np.ndarray, b: np.ndarray) -> float:
+    """Share of fingerprint pixels that differ between two frames, 1.0 if their sizes differ."""
+    if a.shape != b.shape:
+        return 1.0
+    return float(np.count_nonzero(np.abs(a - b) > PIXEL_TOLERANCE)) / a.size
+
+
+class ScreenChangeDetector:
+    """Tracks the last frame sent in full and reports when later frames still match it.
+
+    Frames are compared with the reference frame rather than with their direct predecessor, so
+    slow changes across many steps still add up and end the match.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_CHANGE_THRESHOLD):
+        """
+        Args:
+            threshold: float
+                Share of changed pixels under which a frame is unchanged
+        """
+        self.threshold = threshold
+        self.reset()
+
+    def reset(self):
+        self._reference: Optional[Tuple[bytes, np.ndarray, int]] = None
+
+    @property
+    def reference(self) -> Optional[bytes]:
+        """The screenshot last sent in full."""
+        return self._reference[0] if self._reference else None
+
+    def observe(
+        self, screenshot: bytes, step: int, max_age: Optional[int] = None
+    ) -> Optional[int]:
+        """Compare a frame with the reference frame.
+
+        Args:
+            screenshot (bytes): The frame of this step.
+            step (int): Index of this step.
+            max_age (int): Steps after which the reference is refreshed even if unchanged,
+                e.g. once its image may have left the history window.
+
+        Returns:
+            Optional[int]: The step of the matching reference frame, or None when the frame
+                changed and becomes the new reference.
+        """
+        if self._reference is not None:
+            reference, reference_print, reference_step = self._reference
+            fresh = max_age is None or step - reference_step < max_age
+            if fresh and screenshot == reference:
+                return reference_step
+            current_print = fingerprint(screenshot)
+            if fresh:
+                fraction = changed_fraction(reference_print, current_print)
+                if fraction <= self.threshold:
+                    logger.debug(
+                        "Screen unchanged since step %d (%.4f%% of pixels changed)",
+                        reference_step + 1,
+                        fraction * 100,
+                    )
+                    return reference_step
+        else:
+            current_print = fingerprint(screenshot)
+        self._reference = (screenshot, current_print, step)
+        return None
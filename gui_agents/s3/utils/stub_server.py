@@ -0,0 +1,300 @@
+"""Tiny OpenAI/Anthropic-compatible HTTP server serving scripted responses.
+
+Stands in for vLLM/UI-TARS grounding endpoints (or any chat model) on machines without GPUs or
+network access, e.g. to benchmark the agent loop in CI:
+
+    python -m gui_agents.s3.utils.stub_server --fixture fixture.json --port 8000
+
+and point the agent at ``http://127.0.0.1:8000/v1`` with any API key. Responses are picked by the
+requested model name, falling back to the fixture's ``default`` responses.
+"""
+
+import argparse
+import json
+import logging
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+from gui_agents.s3.core.rate_limiter import CHARS_PER_TOKEN, estimate_tokens
+from gui_agents.s3.core.replay import ReplayScript
+
+logger = logging.getLogger("desktopenv.agent")
+
+STREAM_CHUNK_CHARS = 16
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves /v1/chat/completions (OpenAI) and /v1/messages (Anthropic), streaming or not."""
+
+    script: ReplayScript = None
+    default_response: Optional[str] = None
+
+    def log_message(self, format, *args):
+        logger.debug("stub server: " + format, *args)
+
+    def _send_json(self, payload: Dict, status: int = 200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+    def _send_event(self, payload, event: Optional[str] = None):
+        data = payload if isinstance(payload, str) else json.dumps(payload)
+        prefix = f"event: {event}\n" if event else ""
+        self.wfile.write(f"{prefix}data: {data}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            models = [key for key in self.script.responses if key != "default"]
+            self._send_json(
+                {
+                    "object": "list",
+                    "data": [{"id": m, "object": "model"} for m in models],
+                }
+            )
+        else:
+            self._send_json({"error": {"message": "Not found"}}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        model = request.get("model")
+        try:
+            text = self.script.next_response(model, self.default_response)
+        except KeyError as e:
+            self._send_json({"error": {"message": str(e)}}, status=400)
+            return
+        time.sleep(self.script.sample_latency(model))
+        usage = (
+            estimate_tokens(request.get("messages", [])),
+            len(text) // CHARS_PER_TOKEN,
+        )
+
+        path = self.path.rstrip("/")
+        if path.endswith("/chat/completions"):
+            self._openai_response(request, text, usage)
+        elif path.endswith("/messages"):
+            self._anthropic_response(request, text, usage)
+        else:
+            self._send_json({"error": {"message": "Not found"}}, status=404)
+
+    def _openai_response(self, request: Dict, text: str, usage):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        common = {
+            "id": completion_id,
+            "created": int(time.time()),
+            "model": request.get("model"),
+        }
+        if not request.get("stream"):
+            self._send_json(
+                {
+                    **common,
+                    "object": "chat.completion",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": text},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": usage[0],
+                        "completion_tokens": usage[1],
+                        "total_tokens": sum(usage),
+                    },
+                }
+            )
+            return
+        self._start_stream()
+        for i in range(0, len(text), STREAM_CHUNK_CHARS):
+            self._send_event(
+                {
+                    **common,
+                    "object": "chat.completion.chunk",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "delta": {"content": text[i : i + STREAM_CHUNK_CHARS]},
+                            "finish_reason": None,
+                        }
+                    ],
+                }
+            )
+        self._send_event(
+            {
+                **common,
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+        )
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self._send_event(
+                {
+                    **common,
+                    "object": "chat.completion.chunk",
+                    "choices": [],
+                    "usage": {
+                        "prompt_tokens": usage[0],
+                        "completion_tokens": usage[1],
+                        "total_tokens": sum(usage),
+                    },
+                }
+            )
+        self._send_event("[DONE]")
+
+    def _anthropic_response(self, request: Dict, text: str, usage):
+        message = {
+            "id": f"msg_{uuid.uuid4().hex[:12]}",
+            "type": "message",
+            "role": "assistant",
+            "model": request.get("model"),
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+        }
+        if not request.get("stream"):
+            self._send_json(
+                {
+                    **message,
+                    "content": [{"type": "text", "text": text}],
+                    "usage": {"input_tokens": usage[0], "output_tokens": usage[1]},
+                }
+            )
+            return
+        self._start_stream()
+        self._send_event(
+            {
+                "type": "message_start",
+                "message": {
+                    **message,
+                    "content": [],
+                    "stop_reason": None,
+                    "usage": {"input_tokens": usage[0], "output_tokens": 0},
+                },
+            },
+            event="message_start",
+        )
+        self._send_event(
+            {
+                "type": "content_block_start",
+                "index": 0,
+                "content_block": {"type": "text", "text": ""},
+            },
+            event="content_block_start",
+        )
+        for i in range(0, len(text), STREAM_CHUNK_CHARS):
+            self._send_event(
+                {
+                    "type": "content_block_delta",
+                    "index": 0,
+                    "delta": {
+                        "type": "text_delta",
+                        "text": text[i : i + STREAM_CHUNK_CHARS],
+                    },
+                },
+                event="content_block_delta",
+            )
+        self._send_event(
+            {"type": "content_block_stop", "index": 0}, event="content_block_stop"
+        )
+        self._send_event(
+            {
+                "type": "message_delta",
+                "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                "usage": {"output_tokens": usage[1]},
+            },
+            event="message_delta",
+        )
+        self._send_event({"type": "message_stop"}, event="message_stop")
+
+
+def serve_stub(
+    script: ReplayScript,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    default_response: Optional[str] = None,
+    background: bool = True,
+) -> ThreadingHTTPServer:
+    """Start the stub server.
+
+    Args:
+        script (ReplayScript): Responses and latencies, keyed by model name.
+        host (str): Interface to bind.
+        port (int): Port to bind, 0 picks a free one (see ``server.server_address``).
+        default_response (str): Response for models without scripted responses.
+        background (bool): Serve from a daemon thread and return immediately.
+
+    Returns:
+        ThreadingHTTPServer: The running server, call ``shutdown()`` to stop it.
+    """
+    handler = type(
+        "ScriptedStubHandler",
+        (StubHandler,),
+        {"script": script, "default_response": default_response},
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        server.serve_forever()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="OpenAI/Anthropic-compatible stand-in server with scripted responses"
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--fixture",
+        type=str,
+        default=None,
+        help="JSON fixture with responses per model name (and optionally latency)",
+    )
+    parser.add_argument(
+        "--default_response",
+        type=str,
+        default="(960, 540)",
+        help="Response for models without scripted responses, a grounding point by default",
+    )
+    parser.add_argument(
+        "--latency",
+        type=str,
+        default=None,
+        help='Latency spec as JSON, e.g. \'{"distribution": "lognormal", "median": 0.8, "sigma": 0.4}\'',
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    latency = json.loads(args.latency) if args.latency else None
+    if args.fixture:
+        script = ReplayScript.from_file(args.fixture, latency=latency, seed=args.seed)
+    else:
+        script = ReplayScript(latency=latency, seed=args.seed)
+    print(f"Serving scripted responses on http://{args.host}:{args.port}/v1")
+    serve_stub(
+        script,
+        host=args.host,
+        port=args.port,
+        default_response=args.default_response,
+        background=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Per-consumer variants of the observation screenshot, each transcoded once per step.
+
+The grounding model can get the screenshot scaled down to fit its input resolution, keeping
+the aspect ratio, and the planner and reflection agents can get a compact WebP/JPEG copy. A
+screenshot already in the consumer's size and format is passed through untouched. OCR keeps
+reading the original screenshot, its pixel coordinates are screen coordinates.
+"""
+
+import logging
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+from gui_agents.s3.core.identity_memo import IdentityMemo
+
+logger = logging.getLogger("desktopenv.agent")
+
+# Formats a consumer may ask for, mapped to their PIL names
+IMAGE_FORMATS = {"png": "PNG", "webp": "WEBP", "jpeg": "JPEG", "jpg": "JPEG"}
+
+# Variants kept in memory, a handful per step is enough
+MAX_VARIANTS = 16
+
+
+def fit_size(size: Tuple[int, int], bound: Tuple[int, int]) -> Tuple[int, int]:
+    """Largest size of the same aspect ratio within bound, never larger than size itself."""
+    scale = min(1.0, bound[0] / size[0], bound[1] / size[1])
+    if scale == 1.0:
+        return tuple(size)
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def transcode_image(
+    image_bytes: bytes,
+    size: Optional[Tuple[int, int]] = None,
+    image_format: str = "png",
+    quality: int = 85,
+) -> bytes:
+    """Scale down and re-encode an image, returning it untouched when nothing would change.
+
+    Args:
+        image_bytes (bytes): The encoded source image.
+        size (Tuple[int, int]): Bounding (width, height), the aspect ratio is kept. None keeps
+            the source size.
+        image_format (str): One of png, webp or jpeg.
+        quality (int): Quality of the lossy formats, 1 to 100.
+
+    Returns:
+        bytes: The transcoded image.
+    """
+    pil_format = IMAGE_FORMATS[image_format.lower()]
+    # Only the header is read until the pixels are needed
+    image = Image.open(BytesIO(image_bytes))
+    target = fit_size(image.size, size) if size is not None else image.size
+    if target == image.size and image.format == pil_format == "PNG":
+        return image_bytes
+    if target != image.size:
+        image = image.resize(target, Image.LANCZOS)
+    if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    output = BytesIO()
+    if pil_format == "PNG":
+        image.save(output, format=pil_format)
+    else:
+        image.save(output, format=pil_format, quality=quality)
+    return output.getvalue()
+
+
+class ScreenshotTranscoder:
+    """Transcoding settings of one consumer, e.g. the grounding model or the planner.
+
+    Variants are memoized process-wide by the identity of the screenshot bytes, so agents
+    sharing settings (generator and reflection, every grounding call of a step) transcode each
+    screenshot once. A PNG screenshot that already fits the size is passed through untouched.
+    """
+
+    _variants = IdentityMemo(MAX_VARIANTS)
+
+    def __init__(
+        self,
+        size: Optional[Tuple[int, int]] = None,
+        image_format: str = "png",
+        quality: int = 85,
+    ):
+        """
+        Args:
+            size: Tuple[int, int]
+                Bounding (width, height) of the consumer, scaled into keeping the aspect ratio;
+                None keeps the screen resolution
+            image_format: str
+                png, webp or jpeg
+            quality: int
+                Quality of the lossy formats
+        """
+        if image_format.lower() not in IMAGE_FORMATS:
+            raise ValueError(
+                f"Unsupported image format '{image_format}', use one of {sorted(IMAGE_FORMATS)}"
+            )
+        self.size = tuple(size) if size else None
+        self.image_format = image_format.lower()
+        self.quality = quality
+
+    @classmethod
+    def from_engine_params(
+        cls, engine_params: Dict, resize: bool = False
+    ) -> "ScreenshotTranscoder":
+        """Settings from engine params: ``image_format`` and ``image_quality``, and with
+        ``resize`` the ``grounding_width``/``grounding_height`` of a grounding model when its
+        ``grounding_resize`` param opts in."""
+        size = None
+        if (
+            resize
+            and engine_params.get("grounding_resize")
+            and engine_params.get("grounding_width")
+        ):
+            size = (engine_params["grounding_width"], engine_params["grounding_height"])
+        return cls(
+            size=size,
+            image_format=engine_params.get("image_format") or "png",
+            quality=engine_params.get("image_quality") or 85,
+        )
+
+    @property
+    def passthrough(self) -> bool:
+        return self.size is None and self.image_format == "png"
+
+    def __call__(self, screenshot):
+        """The variant of a screenshot for this consumer.
+
+        Args:
+            screenshot (bytes): The observation screenshot.
+
+        Returns:
+            bytes: The transcoded screenshot, or the screenshot itself when nothing changes.
+        """
+        if self.passthrough or not isinstance(screenshot, bytes):
+            return screenshot
+        return self._variants.get(
+            screenshot,
+            lambda: self._transcode(screenshot),
+            self.size,
+            self.image_format,
+            self.quality,
+        )
+
+    def _transcode(self, screenshot: bytes) -> bytes:
+        variant = transcode_image(
+            screenshot, self.size, self.image_format, self.quality
+        )
+        logger.debug(
+            "Transcoded screenshot to %s within %s: %d -> %d bytes",
+            self.image_format,
+            self.size,
+            len(screenshot),
+            len(variant),
+        )
+        return variant
@@ -248,6 +248,17 @@ if __name__ == "__main__":
     parser.add_argument(
         "--temperature", type=float, default=1.0, help="Temperature for generation"
     )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Directory of the on-disk LLM response cache (disabled if unset)",
+    )
+    parser.add_argument(
+        "--cache-mode",
+        default="read_write",
+        choices=["read_write", "read_only", "record"],
+        help="Response cache mode (default: read_write)",
+    )
 
     args = parser.parse_args()
 
@@ -256,6 +267,8 @@ if __name__ == "__main__":
         "model": args.model,
         "engine_type": args.engine_type,
         "temperature": args.temperature,
+        "cache_dir": args.cache_dir,
+        "cache_mode": args.cache_mode,
     }
 
     print(f"Results directories: {args.results_dirs}")
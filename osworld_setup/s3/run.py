@@ -103,6 +103,13 @@ def run_env_tasks(
                 snapshot_name = None
         from gui_agents.s3.agents.agent_s import AgentS3
         from gui_agents.s3.agents.grounding import OSWorldACI
+        from gui_agents.s3.core.retry import CircuitOpenError, configure_retries
+
+        configure_retries(
+            max_attempts=args.llm_retry_max_attempts,
+            deadline=args.llm_retry_deadline,
+            request_timeout=args.llm_request_timeout,
+        )
 
         env = DesktopEnv(
             path_to_vm=args.path_to_vm,
@@ -139,7 +146,8 @@ def run_env_tasks(
                 item = task_queue.get(timeout=5)
             except Exception:
                 break
-            domain, example_id = item
+            domain, example_id = item[:2]
+            requeues = item[2] if len(item) > 2 else 0
             try:
                 config_file = os.path.join(
                     args.test_config_base_dir, f"examples/{domain}/{example_id}.json"
@@ -171,6 +179,27 @@ def run_env_tasks(
                         shared_scores,
                     )
                 except Exception as e:
+                    if (
+                        isinstance(e, CircuitOpenError)
+                        and requeues < args.max_task_requeues
+                    ):
+                        logger.warning(
+                            f"Re-queueing {domain}/{example_id} in {current_process().name}: {e}"
+                        )
+                        # The next task's recording must not pick up this one
+                        try:
+                            env.controller.end_recording(
+                                os.path.join(example_result_dir, "recording.mp4")
+                            )
+                        except Exception as rec_e:
+                            logger.error(f"Failed to end recording: {rec_e}")
+                        traj_path = os.path.join(example_result_dir, "traj.jsonl")
+                        if os.path.exists(traj_path):
+                            os.remove(traj_path)
+                        task_queue.put((domain, example_id, requeues + 1))
+                        # Let the breaker reach its probe before taking the next task
+                        time.sleep(max(e.retry_in, 0))
+                        continue
                     import traceback
 
                     logger.error(
@@ -319,6 +348,57 @@ def config() -> argparse.Namespace:
         help="Temperature to fix the generation model at (e.g. o3 can only be run with 1.0)",
     )
 
+    parser.add_argument(
+        "--model_rate_limit",
+        type=int,
+        default=-1,
+        help="Requests per minute allowed to the main generation model, shared by all environments (-1 for no limit)",
+    )
+    parser.add_argument(
+        "--model_tokens_per_minute",
+        type=int,
+        default=-1,
+        help="Tokens per minute allowed to the main generation model, shared by all environments (-1 for no limit)",
+    )
+
+    parser.add_argument(
+        "--model_early_stop",
+        action="store_true",
+        help="Stream the main generation model and stop as soon as the action block is complete",
+    )
+
+    parser.add_argument(
+        "--model_unchanged_screenshots",
+        type=str,
+        default="full",
+        choices=["full", "note", "thumbnail"],
+        help="How screenshots identical to an earlier step are sent to the main generation model: in full, as a note only, or as a note with a thumbnail",
+    )
+    parser.add_argument(
+        "--model_context_tokens",
+        type=int,
+        default=None,
+        help="Context window of the main generation model, longer histories are packed to fit it",
+    )
+    parser.add_argument(
+        "--model_incremental_serialization",
+        action="store_true",
+        help="Send pre-serialized request bodies to the main generation model, only encoding the new messages of each step",
+    )
+    parser.add_argument(
+        "--model_image_format",
+        type=str,
+        default="png",
+        choices=["png", "webp", "jpeg"],
+        help="Format of the screenshots sent to the main generation model, webp/jpeg shrink the upload several-fold",
+    )
+    parser.add_argument(
+        "--model_image_quality",
+        type=int,
+        default=85,
+        help="Quality of webp/jpeg screenshots sent to the main generation model",
+    )
+
     # grounding model config
     parser.add_argument(
         "--ground_provider",
@@ -327,7 +407,46 @@ def config() -> argparse.Namespace:
         help="The provider for the grounding model",
     )
     parser.add_argument(
-        "--ground_url", type=str, required=True, help="The URL of the grounding model"
+        "--ground_url",
+        type=str,
+        required=True,
+        help="The URL of the grounding model, or a comma-separated list of replica URLs to load balance over",
+    )
+    parser.add_argument(
+        "--ground_hedge",
+        action="store_true",
+        help="With several grounding replicas, duplicate a request on another replica once it exceeds the observed p95 latency",
+    )
+    parser.add_argument(
+        "--ground_incremental_ocr",
+        action="store_true",
+        help="Run OCR only on the regions that changed since the previous screenshot instead of on the whole screen",
+    )
+    parser.add_argument(
+        "--ground_cache",
+        action="store_true",
+        help="Reuse grounded coordinates across steps when the element's surroundings and the screen layout are unchanged",
+    )
+    parser.add_argument(
+        "--ground_label_resolver",
+        action="store_true",
+        help="Ground descriptions naming a label that appears once on screen from the OCR words, without calling the grounding model",
+    )
+    parser.add_argument(
+        "--ground_label_audit_rate",
+        type=float,
+        default=0.0,
+        help="Share of label resolver hits also sent to the grounding model, logging whether the two agree",
+    )
+    parser.add_argument(
+        "--ground_label_capitalized",
+        action="store_true",
+        help="Let the label resolver also take an unquoted run of capitalized words as the label",
+    )
+    parser.add_argument(
+        "--ground_resize_screenshots",
+        action="store_true",
+        help="Scale screenshots down to fit the grounding resolution, keeping the aspect ratio, before sending them to the grounding model",
     )
     parser.add_argument(
         "--ground_api_key",
@@ -353,6 +472,70 @@ def config() -> argparse.Namespace:
         required=True,
         help="Height of screenshot image after processor rescaling",
     )
+    parser.add_argument(
+        "--ground_rate_limit",
+        type=int,
+        default=-1,
+        help="Requests per minute allowed to the grounding model, shared by all environments (-1 for no limit)",
+    )
+    parser.add_argument(
+        "--ground_tokens_per_minute",
+        type=int,
+        default=-1,
+        help="Tokens per minute allowed to the grounding model, shared by all environments (-1 for no limit)",
+    )
+
+    # llm response cache config
+    parser.add_argument(
+        "--llm_cache_dir",
+        type=str,
+        default=None,
+        help="Directory of the on-disk LLM response cache, shared by all environments (disabled if unset)",
+    )
+    parser.add_argument(
+        "--llm_cache_mode",
+        type=str,
+        default="read_write",
+        choices=["read_write", "read_only", "record"],
+        help="read_write serves hits and stores misses, read_only never writes, record always calls the model and overwrites",
+    )
+    parser.add_argument(
+        "--llm_cache_max_size_mb",
+        type=float,
+        default=1024,
+        help="Size bound of the LLM response cache, least recently used entries are evicted first",
+    )
+    parser.add_argument(
+        "--llm_cache_sampled",
+        action="store_true",
+        help="Also cache calls made with a non-zero temperature, replaying one sample of them on every re-run",
+    )
+
+    # llm retry config
+    parser.add_argument(
+        "--llm_retry_deadline",
+        type=float,
+        default=120.0,
+        help="Seconds after which an LLM call stops retrying transient errors",
+    )
+    parser.add_argument(
+        "--llm_request_timeout",
+        type=float,
+        default=None,
+        help="Timeout of a single LLM request attempt, by default the client's 600 seconds",
+    )
+    parser.add_argument(
+        "--llm_retry_max_attempts",
+        type=int,
+        default=6,
+        help="Attempts per LLM call, including the first one",
+    )
+    parser.add_argument(
+        "--max_task_requeues",
+        type=int,
+        default=1,
+        help="Times a task failing on an open circuit breaker (endpoint down) is put back on the queue",
+    )
 
     args = parser.parse_args()
 
@@ -371,14 +554,43 @@ def test(args: argparse.Namespace, test_all_meta: dict) -> None:
         "base_url": getattr(args, "model_url", ""),
         "api_key": getattr(args, "model_api_key", ""),
         "temperature": getattr(args, "model_temperature", None),
+        "rate_limit": args.model_rate_limit,
+        "tokens_per_minute": args.model_tokens_per_minute,
+        "early_stop": args.model_early_stop,
+        "incremental_serialization": args.model_incremental_serialization,
+        "max_context_tokens": args.model_context_tokens,
+        "unchanged_screenshots": args.model_unchanged_screenshots,
+        "image_format": args.model_image_format,
+        "image_quality": args.model_image_quality,
+        "cache_dir": args.llm_cache_dir,
+        "cache_mode": args.llm_cache_mode,
+        "cache_max_size_mb": args.llm_cache_max_size_mb,
+        "cache_sampled": args.llm_cache_sampled,
     }
     engine_params_for_grounding = {
         "engine_type": args.ground_provider,
         "model": args.ground_model,
-        "base_url": getattr(args, "ground_url", ""),
+        "base_url": (
+            args.ground_url.split(",")
+            if "," in getattr(args, "ground_url", "")
+            else getattr(args, "ground_url", "")
+        ),
+        "hedge": args.ground_hedge,
+        "grounding_cache": args.ground_cache,
+        "label_resolver": args.ground_label_resolver,
+        "label_audit_rate": args.ground_label_audit_rate,
+        "label_capitalized": args.ground_label_capitalized,
+        "incremental_ocr": args.ground_incremental_ocr,
         "api_key": getattr(args, "ground_api_key", ""),
         "grounding_width": args.grounding_width,
         "grounding_height": args.grounding_height,
+        "grounding_resize": args.ground_resize_screenshots,
+        "rate_limit": args.ground_rate_limit,
+        "tokens_per_minute": args.ground_tokens_per_minute,
+        "cache_dir": args.llm_cache_dir,
+        "cache_mode": args.llm_cache_mode,
+        "cache_max_size_mb": args.llm_cache_max_size_mb,
+        "cache_sampled": args.llm_cache_sampled,
     }
 
     with Manager() as manager:
@@ -32,7 +32,10 @@ setup(
         'pywinauto; platform_system == "Windows"',  # Only for Windows
         'pywin32; platform_system == "Windows"',  # Only for Windows
     ],
-    extras_require={"dev": ["black"]},  # Code formatter for linting
+    extras_require={
+        "dev": ["black"],  # Code formatter for linting
+        "http2": ["httpx[http2]"],  # HTTP/2 for the shared API client pool
+    },
     entry_points={
         "console_scripts": [
             "agent_s=gui_agents.s3.cli_app:main",
@@ -0,0 +1,44 @@
+"""Fixtures shared by the test modules."""
+
+import numpy as np
+
+from gui_agents.s3.agents.grounding import OSWorldACI
+
+# Engine params of agents whose model calls are stubbed out by the tests
+ENGINE_PARAMS = {"engine_type": "openai", "model": "gpt-4o", "api_key": "x"}
+
+
+def make_aci(**grounding_params) -> OSWorldACI:
+    """OSWorldACI on a 1920x1080 screen, grounding params added to the stub engine params."""
+    return OSWorldACI(
+        env=None,
+        platform="linux",
+        engine_params_for_generation=ENGINE_PARAMS,
+        engine_params_for_grounding={
+            **ENGINE_PARAMS,
+            "grounding_width": 1920,
+            "grounding_height": 1080,
+            **grounding_params,
+        },
+        width=1920,
+        height=1080,
+    )
+
+
+def read_rectangles(image):
+    """Fake OCR reading every gray level of the image as the word 'w<level>', in one block."""
+    pixels = np.asarray(image)
+    words = []
+    for level in sorted(set(np.unique(pixels)) - {255}):
+        rows, cols = np.nonzero(pixels == level)
+        words.append(
+            {
+                "text": f"w{level}",
+                "block_num": 1,
+                "left": int(cols.min()),
+                "top": int(rows.min()),
+                "width": int(cols.max() - cols.min() + 1),
+                "height": int(rows.max() - rows.min() + 1),
+            }
+        )
+    return words
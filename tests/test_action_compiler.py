@@ -0,0 +1,66 @@
+import unittest
+from typing import List, Optional
+
+from gui_agents.s3.agents.grounding import ACI, agent_action
+from gui_agents.s3.utils.action_compiler import (
+    ActionCompileError,
+    compile_action,
+    is_single_action,
+)
+
+
+class _ToyACI(ACI):
+    @agent_action
+    def click(
+        self, element_description: str, num_clicks: int = 1, hold_keys: List = []
+    ):
+        return f"click({element_description!r}, {num_clicks}, {hold_keys})"
+
+    @agent_action
+    def type(self, element_description: Optional[str] = None, text: str = ""):
+        return f"type({element_description!r}, {text!r})"
+
+    def helper(self):
+        return "not an action"
+
+
+class TestActionCompiler(unittest.TestCase):
+    def test_compiles_and_runs_a_call(self):
+        agent = _ToyACI()
+        action = compile_action("agent.click('the OK button', num_clicks=2)\n", agent)
+        self.assertEqual(action.name, "click")
+        self.assertEqual(
+            action.arguments, {"element_description": "the OK button", "num_clicks": 2}
+        )
+        self.assertEqual(action.grounding_queries, ("the OK button",))
+        self.assertEqual(action.run(agent), "click('the OK button', 2, [])")
+        self.assertIs(
+            compile_action("agent.click('the OK button', num_clicks=2)", agent), action
+        )
+        self.assertEqual(
+            compile_action("agent.type(text='hi')", agent).run(agent),
+            "type(None, 'hi')",
+        )
+
+    def test_rejects_invalid_actions(self):
+        agent = _ToyACI()
+        for code in [
+            "agent.click(",  # syntax error
+            "agent.click('a')\nagent.click('b')",  # two actions
+            "agent.helper()",  # not an agent action
+            "agent.click(__import__('os').system('true'))",  # not a literal
+            "agent.click('a', num_clicks='2')",  # wrong type
+            "agent.click('a', clicks=2)",  # unknown parameter
+            "agent.click()",  # missing argument
+        ]:
+            with self.subTest(code=code), self.assertRaises(ActionCompileError):
+                compile_action(code, agent)
+
+    def test_single_action_check(self):
+        self.assertTrue(is_single_action("agent.wait(1)  # let it load\n"))
+        self.assertFalse(is_single_action("x = 1\nagent.wait(1)"))
+        self.assertFalse(is_single_action("print('hi')"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import asyncio
+import unittest
+
+from openai import AsyncOpenAI, OpenAI
+
+from gui_agents.s3.core.client_pool import get_async_client, get_client
+from gui_agents.s3.core.engine import LMMEngineOpenAI
+
+
+class TestClientPool(unittest.TestCase):
+    def test_engines_on_same_endpoint_share_a_client(self):
+        params = {"base_url": "http://localhost:8000/v1", "api_key": "sk-test"}
+        self.assertIs(get_client(OpenAI, **params), get_client(OpenAI, **params))
+        self.assertIsNot(
+            get_client(OpenAI, **params),
+            get_client(OpenAI, base_url=params["base_url"], api_key="sk-other"),
+        )
+
+        generator = LMMEngineOpenAI(model="gpt-4o", **params)
+        reflection = LMMEngineOpenAI(model="gpt-4o-mini", **params)
+        self.assertEqual(generator._client_params(), reflection._client_params())
+
+    def test_async_clients_are_per_event_loop(self):
+        async def lookup():
+            return get_async_client(AsyncOpenAI, api_key="sk-test")
+
+        async def lookup_twice():
+            return await lookup() is await lookup()
+
+        self.assertTrue(asyncio.run(lookup_twice()))
+        self.assertIsNot(asyncio.run(lookup()), asyncio.run(lookup()))
+
+
+if __name__ == "__main__":
+    unittest.main()
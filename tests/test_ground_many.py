@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+
+from gui_agents.s3.core.telemetry import collect_llm_calls, track_llm_call
+
+from helpers import make_aci
+
+
+class TestGroundMany(unittest.TestCase):
+    def setUp(self):
+        self.aci = make_aci()
+        self.aci.assign_screenshot({"screenshot": b"frame"})
+
+    def test_drag_and_drop_grounds_both_ends_concurrently(self):
+        def generate_coords(description, obs):
+            with track_llm_call("grounding", "ui-tars"):
+                time.sleep(0.3)
+            return [100, 200] if description == "start" else [300, 400]
+
+        with mock.patch.object(self.aci, "generate_coords", generate_coords):
+            with collect_llm_calls() as calls:
+                started = time.monotonic()
+                command = self.aci.drag_and_drop("start", "end")
+                elapsed = time.monotonic() - started
+        self.assertLess(elapsed, 0.5)
+        self.assertIn("pyautogui.moveTo(100, 200)", command)
+        self.assertIn("pyautogui.dragTo(300, 400", command)
+        # Calls made in the worker threads are still collected
+        self.assertEqual(len(calls), 2)
+
+    def test_highlight_runs_ocr_once(self):
+        ocr_elements = [
+            {"text": "Lorem", "left": 10, "top": 20, "width": 30, "height": 10},
+            {"text": "ipsum", "left": 50, "top": 20, "width": 40, "height": 10},
+        ]
+        ocr_calls = []
+
+        def ocr_pass(screenshot):
+            ocr_calls.append(threading.get_ident())
+            return "Text Table:\n", ocr_elements
+
+        screenshot = os.urandom(64)
+        with mock.patch.object(self.aci, "_ocr_pass", ocr_pass), mock.patch.object(
+            self.aci.text_span_agent,
+            "get_response",
+            side_effect=lambda messages, **kwargs: (
+                "0" if "FIRST" in messages[1]["content"][0]["text"] else "1"
+            ),
+        ):
+            self.aci.assign_screenshot({"screenshot": screenshot})
+            command = self.aci.highlight_text_span("Hello", "world")
+            # Equal content in a new observation is read from the cache
+            self.aci.assign_screenshot({"screenshot": bytes(bytearray(screenshot))})
+            self.aci.highlight_text_span("Hello", "world")
+        self.assertEqual(len(ocr_calls), 1)
+        self.assertIn("pyautogui.moveTo(10, 25)", command)
+        self.assertIn("pyautogui.dragTo(90, 25", command)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from gui_agents.s3.utils.grounding_cache import GroundingCache
+
+
+def _screenshot(button_at=(900, 500), background=(240, 240, 240)):
+    image = Image.new("RGB", (1920, 1080), background)
+    draw = ImageDraw.Draw(image)
+    x, y = button_at
+    draw.rectangle((x - 40, y - 15, x + 40, y + 15), fill=(30, 90, 200))
+    draw.text((x - 10, y - 5), "Save", fill=(255, 255, 255))
+    output = BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+class TestGroundingCache(unittest.TestCase):
+    def test_hit_while_the_element_is_unchanged(self):
+        cache = GroundingCache((1000, 1000))
+        cache.put("the Save button", _screenshot(), [469, 463])
+        # Normalized descriptions share the entry, equal content in a new frame hits
+        self.assertEqual(cache.get("The  Save button.", _screenshot()), [469, 463])
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_miss_when_the_element_moved(self):
+        cache = GroundingCache((1000, 1000))
+        cache.put("the Save button", _screenshot(), [469, 463])
+        self.assertIsNone(cache.get("the Save button", _screenshot((900, 800))))
+        # The stale entry is gone
+        self.assertIsNone(cache.get("the Save button", _screenshot()))
+
+    def test_layout_change_drops_everything(self):
+        cache = GroundingCache((1000, 1000))
+        cache.put("the Save button", _screenshot(), [469, 463])
+        cache.get("the Save button", _screenshot(background=(20, 20, 20)))
+        self.assertIsNone(cache.get("the Save button", _screenshot()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from unittest import mock
+
+from gui_agents.s3.utils.action_compiler import ActionCompileError
+from gui_agents.s3.utils.common_utils import create_pyautogui_code
+from gui_agents.s3.utils.formatters import CODE_VALID_FORMATTER
+
+from helpers import make_aci
+
+
+class TestSinglePassGrounding(unittest.TestCase):
+    def setUp(self):
+        self.aci = make_aci()
+        patcher = mock.patch.object(
+            self.aci, "generate_coords", return_value=[100, 200]
+        )
+        self.generate_coords = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_validated_action_is_not_grounded_again(self):
+        obs = {"screenshot": b"frame"}
+        response = "```python\nagent.click('the OK button')\n```"
+        success, _ = CODE_VALID_FORMATTER(self.aci, obs, response)
+        self.assertTrue(success)
+        exec_code = create_pyautogui_code(self.aci, "agent.click('the OK button')", obs)
+        self.assertIn("pyautogui.click(100, 200", exec_code)
+        self.assertEqual(self.generate_coords.call_count, 1)
+
+        # A new observation is grounded afresh
+        create_pyautogui_code(
+            self.aci, "agent.click('the OK button')", {"screenshot": b"frame"}
+        )
+        self.assertEqual(self.generate_coords.call_count, 2)
+
+    def test_invalid_actions_raise(self):
+        obs = {"screenshot": b"frame"}
+        with self.assertRaises(ActionCompileError):
+            create_pyautogui_code(self.aci, "agent.click()", obs)
+        self.assertEqual(self.generate_coords.call_count, 0)
+
+    def test_grounding_failures_are_retried(self):
+        obs = {"screenshot": b"frame"}
+        self.generate_coords.side_effect = [ConnectionError("reset"), [100, 200]]
+        with self.assertRaises(ConnectionError):
+            create_pyautogui_code(self.aci, "agent.click('the OK button')", obs)
+        exec_code = create_pyautogui_code(self.aci, "agent.click('the OK button')", obs)
+        self.assertIn("pyautogui.click(100, 200", exec_code)
+        self.assertEqual(self.generate_coords.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,21 @@
+import unittest
+
+from gui_agents.s3.core.identity_memo import IdentityMemo
+
+
+class TestIdentityMemo(unittest.TestCase):
+    def test_hits_only_the_same_object_and_settings(self):
+        memo = IdentityMemo(max_entries=2)
+        source, equal = {"text": "a"}, {"text": "a"}
+        self.assertEqual(memo.get(source, lambda: 1), 1)
+        self.assertEqual(memo.get(source, lambda: 2), 1)
+        # An equal but distinct object, or other settings, is a miss
+        self.assertEqual(memo.get(equal, lambda: 3), 3)
+        self.assertEqual(memo.get(source, lambda: 4, "webp"), 4)
+        # Bounded, least recently used first
+        self.assertEqual(len(memo), 2)
+        self.assertEqual(memo.get(source, lambda: 5), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
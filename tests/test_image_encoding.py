@@ -0,0 +1,47 @@
+import base64
+import os
+import tempfile
+import unittest
+
+from gui_agents.s3.core.image_encoding import ImageEncodingCache
+
+
+class TestImageEncodingCache(unittest.TestCase):
+    def test_encodes_once_per_content(self):
+        cache = ImageEncodingCache()
+        screenshot = os.urandom(4096)
+        payload = cache.encode(screenshot)
+        self.assertEqual(payload, base64.b64encode(screenshot).decode("utf-8"))
+        self.assertIs(cache.encode(screenshot), payload)
+        # Equal bytes in another object hit through the content hash
+        self.assertIs(cache.encode(bytes(bytearray(screenshot))), payload)
+        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as f:
+            f.write(screenshot)
+        try:
+            self.assertIs(cache.encode(f.name), payload)
+        finally:
+            os.remove(f.name)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_data_urls_are_reused(self):
+        cache = ImageEncodingCache()
+        screenshot = os.urandom(1024)
+        url = cache.data_url(screenshot)
+        self.assertTrue(url.startswith("data:image/png;base64,"))
+        self.assertIs(cache.data_url(screenshot), url)
+        self.assertTrue(
+            cache.data_url(screenshot, media_type="image").startswith(
+                "data:image;base64,"
+            )
+        )
+
+    def test_memory_is_bounded(self):
+        cache = ImageEncodingCache(max_bytes=10_000)
+        for _ in range(10):
+            cache.encode(os.urandom(2048))
+        self.assertLessEqual(cache._size, 10_000)
+        self.assertLess(len(cache._entries), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
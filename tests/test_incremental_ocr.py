@@ -0,0 +1,106 @@
+import unittest
+
+from PIL import Image, ImageDraw
+
+from gui_agents.s3.utils.incremental_ocr import IncrementalOCR
+from gui_agents.s3.utils.phrase_matcher import match_phrase
+
+from helpers import make_aci, read_rectangles
+
+
+def _frame(words):
+    """A white screen with each word drawn as a rectangle of its own gray level."""
+    image = Image.new("L", (1280, 720), 255)
+    draw = ImageDraw.Draw(image)
+    for level, (left, top, right, bottom) in words.items():
+        draw.rectangle((left, top, right - 1, bottom - 1), fill=level)
+    return image
+
+
+class _FakeOCR:
+    """read_rectangles, recording the size of each image read."""
+
+    def __init__(self):
+        self.reads = []
+
+    def __call__(self, image):
+        self.reads.append(image.size)
+        return read_rectangles(image)
+
+
+def _boxes(words):
+    return sorted(
+        (w["text"], w["left"], w["top"], w["width"], w["height"]) for w in words
+    )
+
+
+class TestIncrementalOCR(unittest.TestCase):
+    def test_only_changed_regions_are_read(self):
+        scene = {
+            10: (100, 100, 220, 120),
+            20: (600, 100, 700, 120),
+            30: (100, 500, 300, 520),
+        }
+        ocr = _FakeOCR()
+        incremental = IncrementalOCR(ocr)
+        first = incremental(_frame(scene))
+        self.assertEqual(_boxes(first), _boxes(ocr(_frame(scene))))
+
+        # One word is replaced, another one is added across a tile boundary
+        scene[40] = scene.pop(20)
+        scene[50] = (120, 250, 200, 270)
+        ocr.reads.clear()
+        words = incremental(_frame(scene))
+        self.assertEqual(_boxes(words), _boxes(_FakeOCR()(_frame(scene))))
+        self.assertTrue(ocr.reads)
+        self.assertTrue(all(w * h < 1280 * 720 / 4 for w, h in ocr.reads))
+        # The merged words are in reading order
+        self.assertEqual([w["text"] for w in words], ["w10", "w40", "w50", "w30"])
+
+        ocr.reads.clear()
+        self.assertEqual(_boxes(incremental(_frame(scene))), _boxes(words))
+        self.assertEqual(ocr.reads, [])
+
+    def test_word_growing_past_the_region_is_read_whole(self):
+        ocr = _FakeOCR()
+        incremental = IncrementalOCR(ocr)
+        incremental(_frame({10: (100, 100, 600, 120)}))
+        # Only the end of a long word changes, the whole word must be read again
+        words = incremental(
+            _frame({10: (100, 100, 560, 120), 20: (560, 100, 640, 120)})
+        )
+        self.assertEqual(
+            _boxes(words),
+            [("w10", 100, 100, 460, 20), ("w20", 560, 100, 80, 20)],
+        )
+
+    def test_change_inside_a_paragraph_keeps_reading_order(self):
+        # Three lines of four words, levels increasing in reading order
+        scene = {}
+        for index in range(12):
+            line, column = divmod(index, 4)
+            left, top = 100 + 120 * column, 100 + 40 * line
+            scene[10 + 20 * index] = (left, top, left + 100, top + 20)
+        ocr = _FakeOCR()
+        incremental = IncrementalOCR(ocr)
+        incremental(_frame(scene))
+        # The third word of the second line is retyped
+        scene[140] = scene.pop(130)
+        words = incremental(_frame(scene))
+        texts = [w["text"] for w in words]
+        self.assertEqual(texts, [w["text"] for w in _FakeOCR()(_frame(scene))])
+        self.assertEqual(texts[5:8], ["w110", "w140", "w150"])
+        self.assertEqual({w["block_num"] for w in words}, {1})
+
+        # A phrase crossing the region's edge is still found in order
+        elements = [{**w, "id": i} for i, w in enumerate(words)]
+        self.assertEqual(match_phrase("w110 w140 w150 w170", elements, "end"), 8)
+
+    def test_grounding_agent_opts_in(self):
+        self.assertIsNone(make_aci().incremental_ocr)
+        aci = make_aci(incremental_ocr=True)
+        self.assertIsInstance(aci.incremental_ocr, IncrementalOCR)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+from unittest import mock
+
+from gui_agents.s3.utils.label_resolver import LabelResolver, extract_labels
+
+from helpers import make_aci
+
+
+def word(text, left, top, width=40, height=12):
+    return {"text": text, "left": left, "top": top, "width": width, "height": height}
+
+
+OCR_ELEMENTS = [
+    word("File", 10, 5),
+    word("Edit", 60, 5),
+    word("Format", 110, 5, width=50),
+    word("Cells...", 166, 5, width=50),
+    word("Cancel", 300, 400, width=50),
+    word("OK", 400, 400, width=20),
+    word("Format", 10, 600, width=50),
+    word("painter", 10, 640, width=50),
+]
+
+
+class TestExtractLabels(unittest.TestCase):
+    def test_quoted_labels_take_precedence(self):
+        self.assertEqual(
+            extract_labels("the user's 'OK' button in the Save dialog"), ["OK"]
+        )
+        self.assertEqual(
+            extract_labels("menu item “Format Cells...”"), ["Format Cells..."]
+        )
+
+    def test_unquoted_descriptions_have_no_label_by_default(self):
+        self.assertEqual(extract_labels("The Save button"), [])
+        self.assertEqual(extract_labels("Click Chrome's Settings menu"), [])
+        self.assertEqual(extract_labels("the checkbox next to Remember me"), [])
+
+    def test_capitalized_fallback(self):
+        self.assertEqual(extract_labels("The Save button", capitalized=True), ["Save"])
+        self.assertEqual(
+            extract_labels("Chrome icon on the Desktop", capitalized=True), []
+        )
+        self.assertEqual(extract_labels("blue folder icon", capitalized=True), [])
+
+    def test_capitalized_fallback_skips_possessives(self):
+        self.assertEqual(extract_labels("Chrome's settings menu", capitalized=True), [])
+        self.assertEqual(
+            extract_labels("Click Chrome's Settings menu", capitalized=True), []
+        )
+
+
+class TestLabelResolver(unittest.TestCase):
+    def test_unique_multi_word_label(self):
+        resolver = LabelResolver()
+        box = resolver.resolve("the 'Format Cells...' menu item", OCR_ELEMENTS)
+        self.assertEqual(box, (110, 5, 216, 17))
+        self.assertEqual((resolver.hits, resolver.lookups), (1, 1))
+
+    def test_words_on_other_lines_do_not_continue_a_label(self):
+        self.assertIsNone(LabelResolver().resolve("'Format painter'", OCR_ELEMENTS))
+
+    def test_ambiguous_or_missing_label_misses(self):
+        resolver = LabelResolver()
+        self.assertIsNone(resolver.resolve("the 'Format' button", OCR_ELEMENTS))
+        self.assertIsNone(resolver.resolve("the 'Apply' button", OCR_ELEMENTS))
+        self.assertEqual((resolver.hits, resolver.lookups), (0, 2))
+
+    def test_unquoted_label_is_not_resolved_by_default(self):
+        elements = OCR_ELEMENTS + [word("Chrome", 500, 500), word("Settings", 500, 700)]
+        self.assertIsNone(LabelResolver().resolve("Cancel button", elements))
+        self.assertIsNone(LabelResolver().resolve("Chrome's Settings menu", elements))
+        self.assertEqual(
+            LabelResolver(capitalized_labels=True).resolve("Cancel button", elements),
+            (300, 400, 350, 412),
+        )
+
+    def test_audit_counts_disagreements(self):
+        resolver = LabelResolver()
+        resolver.record_audit((400, 400, 420, 412), [405, 410])
+        resolver.record_audit((400, 400, 420, 412), [900, 100])
+        self.assertEqual((resolver.disagreements, resolver.audits), (1, 2))
+
+
+class TestLabelGrounding(unittest.TestCase):
+    def make_aci(self, **params):
+        aci = make_aci(
+            grounding_width=960, grounding_height=540, label_resolver=True, **params
+        )
+        aci.get_ocr_elements = mock.Mock(return_value=("", OCR_ELEMENTS))
+        aci._grounding_messages = mock.Mock(return_value=[])
+        return aci
+
+    def test_unique_label_skips_the_grounding_model(self):
+        aci = self.make_aci()
+        obs = {"screenshot": b"frame"}
+        with mock.patch(
+            "gui_agents.s3.agents.grounding.call_llm_safe"
+        ) as call_llm_safe:
+            coords = aci.generate_coords("the 'OK' button", obs)
+        call_llm_safe.assert_not_called()
+        # Center (410, 406) of the label in screen pixels, in grounding space
+        self.assertEqual(coords, [205, 203])
+        self.assertEqual(aci.resize_coordinates(coords), [410, 406])
+
+    def test_falls_back_to_the_grounding_model(self):
+        aci = self.make_aci()
+        obs = {"screenshot": b"frame"}
+        with mock.patch(
+            "gui_agents.s3.agents.grounding.call_llm_safe", return_value="(30, 40)"
+        ):
+            self.assertEqual(aci.generate_coords("the 'Apply' button", obs), [30, 40])
+            # No label named, no OCR
+            self.assertEqual(aci.generate_coords("the Cancel button", obs), [30, 40])
+        self.assertEqual(aci.get_ocr_elements.call_count, 1)
+
+    def test_audited_hit_uses_and_compares_the_model(self):
+        aci = self.make_aci(label_audit_rate=1.0)
+        obs = {"screenshot": b"frame"}
+        with mock.patch(
+            "gui_agents.s3.agents.grounding.call_llm_safe", return_value="(450, 50)"
+        ):
+            coords = aci.generate_coords("the 'OK' button", obs)
+        self.assertEqual(coords, [450, 50])
+        self.assertEqual(aci.label_resolver.disagreements, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
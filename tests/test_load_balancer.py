@@ -0,0 +1,88 @@
+import asyncio
+import time
+import unittest
+
+from gui_agents.s3.core.load_balancer import LoadBalancedEngine
+from gui_agents.s3.core.mllm import LMMAgent
+
+
+class FakeEngine:
+    def __init__(self, name, delay):
+        self.base_url = name
+        self.delay = delay
+
+    def generate(self, messages, **kwargs):
+        time.sleep(self.delay)
+        return self.base_url
+
+    async def agenerate(self, messages, **kwargs):
+        await asyncio.sleep(self.delay)
+        return self.base_url
+
+
+class TestLoadBalancedEngine(unittest.TestCase):
+    def test_routes_to_least_outstanding_replica(self):
+        engine = LoadBalancedEngine([FakeEngine("a", 0), FakeEngine("b", 0)])
+        engine.replicas[0].outstanding = 1
+        self.assertEqual({engine.generate([]) for _ in range(4)}, {"b"})
+        self.assertEqual(engine.stats()["b"]["samples"], 4)
+
+    def test_sequential_calls_are_spread_over_replicas(self):
+        engine = LoadBalancedEngine(
+            [FakeEngine("a", 0), FakeEngine("b", 0), FakeEngine("c", 0)]
+        )
+        engine.replicas[0].latencies.extend([0.1] * 30)
+        engine.replicas[1].latencies.extend([0.2] * 30)
+        engine.replicas[2].latencies.extend([0.3] * 30)
+        counts = {"a": 0, "b": 0, "c": 0}
+        for _ in range(300):
+            counts[engine._pick().engine.base_url] += 1
+        # Every replica gets a share, the fastest the largest one
+        self.assertGreater(min(counts.values()), 30)
+        self.assertEqual(max(counts, key=counts.get), "a")
+
+    def test_tripped_replicas_are_avoided(self):
+        engine = LoadBalancedEngine([FakeEngine("a", 0), FakeEngine("b", 0)])
+        breaker = type("Breaker", (), {"is_open": lambda self: True})()
+        engine.replicas[0].engine.circuit_breaker = lambda: breaker
+        self.assertEqual({engine.generate([]) for _ in range(10)}, {"b"})
+
+    def test_hedges_slow_calls_on_another_replica(self):
+        engine = LoadBalancedEngine(
+            [FakeEngine("slow", 2.0), FakeEngine("fast", 0)], hedge=True
+        )
+        for replica in engine.replicas:
+            replica.latencies.extend([0.05] * 30)
+        for _ in range(2):
+            started = time.time()
+            self.assertEqual(engine.generate([]), "fast")
+            self.assertLess(time.time() - started, 1.0)
+
+        async def agenerate():
+            return await engine.agenerate([])
+
+        started = time.time()
+        self.assertEqual(asyncio.run(agenerate()), "fast")
+        self.assertLess(time.time() - started, 1.0)
+
+    def test_agent_builds_balancer_from_url_list(self):
+        agent = LMMAgent(
+            engine_params={
+                "engine_type": "vllm",
+                "model": "ui-tars",
+                "api_key": "x",
+                "base_url": ["http://gpu-0:8000/v1", "http://gpu-1:8000/v1"],
+            }
+        )
+        self.assertIsInstance(agent.engine, LoadBalancedEngine)
+        self.assertEqual(agent.engine.model, "ui-tars")
+        self.assertEqual(
+            [replica.name for replica in agent.engine.replicas],
+            ["http://gpu-0:8000/v1", "http://gpu-1:8000/v1"],
+        )
+        agent.add_message("Click OK")
+        self.assertEqual(agent.messages[-1]["role"], "user")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw
+
+from gui_agents.s3.utils.ocr import ParallelOCR
+
+from helpers import read_rectangles
+
+
+def _screen():
+    image = Image.new("L", (2560, 1440), 255)
+    draw = ImageDraw.Draw(image)
+    # A line of words every 30 pixels, some straddling the band boundaries
+    for i, top in enumerate(range(10, 1430, 30)):
+        draw.rectangle((100 + i * 40, top, 180 + i * 40, top + 17), fill=i)
+    return image
+
+
+def _boxes(words):
+    return sorted((w["text"], w["left"], w["top"], w["width"]) for w in words)
+
+
+class TestParallelOCR(unittest.TestCase):
+    def test_bands_match_the_serial_read(self):
+        screen = _screen()
+        with ThreadPoolExecutor(4) as executor:
+            ocr = ParallelOCR(workers=4, executor=executor, read=read_rectangles)
+            words = ocr(screen)
+        self.assertEqual(_boxes(words), _boxes(read_rectangles(screen)))
+        # Each band's blocks get their own group numbers
+        self.assertEqual(len({w["block_num"] for w in words}), 4)
+
+    def test_process_pool(self):
+        ocr = ParallelOCR(workers=2, read=read_rectangles)
+        screen = _screen()
+        self.assertEqual(_boxes(ocr(screen)), _boxes(read_rectangles(screen)))
+
+    def test_small_images_are_read_serially(self):
+        ocr = ParallelOCR(workers=4, executor=object(), read=read_rectangles)
+        self.assertEqual(ocr(Image.new("L", (640, 300), 255)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from gui_agents.s3.utils.phrase_matcher import match_phrase
+
+
+def _elements(text):
+    return [{"text": word} for word in text.split()]
+
+
+class TestPhraseMatcher(unittest.TestCase):
+    def setUp(self):
+        self.elements = _elements(
+            "Quarterly report. The revenue grew by 12% in Q3, "
+            "while the operating costs stayed flat. See the appendix"
+        )
+
+    def test_aligns_on_the_first_and_last_word(self):
+        self.assertEqual(
+            match_phrase("the revenue grew", self.elements, alignment="start"), 2
+        )
+        self.assertEqual(
+            match_phrase("the revenue grew", self.elements, alignment="end"), 4
+        )
+        self.assertEqual(match_phrase("appendix", self.elements), 17)
+
+    def test_tolerates_case_punctuation_and_misreadings(self):
+        # "operatinq" and "c0sts" are typical OCR slips
+        elements = _elements("while the operatinq c0sts stayed flat.")
+        self.assertEqual(
+            match_phrase("Operating costs stayed flat", elements, alignment="end"), 5
+        )
+
+    def test_falls_back_when_unsure(self):
+        # "the" occurs several times
+        self.assertIsNone(match_phrase("the", self.elements))
+        self.assertIsNone(match_phrase("net income", self.elements))
+        self.assertIsNone(match_phrase("...", self.elements))
+
+
+if __name__ == "__main__":
+    unittest.main()
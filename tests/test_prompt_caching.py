@@ -0,0 +1,75 @@
+import unittest
+
+from gui_agents.s3.core.engine import LMMEngineAnthropic
+
+
+def text(role, value):
+    return {"role": role, "content": [{"type": "text", "text": value}]}
+
+
+def with_image(role, value):
+    message = text(role, value)
+    message["content"].append(
+        {
+            "type": "image",
+            "source": {"type": "base64", "media_type": "image/png", "data": "AA=="},
+        }
+    )
+    return message
+
+
+class TestAnthropicPromptCaching(unittest.TestCase):
+    def setUp(self):
+        self.engine = LMMEngineAnthropic(model="claude-sonnet-4-5", api_key="x")
+        # Older turns already had their screenshots flushed
+        self.messages = [
+            text("system", "You are a GUI agent."),
+            text("user", "step 1"),
+            text("assistant", "plan 1"),
+            with_image("user", "step 2"),
+            text("assistant", "plan 2"),
+            with_image("user", "step 3"),
+        ]
+
+    def test_breakpoints_on_system_and_stable_prefix(self):
+        params = self.engine._request_params(self.messages)
+        self.assertEqual(params["system"][0]["cache_control"], {"type": "ephemeral"})
+        turns = params["messages"]
+        self.assertEqual(
+            turns[1]["content"][-1]["cache_control"], {"type": "ephemeral"}
+        )
+        marked = [
+            i
+            for i, turn in enumerate(turns)
+            if any("cache_control" in item for item in turn["content"])
+        ]
+        # The frozen text-only prefix, and the history sent with the previous request
+        self.assertEqual(marked, [1, 3])
+        # The agent history itself is left untouched
+        self.assertNotIn("cache_control", self.messages[2]["content"][-1])
+
+    def test_breakpoint_while_every_turn_still_has_its_image(self):
+        messages = [
+            text("system", "You are a GUI agent."),
+            with_image("user", "step 1"),
+            text("assistant", "plan 1"),
+            with_image("user", "step 2"),
+        ]
+        turns = self.engine._request_params(messages)["messages"]
+        self.assertEqual(
+            turns[1]["content"][-1]["cache_control"], {"type": "ephemeral"}
+        )
+        self.assertNotIn("cache_control", turns[0]["content"][-1])
+        self.assertNotIn("cache_control", turns[2]["content"][-1])
+
+    def test_prompt_caching_can_be_disabled(self):
+        engine = LMMEngineAnthropic(
+            model="claude-sonnet-4-5", api_key="x", prompt_caching=False
+        )
+        params = engine._request_params(self.messages)
+        self.assertEqual(params["system"], "You are a GUI agent.")
+        self.assertIs(params["messages"][1], self.messages[2])
+
+
+if __name__ == "__main__":
+    unittest.main()
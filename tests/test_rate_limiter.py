@@ -0,0 +1,68 @@
+import tempfile
+import unittest
+
+from gui_agents.s3.core.rate_limiter import RateLimiter, estimate_tokens
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+
+    def test_disabled_limiter_never_waits(self):
+        limiter = RateLimiter(("openai", "default", "gpt-4o"), state_dir=self.state_dir)
+        self.assertFalse(limiter.enabled)
+        self.assertEqual(limiter.acquire(tokens=10**9), 0.0)
+
+    def test_request_budget_is_shared_between_instances(self):
+        """Two limiters with the same key draw from one bucket, as separate processes would"""
+        key = ("vllm", "http://localhost:8000/v1", "ui-tars")
+        first = RateLimiter(
+            key, requests_per_minute=2, headroom=1.0, state_dir=self.state_dir
+        )
+        second = RateLimiter(
+            key, requests_per_minute=2, headroom=1.0, state_dir=self.state_dir
+        )
+        self.assertEqual(first._try_acquire(0), 0.0)
+        self.assertEqual(second._try_acquire(0), 0.0)
+        # Bucket is empty, the next request must wait roughly 30s for one refill
+        wait = first._try_acquire(0)
+        self.assertGreater(wait, 29.0)
+        self.assertLessEqual(wait, 30.0)
+
+    def test_token_budget_and_adjust(self):
+        limiter = RateLimiter(
+            ("openai", "default", "gpt-4o"),
+            tokens_per_minute=1000,
+            headroom=1.0,
+            state_dir=self.state_dir,
+        )
+        self.assertEqual(limiter._try_acquire(600), 0.0)
+        # Request used 300 more tokens than estimated
+        limiter.adjust(300)
+        self.assertGreater(limiter._try_acquire(200), 0.0)
+
+    def test_oversized_request_is_clamped_to_bucket(self):
+        limiter = RateLimiter(
+            ("openai", "default", "gpt-4o"),
+            tokens_per_minute=100,
+            headroom=1.0,
+            state_dir=self.state_dir,
+        )
+        self.assertEqual(limiter._try_acquire(10_000), 0.0)
+
+    def test_estimate_tokens(self):
+        messages = [
+            {"role": "system", "content": [{"type": "text", "text": "a" * 400}]},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "b" * 40},
+                    {"type": "image_url", "image_url": {"url": "data:..."}},
+                ],
+            },
+        ]
+        self.assertEqual(estimate_tokens(messages), 110 + 1500)
+
+
+if __name__ == "__main__":
+    unittest.main()
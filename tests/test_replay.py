@@ -0,0 +1,79 @@
+import io
+import unittest
+
+from PIL import Image
+
+from gui_agents.s3.agents.agent_s import AgentS3
+from gui_agents.s3.agents.grounding import OSWorldACI
+from gui_agents.s3.core.engine import LMMEngineOpenAI
+from gui_agents.s3.core.replay import LatencyModel, ReplayScript
+from gui_agents.s3.utils.common_utils import action_block_complete
+from gui_agents.s3.utils.stub_server import serve_stub
+
+PLAN = "(Next Action)\nClick OK.\n\n(Grounded Action)\n```python\nagent.click('The OK button', 1, 'left')\n```"
+
+
+def screenshot():
+    buffer = io.BytesIO()
+    Image.new("RGB", (1920, 1080), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class TestReplay(unittest.TestCase):
+    def test_latency_model(self):
+        self.assertEqual(LatencyModel().sample(), 0.0)
+        self.assertEqual(LatencyModel(0.25).sample(), 0.25)
+        sample = LatencyModel(
+            {"distribution": "uniform", "low": 0.1, "high": 0.2}, seed=0
+        ).sample()
+        self.assertTrue(0.1 <= sample <= 0.2)
+
+    def test_script_cycles_and_falls_back_to_default(self):
+        script = ReplayScript({"generator": ["a", "b"], "default": ["d"]})
+        self.assertEqual(
+            [script.next_response("generator") for _ in range(3)], ["a", "b", "a"]
+        )
+        self.assertEqual(script.next_response("reflection"), "d")
+        with self.assertRaises(KeyError):
+            ReplayScript().next_response("grounding")
+
+    def test_agent_predict_runs_offline(self):
+        engine_params = {
+            "engine_type": "replay",
+            "responses": {"generator": [PLAN], "reflection": ["Going well."]},
+        }
+        grounding_params = {
+            "engine_type": "replay",
+            "grounding_width": 1920,
+            "grounding_height": 1080,
+        }
+        grounding_agent = OSWorldACI(
+            env=None,
+            platform="linux",
+            engine_params_for_generation=engine_params,
+            engine_params_for_grounding=grounding_params,
+        )
+        agent = AgentS3(engine_params, grounding_agent, platform="linux")
+        for _ in range(2):
+            info, actions = agent.predict("Click OK", {"screenshot": screenshot()})
+            self.assertIn("pyautogui.click(960, 540", actions[0])
+        self.assertEqual(info["llm_usage"]["reflection"]["calls"], 1)
+
+    def test_stub_server_speaks_openai(self):
+        server = serve_stub(ReplayScript({"planner": [PLAN + "\nDone."]}))
+        self.addCleanup(server.shutdown)
+        engine = LMMEngineOpenAI(
+            model="planner",
+            base_url=f"http://127.0.0.1:{server.server_address[1]}/v1",
+            api_key="stub",
+        )
+        messages = [{"role": "user", "content": [{"type": "text", "text": "Go"}]}]
+        self.assertEqual(engine.generate(messages), PLAN + "\nDone.")
+        self.assertEqual(
+            engine.generate(messages, stop_when=action_block_complete)[: len(PLAN)],
+            PLAN,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import base64
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from gui_agents.s3.core.engine import LMMEngineOpenAI
+from gui_agents.s3.core.mllm import LMMAgent
+from gui_agents.s3.core.response_cache import ResponseCache, make_cache_key
+
+
+def image_message(data: bytes, detail: str = "high"):
+    return {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": "What is on screen?"},
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/png;base64,{base64.b64encode(data).decode()}",
+                    "detail": detail,
+                },
+            },
+        ],
+    }
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def test_key_hashes_images_by_content(self):
+        first = make_cache_key("gpt-4o", [image_message(b"png")], 0.0)
+        self.assertEqual(first, make_cache_key("gpt-4o", [image_message(b"png")], 0.0))
+        self.assertNotEqual(
+            first, make_cache_key("gpt-4o", [image_message(b"jpg")], 0.0)
+        )
+        self.assertNotEqual(
+            first, make_cache_key("gpt-4o", [image_message(b"png")], 1.0)
+        )
+
+    def test_modes(self):
+        ResponseCache(self.cache_dir).put("key", "stored")
+        read_only = ResponseCache(self.cache_dir, mode="read_only")
+        self.assertEqual(read_only.get("key"), "stored")
+        read_only.put("other", "ignored")
+        self.assertIsNone(read_only.get("other"))
+        record = ResponseCache(self.cache_dir, mode="record")
+        self.assertIsNone(record.get("key"))
+        record.put("key", "rerecorded")
+        self.assertEqual(read_only.get("key"), "rerecorded")
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(self.cache_dir, max_size_mb=100 / (1024 * 1024))
+        cache.put("old", "a" * 40)
+        cache.put("recent", "b" * 40)
+        cache.get("old")
+        cache.put("new", "c" * 40)
+        self.assertEqual(cache.get("old"), "a" * 40)
+        self.assertIsNone(cache.get("recent"))
+        self.assertEqual(cache.get("new"), "c" * 40)
+
+    def test_size_is_tracked_across_replacements_and_processes(self):
+        cache = ResponseCache(self.cache_dir)
+        cache.put("a", "x" * 10)
+        cache.put("b", "y" * 20)
+        cache.put("a", "z" * 5)
+        self.assertEqual(cache.size(), len('"zzzzz"') + len('"' + "y" * 20 + '"'))
+        # Another process opening the file sees the same total
+        self.assertEqual(ResponseCache(self.cache_dir).size(), cache.size())
+
+    def test_agent_serves_repeated_requests_from_cache(self):
+        engine_params = {
+            "engine_type": "openai",
+            "model": "gpt-4o",
+            "api_key": "sk-test",
+            "cache_dir": self.cache_dir,
+        }
+        agent = LMMAgent(engine_params=engine_params)
+        agent.engine.generate = MagicMock(return_value="click")
+        agent.add_message("Open the menu")
+        self.assertEqual(agent.get_response(), "click")
+        self.assertEqual(agent.get_response(), "click")
+        agent.engine.generate.assert_called_once()
+        self.assertIsInstance(agent.engine, LMMEngineOpenAI)
+
+    def test_sampled_calls_are_cached_only_on_opt_in(self):
+        engine_params = {
+            "engine_type": "openai",
+            "model": "gpt-4o",
+            "api_key": "sk-test",
+            "cache_dir": self.cache_dir,
+        }
+        for cache_sampled, calls in ((False, 2), (True, 1)):
+            agent = LMMAgent(
+                engine_params={**engine_params, "cache_sampled": cache_sampled}
+            )
+            agent.engine.generate = MagicMock(return_value="click")
+            agent.add_message(f"Open the menu {cache_sampled}")
+            agent.get_response(temperature=0.7)
+            agent.get_response(temperature=0.7)
+            self.assertEqual(agent.engine.generate.call_count, calls)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import asyncio
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import httpx
+import openai
+
+from gui_agents.s3.core import retry
+from gui_agents.s3.core.engine import LMMEngineOpenAI
+from gui_agents.s3.core.retry import (
+    CircuitBreaker,
+    CircuitOpenError,
+    retry_after,
+    with_retries,
+)
+from gui_agents.s3.core.telemetry import collect_llm_calls, track_llm_call
+from gui_agents.s3.utils.formatters import _attempt_code_creation
+
+
+def status_error(status, headers=None):
+    request = httpx.Request("POST", "http://endpoint/v1/chat/completions")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return openai.APIStatusError("failed", response=response, body=None)
+
+
+class FlakyEngine:
+    def __init__(self, errors, breaker=None):
+        self.errors = list(errors)
+        self.calls = 0
+        self.breaker = breaker or CircuitBreaker("flaky", 3, 60.0)
+
+    def circuit_breaker(self):
+        return self.breaker
+
+    @with_retries
+    def generate(self, messages):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+    @with_retries
+    async def agenerate(self, messages):
+        return self.generate.__wrapped__(self, messages)
+
+
+class TestRetry(unittest.TestCase):
+    def setUp(self):
+        self.settings = dict(retry._retry_settings)
+        retry.configure_retries(base_delay=0.01, max_delay=0.01, deadline=5.0)
+
+    def tearDown(self):
+        retry._retry_settings.update(self.settings)
+
+    def test_retries_transient_errors_and_counts_them(self):
+        engine = FlakyEngine([status_error(503), status_error(429)])
+        with collect_llm_calls() as calls:
+            with track_llm_call("generator", "model"):
+                self.assertEqual(engine.generate([]), "ok")
+        self.assertEqual(engine.calls, 3)
+        self.assertEqual(calls[0]["retries"], 2)
+
+    def test_client_errors_are_not_retried(self):
+        engine = FlakyEngine([status_error(400)])
+        with self.assertRaises(openai.APIStatusError):
+            engine.generate([])
+        self.assertEqual(engine.calls, 1)
+
+    def test_retry_after_header_and_deadline(self):
+        self.assertEqual(retry_after(status_error(429, {"retry-after": "7"})), 7.0)
+        self.assertEqual(
+            retry_after(status_error(429, {"retry-after-ms": "250"})), 0.25
+        )
+        # Waiting the requested minute would overrun the deadline, so the error surfaces now
+        engine = FlakyEngine([status_error(429, {"retry-after": "60"})])
+        started = time.time()
+        with self.assertRaises(openai.APIStatusError):
+            engine.generate([])
+        self.assertLess(time.time() - started, 1.0)
+
+    def test_breaker_opens_fails_fast_and_recovers(self):
+        retry.configure_retries(max_attempts=1)
+        engine = FlakyEngine([status_error(500)] * 3)
+        for _ in range(3):
+            with self.assertRaises(openai.APIStatusError):
+                engine.generate([])
+        with self.assertRaises(CircuitOpenError):
+            engine.generate([])
+        self.assertEqual(engine.calls, 3)
+
+        engine.breaker.reset_timeout = 0.0
+        self.assertEqual(asyncio.run(engine.agenerate([])), "ok")
+        self.assertEqual(engine.breaker.state, "closed")
+
+    def test_request_timeout_is_a_separate_setting(self):
+        engine = LMMEngineOpenAI(model="gpt-4o", api_key="sk-test")
+        engine.llm_client = MagicMock()
+        messages = [{"role": "user", "content": "Click OK"}]
+
+        def sent_params():
+            stream = MagicMock()
+            stream.__iter__.return_value = iter(
+                [SimpleNamespace(choices=[], usage=None)]
+            )
+            engine.llm_client.chat.completions.create.return_value = stream
+            engine.generate(messages, stop_when=lambda text: False)
+            return engine.llm_client.chat.completions.create.call_args.kwargs
+
+        # The retry deadline does not shorten an attempt, the client's timeout applies
+        self.assertNotIn("timeout", sent_params())
+        retry.configure_retries(request_timeout=900.0)
+        self.assertEqual(sent_params()["timeout"], 900.0)
+
+    def test_grounding_backend_failures_are_not_malformed_actions(self):
+        with patch(
+            "gui_agents.s3.utils.formatters.create_pyautogui_code",
+            side_effect=CircuitOpenError("grounding", 10.0),
+        ):
+            with self.assertRaises(CircuitOpenError):
+                _attempt_code_creation(None, "agent.click('OK')", {})
+        with patch(
+            "gui_agents.s3.utils.formatters.create_pyautogui_code",
+            side_effect=ValueError("no such action"),
+        ):
+            self.assertIsNone(_attempt_code_creation(None, "agent.fly()", {}))
+
+
+if __name__ == "__main__":
+    unittest.main()
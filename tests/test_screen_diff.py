@@ -0,0 +1,42 @@
+import unittest
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from gui_agents.s3.utils.screen_diff import ScreenChangeDetector, thumbnail_size
+
+
+def _screenshot(draw=None):
+    image = Image.new("RGB", (1920, 1080), (240, 240, 240))
+    if draw:
+        draw(ImageDraw.Draw(image))
+    output = BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+class TestScreenChangeDetector(unittest.TestCase):
+    def test_repeated_frames_match_the_reference(self):
+        detector = ScreenChangeDetector()
+        self.assertIsNone(detector.observe(_screenshot(), 0))
+        self.assertEqual(detector.observe(_screenshot(), 1), 0)
+        # A stray pixel is not a change
+        speck = _screenshot(lambda d: d.point((400, 300), fill=(0, 0, 0)))
+        self.assertEqual(detector.observe(speck, 2), 0)
+        # Refreshed once the reference is too old
+        self.assertIsNone(detector.observe(_screenshot(), 3, max_age=3))
+        self.assertEqual(detector.observe(_screenshot(), 4, max_age=3), 3)
+
+    def test_small_changes_are_detected(self):
+        detector = ScreenChangeDetector()
+        detector.observe(_screenshot(), 0)
+        typed = _screenshot(lambda d: d.text((400, 300), "l", fill=(0, 0, 0)))
+        self.assertIsNone(detector.observe(typed, 1))
+        self.assertIs(detector.reference, typed)
+
+    def test_thumbnail_keeps_the_aspect_ratio(self):
+        self.assertEqual(thumbnail_size(_screenshot()), (480, 270))
+
+
+if __name__ == "__main__":
+    unittest.main()
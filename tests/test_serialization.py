@@ -0,0 +1,159 @@
+import json
+import unittest
+from unittest import mock
+
+from anthropic import Anthropic
+
+from gui_agents.s3.core.mllm import LMMAgent
+from gui_agents.s3.core.replay import ReplayScript
+from gui_agents.s3.core.trajectory import TrajectoryStore
+from gui_agents.s3.core.serialization import RequestSerializer, dumps
+from gui_agents.s3.utils.common_utils import action_block_complete
+from gui_agents.s3.utils.stub_server import StubHandler, serve_stub
+
+PLAN = "Click OK.\n```python\nagent.click('The OK button')\n```"
+
+
+def turn(role, text):
+    return {"role": role, "content": [{"type": "text", "text": text}]}
+
+
+class TestRequestSerializer(unittest.TestCase):
+    def test_reuses_prefix_bytes(self):
+        serializer = RequestSerializer()
+        history = [turn("system", "sys"), turn("user", "step 1")]
+        first = serializer.serialize({"model": "m", "messages": history})
+        self.assertEqual(json.loads(first), {"model": "m", "messages": history})
+        history.append(turn("assistant", "plan 1"))
+        history.append(turn("user", "step 2"))
+        second = serializer.serialize(
+            {"model": "m", "messages": history, "extra_body": {"top_p": 0.9}}
+        )
+        self.assertEqual(
+            json.loads(second), {"model": "m", "top_p": 0.9, "messages": history}
+        )
+        # The previous messages are copied, byte-identical, rather than re-encoded
+        prefix = b",".join(dumps(m) for m in history[:2])
+        self.assertIn(b'"messages":[' + prefix + b",", second)
+        reused, serialized = serializer.stats()
+        self.assertEqual(reused, len(prefix))
+        self.assertEqual(serialized, sum(len(dumps(m)) for m in history))
+
+    def test_retained_images_are_not_reencoded(self):
+        serializer = RequestSerializer()
+        system = turn("system", "sys")
+        turns = []
+        for step in range(4):
+            message = turn("user", "step %d" % step)
+            message["content"].append(
+                {
+                    "type": "image_url",
+                    "image_url": {"url": "data:%d" % step + "A" * 1000},
+                }
+            )
+            turns.append(message)
+        store = TrajectoryStore(max_images=2)
+        store.reset(system)
+        for message in turns[:3]:
+            store.append(message)
+        serializer.serialize({"model": "m", "messages": store.render()})
+        # The window slides: the oldest imaged turn loses its image, the newer keep theirs
+        store.append(turns[3])
+        window = store.render()
+        with mock.patch(
+            "gui_agents.s3.core.serialization.dumps", wraps=dumps
+        ) as encode:
+            body = serializer.serialize({"model": "m", "messages": window})
+        self.assertEqual(json.loads(body), {"model": "m", "messages": window})
+        encoded = [call.args[0] for call in encode.call_args_list]
+        self.assertIn(turns[3]["content"][1], encoded)
+        for message in turns[1:3]:
+            self.assertNotIn(message, encoded)
+            self.assertNotIn(message["content"][1], encoded)
+
+    def test_agent_sends_serialized_bodies(self):
+        server = serve_stub(ReplayScript({"default": [PLAN]}))
+        try:
+            agent = LMMAgent(
+                {
+                    "engine_type": "openai",
+                    "model": "stub",
+                    "api_key": "x",
+                    "base_url": "http://127.0.0.1:%d/v1" % server.server_address[1],
+                    "incremental_serialization": True,
+                }
+            )
+            agent.add_message("Click OK", role="user")
+            self.assertEqual(agent.get_response(), PLAN)
+            agent.add_message(PLAN, role="assistant")
+            agent.add_message("Again", role="user")
+            agent.early_stop = True
+            self.assertEqual(agent.get_response(stop_when=action_block_complete), PLAN)
+            self.assertGreater(agent.engine.request_serializer.stats()[0], 0)
+        finally:
+            server.shutdown()
+
+    def anthropic_agent(self, server):
+        agent = LMMAgent(
+            {
+                "engine_type": "anthropic",
+                "model": "claude",
+                "api_key": "x",
+                "incremental_serialization": True,
+            }
+        )
+        agent.engine.llm_client = Anthropic(
+            api_key="x", base_url="http://127.0.0.1:%d" % server.server_address[1]
+        )
+        agent.add_system_prompt("You are a GUI agent.")
+        agent.add_message("Click OK", role="user")
+        return agent
+
+    def test_anthropic_posts_serialized_bodies(self):
+        server = serve_stub(ReplayScript({"default": [PLAN]}))
+        headers = []
+        do_post = StubHandler.do_POST
+
+        def recording_do_post(handler):
+            headers.append(dict(handler.headers))
+            do_post(handler)
+
+        try:
+            agent = self.anthropic_agent(server)
+            with mock.patch.object(StubHandler, "do_POST", recording_do_post):
+                self.assertEqual(agent.get_response(), PLAN)
+                agent.add_message(PLAN, role="assistant")
+                agent.add_message("Again", role="user")
+                agent.early_stop = True
+                self.assertEqual(
+                    agent.get_response(stop_when=action_block_complete), PLAN
+                )
+            self.assertGreater(agent.engine.request_serializer.stats()[0], 0)
+            self.assertEqual(
+                [h["Content-Type"] for h in headers], ["application/json"] * 2
+            )
+            self.assertTrue(all("anthropic-version" in h for h in headers))
+        finally:
+            server.shutdown()
+
+    def test_falls_back_to_create_without_raw_body_support(self):
+        server = serve_stub(ReplayScript({"default": [PLAN]}))
+        post = Anthropic.post
+
+        def old_sdk_post(client, path, **kwargs):
+            # SDKs predating raw content bodies reject the argument before sending
+            if "content" in kwargs:
+                raise TypeError("post() got an unexpected keyword argument 'content'")
+            return post(client, path, **kwargs)
+
+        try:
+            agent = self.anthropic_agent(server)
+            with mock.patch.object(Anthropic, "post", old_sdk_post):
+                self.assertEqual(agent.get_response(), PLAN)
+            self.assertIsNone(agent.engine.request_serializer)
+        finally:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from gui_agents.s3.core.engine import LMMEngineAnthropic, LMMEngineOpenAI
+from gui_agents.s3.core.rate_limiter import RateLimiter
+from gui_agents.s3.core.telemetry import collect_llm_calls, track_llm_call
+from gui_agents.s3.utils.common_utils import (
+    action_block_complete,
+    answer_block_complete,
+)
+
+
+def chunk(text):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None
+    )
+
+
+def usage_chunk(prompt_tokens, completion_tokens):
+    return SimpleNamespace(
+        choices=[],
+        usage=SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        ),
+    )
+
+
+class TestStreamingEarlyStop(unittest.TestCase):
+    def test_action_block_complete(self):
+        self.assertFalse(action_block_complete("(Next Action)\nClick OK"))
+        self.assertFalse(action_block_complete("```python\nagent.click('OK'"))
+        # Closed block whose call is cut off is not complete yet
+        self.assertFalse(action_block_complete("```python\nagent.click('OK',\n```"))
+        self.assertFalse(action_block_complete("```python\nprint('OK')\n```"))
+        self.assertTrue(
+            action_block_complete("Reasoning\n```python\nagent.click('OK', 1)\n```")
+        )
+
+    def test_answer_block_complete(self):
+        self.assertFalse(answer_block_complete("<thoughts>```python\n```"))
+        self.assertFalse(answer_block_complete("<answer>\n```python\nprint(1)"))
+        self.assertTrue(answer_block_complete("<answer>\n```bash\nls\n```"))
+        self.assertTrue(answer_block_complete("<answer>\nDONE\n</answer>"))
+
+    def test_generate_stops_reading_once_action_is_complete(self):
+        engine = LMMEngineOpenAI(model="gpt-4o", api_key="sk-test")
+        stream = MagicMock()
+        stream.__iter__.return_value = iter(
+            [
+                chunk("I will click OK.\n```python\nagent.click("),
+                chunk("'OK')\n```"),
+                chunk("\nThis should complete the task."),
+            ]
+        )
+        engine.llm_client = MagicMock()
+        engine.llm_client.chat.completions.create.return_value = stream
+
+        response = engine.generate(
+            [{"role": "user", "content": "Click OK"}],
+            stop_when=action_block_complete,
+        )
+
+        self.assertEqual(
+            response, "I will click OK.\n```python\nagent.click('OK')\n```"
+        )
+        stream.close.assert_called_once()
+        _, params = engine.llm_client.chat.completions.create.call_args
+        self.assertTrue(params["stream"])
+        self.assertEqual(params["stream_options"], {"include_usage": True})
+
+    def test_streamed_usage_is_recorded_and_settled(self):
+        engine = LMMEngineOpenAI(model="gpt-4o", api_key="sk-test")
+        engine.llm_client = MagicMock()
+        messages = [{"role": "user", "content": "Click OK"}]
+
+        def generate(chunks):
+            stream = MagicMock()
+            stream.__iter__.return_value = iter(chunks)
+            engine.llm_client.chat.completions.create.return_value = stream
+            with collect_llm_calls() as calls, track_llm_call("generator", "gpt-4o"):
+                engine.generate(messages, stop_when=action_block_complete)
+            return calls[0]
+
+        with patch.object(RateLimiter, "adjust") as adjust:
+            # A stream read to its end reports the provider's usage
+            call = generate([chunk("Thinking about it."), usage_chunk(120, 8)])
+            self.assertEqual(
+                (call["prompt_tokens"], call["completion_tokens"]), (120, 8)
+            )
+            self.assertNotIn("usage_estimated", call)
+            # A stream dropped early has its usage estimated
+            call = generate(
+                [chunk("```python\nagent.click('OK')\n```"), usage_chunk(120, 50)]
+            )
+            self.assertTrue(call["usage_estimated"])
+            self.assertGreater(call["completion_tokens"], 0)
+        self.assertEqual(adjust.call_count, 2)
+
+    def test_anthropic_usage_parts_are_merged(self):
+        engine = LMMEngineAnthropic(model="claude-sonnet-4-5", api_key="x")
+        events = [
+            SimpleNamespace(
+                type="message_start",
+                message=SimpleNamespace(
+                    usage=SimpleNamespace(
+                        input_tokens=100, output_tokens=1, cache_read_input_tokens=80
+                    )
+                ),
+            ),
+            SimpleNamespace(
+                type="content_block_delta",
+                delta=SimpleNamespace(type="text_delta", text="Thinking about it."),
+            ),
+            SimpleNamespace(
+                type="message_delta", usage=SimpleNamespace(output_tokens=20)
+            ),
+        ]
+        stream = MagicMock()
+        stream.__iter__.return_value = iter(events)
+        engine.llm_client = MagicMock()
+        engine.llm_client.messages.create.return_value = stream
+        with collect_llm_calls() as calls, track_llm_call("generator", "claude"):
+            engine.generate(
+                [
+                    {"role": "system", "content": [{"type": "text", "text": "s"}]},
+                    {"role": "user", "content": [{"type": "text", "text": "Go"}]},
+                ],
+                stop_when=action_block_complete,
+            )
+        self.assertEqual(
+            (
+                calls[0]["prompt_tokens"],
+                calls[0]["completion_tokens"],
+                calls[0]["cached_tokens"],
+            ),
+            (100, 20, 80),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
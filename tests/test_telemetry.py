@@ -0,0 +1,44 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from gui_agents.s3.core.mllm import LMMAgent
+from gui_agents.s3.core.telemetry import collect_llm_calls, summarize_llm_calls
+
+
+class TestTelemetry(unittest.TestCase):
+    def test_calls_are_recorded_with_role_and_usage(self):
+        agent = LMMAgent(
+            engine_params={"engine_type": "openai", "model": "gpt-4o", "api_key": "x"},
+            role="reflection",
+        )
+        agent.engine.llm_client = MagicMock()
+        agent.engine.llm_client.chat.completions.create.return_value = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="Looks fine"))],
+            usage=SimpleNamespace(
+                prompt_tokens=1200,
+                completion_tokens=30,
+                total_tokens=1230,
+                prompt_tokens_details=SimpleNamespace(cached_tokens=1024),
+            ),
+        )
+        agent.add_message("Reflect on the trajectory")
+
+        with collect_llm_calls() as calls:
+            self.assertEqual(agent.get_response(), "Looks fine")
+        # Calls outside the block are not collected
+        agent.get_response()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0]["role"], "reflection")
+        self.assertEqual(calls[0]["model"], "gpt-4o")
+        self.assertEqual(calls[0]["prompt_tokens"], 1200)
+        self.assertEqual(calls[0]["cached_tokens"], 1024)
+        self.assertIsNotNone(calls[0]["latency"])
+        summary = summarize_llm_calls(calls)
+        self.assertEqual(summary["reflection"]["calls"], 1)
+        self.assertEqual(summary["reflection"]["completion_tokens"], 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
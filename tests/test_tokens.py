@@ -0,0 +1,71 @@
+import base64
+import unittest
+from io import BytesIO
+
+from PIL import Image
+
+from gui_agents.s3.core.tokens import ContextPacker, TokenCounter, image_tokens
+
+
+def _screenshot_url(size=(1920, 1080)):
+    output = BytesIO()
+    Image.new("RGB", size).save(output, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(output.getvalue()).decode()
+
+
+def _user(text, image_url=None):
+    content = [{"type": "text", "text": text}]
+    if image_url:
+        content.append({"type": "image_url", "image_url": {"url": image_url}})
+    return {"role": "user", "content": content}
+
+
+def _assistant(text):
+    return {"role": "assistant", "content": [{"type": "text", "text": text}]}
+
+
+class TestTokens(unittest.TestCase):
+    def test_image_tokens_per_provider(self):
+        # 1920x1080 is scaled to 1365x768, three by two tiles
+        self.assertEqual(image_tokens("openai", 1920, 1080), 85 + 170 * 6)
+        self.assertEqual(image_tokens("openai", 1920, 1080, "low"), 85)
+        self.assertEqual(image_tokens("anthropic", 1000, 750), 1000)
+        self.assertEqual(image_tokens("gemini", 1920, 1080), 258 * 6)
+
+    def test_counts_are_memoized_per_message(self):
+        counter = TokenCounter("openai")
+        message = _user("hello", _screenshot_url())
+        tokens = counter.message_tokens(message)
+        self.assertGreater(tokens, 85 + 170 * 6)
+        counter._count = None  # a memo hit never recounts
+        self.assertEqual(counter.message_tokens(message), tokens)
+
+    def test_packer_strips_images_then_drops_turns(self):
+        counter = TokenCounter("openai")
+        url = _screenshot_url()
+        system = {"role": "system", "content": [{"type": "text", "text": "sys"}]}
+        messages = [system]
+        for i in range(4):
+            messages += [_user(f"step {i}", url), _assistant(f"action {i}")]
+        messages.append(_user("latest", url))
+
+        short = messages[:3]
+        self.assertIs(ContextPacker(counter, max_tokens=10_000).pack(short), short)
+
+        # Dropping the three oldest images is enough
+        packed = ContextPacker(counter, max_tokens=3_000).pack(messages)
+        self.assertEqual(len(packed), len(messages))
+        images = [len(m["content"]) == 2 for m in packed]
+        self.assertEqual(images, [False] * 7 + [True, False, True])
+        # The originals are untouched
+        self.assertEqual(len(messages[1]["content"]), 2)
+
+        packed = ContextPacker(counter, max_tokens=1_300).pack(messages)
+        self.assertIs(packed[0], system)
+        self.assertIs(packed[-1], messages[-1])
+        self.assertEqual(packed[1]["role"], "user")
+        self.assertLessEqual(counter.messages_tokens(packed), 1_300)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+from types import SimpleNamespace
+
+from gui_agents.s3.agents.worker import Worker
+from gui_agents.s3.core.trajectory import TrajectoryStore
+
+SYSTEM = {"role": "system", "content": [{"type": "text", "text": "system"}]}
+
+
+def user_turn(step):
+    return {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": f"step {step}"},
+            {
+                "type": "image_url",
+                "image_url": {"url": f"data:image/png;base64,{step}"},
+            },
+        ],
+    }
+
+
+def assistant_turn(step):
+    return {"role": "assistant", "content": [{"type": "text", "text": f"plan {step}"}]}
+
+
+def images(messages):
+    return [
+        item["image_url"]["url"]
+        for message in messages
+        for item in message["content"]
+        if item["type"] == "image_url"
+    ]
+
+
+class TestTrajectoryStore(unittest.TestCase):
+    def test_image_window_keeps_all_text_and_latest_images(self):
+        store = TrajectoryStore(max_images=3)
+        store.reset(SYSTEM)
+        for step in range(10):
+            store.append(user_turn(step))
+            store.append(assistant_turn(step))
+        rendered = store.render()
+        self.assertEqual(len(rendered), 21)
+        self.assertEqual(
+            images(rendered), [f"data:image/png;base64,{s}" for s in (7, 8, 9)]
+        )
+        # Originals are kept for logging, and the frozen prefix is not rebuilt per render
+        self.assertEqual(len(images(store.turns)), 10)
+        self.assertIs(store.render()[1], rendered[1])
+
+    def test_turn_window_drops_whole_rounds(self):
+        store = TrajectoryStore(max_turns=2, turn_size=2)
+        store.reset(SYSTEM)
+        for step in range(5):
+            store.append(user_turn(step))
+            store.append(assistant_turn(step))
+        store.append(user_turn(5))
+        rendered = store.render()
+        self.assertEqual(rendered[0], SYSTEM)
+        self.assertEqual(
+            [m["content"][0]["text"] for m in rendered[1:]],
+            ["step 3", "plan 3", "step 4", "plan 4", "step 5"],
+        )
+
+    def test_turn_window_matches_flush_messages(self):
+        # Worker.flush_messages dropped the oldest turn after each step once the history
+        # exceeded turn_size * max_trajectory_length + 1 messages
+        worker = SimpleNamespace(
+            engine_params={"engine_type": "vllm"}, max_trajectory_length=8
+        )
+        for turn_size in (1, 2):
+            store = Worker._trajectory_store(worker, turn_size)
+            store.reset(SYSTEM)
+            baseline = [SYSTEM]
+            for step in range(20):
+                store.append(user_turn(step))
+                baseline.append(user_turn(step))
+                self.assertEqual(store.render(), baseline, (turn_size, step))
+                if turn_size == 2:
+                    store.append(assistant_turn(step))
+                    baseline.append(assistant_turn(step))
+                if len(baseline) > turn_size * 8 + 1:
+                    del baseline[1 : 1 + turn_size]
+
+
+if __name__ == "__main__":
+    unittest.main()
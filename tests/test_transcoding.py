@@ -0,0 +1,72 @@
+import unittest
+from io import BytesIO
+
+from PIL import Image
+
+from gui_agents.s3.core.image_encoding import detect_media_type
+from gui_agents.s3.utils.transcoding import ScreenshotTranscoder
+
+from helpers import make_aci
+
+
+def screenshot(size=(1920, 1080)):
+    output = BytesIO()
+    Image.new("RGB", size, (30, 120, 200)).save(output, format="PNG")
+    return output.getvalue()
+
+
+class TestScreenshotTranscoder(unittest.TestCase):
+    def test_grounding_variant_fits_model_resolution(self):
+        transcoder = ScreenshotTranscoder.from_engine_params(
+            {
+                "grounding_width": 1000,
+                "grounding_height": 1000,
+                "grounding_resize": True,
+            },
+            resize=True,
+        )
+        source = screenshot()
+        variant = transcoder(source)
+        # Scaled into the bound, keeping the aspect ratio
+        self.assertEqual(Image.open(BytesIO(variant)).size, (1000, 562))
+        self.assertEqual(detect_media_type(variant), "image/png")
+        # Transcoded once per screenshot
+        self.assertIs(transcoder(source), variant)
+
+    def test_resize_is_opt_in(self):
+        source = screenshot()
+        transcoder = ScreenshotTranscoder.from_engine_params(
+            {"grounding_width": 1000, "grounding_height": 562}, resize=True
+        )
+        self.assertIsNone(transcoder.size)
+        self.assertIs(transcoder(source), source)
+
+    def test_screenshot_of_matching_size_is_passed_through(self):
+        source = screenshot()
+        self.assertIs(ScreenshotTranscoder(size=(1920, 1080))(source), source)
+        # Never scaled up
+        self.assertIs(ScreenshotTranscoder(size=(2560, 1440))(source), source)
+
+    def test_grounding_coordinates_follow_the_sent_image(self):
+        aci = make_aci(
+            grounding_width=1000, grounding_height=1000, grounding_resize=True
+        )
+        self.assertEqual(aci.grounding_space, (1000, 562))
+        self.assertEqual(aci.resize_coordinates([500, 281]), [960, 540])
+
+    def test_planner_variant_format(self):
+        source = screenshot()
+        self.assertIs(ScreenshotTranscoder.from_engine_params({})(source), source)
+        variant = ScreenshotTranscoder(image_format="webp", quality=80)(source)
+        self.assertEqual(detect_media_type(variant), "image/webp")
+        self.assertEqual(Image.open(BytesIO(variant)).size, (1920, 1080))
+        jpeg = ScreenshotTranscoder(image_format="jpeg")(source)
+        self.assertEqual(detect_media_type(jpeg), "image/jpeg")
+
+    def test_unknown_format_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ScreenshotTranscoder(image_format="bmp")
+
+
+if __name__ == "__main__":
+    unittest.main()